@@ -0,0 +1,120 @@
+"""
+Pipelined batch parsing for finding aids. Instead of running every file
+through XML -> NLP -> SearchWorks in turn, each step is its own asyncio stage
+and the stages are joined by bounded queues:
+
+    read/extract -> NLP (batched) -> URL lookup (concurrent) -> write
+
+so one file's lookup waits on the network while later files are parsed and
+run through spaCy. A full queue makes the stage feeding it wait, which keeps
+memory bounded and lets the batch run at the speed of its slowest stage.
+
+The blocking work runs on executor threads: one for XML, one for spaCy, and
+up to lookup_concurrency for SearchWorks requests through the client's pooled
+session. Records that share a title share one lookup. Rows are written in
+input order, and the same metrics stages are recorded as in the phased path
+(ead.file per file, ead.lookup per distinct title).
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from Metrics import metrics
+
+_DONE = object()
+
+
+def _parse_file(parser, file):
+    with metrics.file('ead.file', file.name):
+        return parser.extract_fields(parser.read_root(file), file.name)
+
+
+async def _read(parser, files, loop, xml_pool, outbox):
+    for index, file in enumerate(files):
+        record = await loop.run_in_executor(xml_pool, _parse_file, parser, file)
+        await outbox.put((index, file, record))
+    await outbox.put(_DONE)
+
+
+async def _nlp(parser, loop, nlp_pool, inbox, outbox, batch_size):
+    # takes whatever is waiting, up to batch_size, so spaCy still sees batches
+    # without holding records back when the queue runs dry
+    done = False
+    while not done:
+        batch = [await inbox.get()]
+        while len(batch) < batch_size and not inbox.empty():
+            batch.append(inbox.get_nowait())
+        if batch[-1] is _DONE:
+            batch.pop()
+            done = True
+        if batch:
+            records = await loop.run_in_executor(
+                nlp_pool, lambda: parser.batch_nlp([record for _, _, record in batch], batch_size=batch_size))
+            for (index, file, _), record in zip(batch, records):
+                await outbox.put((index, file, record))
+    await outbox.put(_DONE)
+
+
+async def _lookup(parser, loop, lookup_pool, inbox, outbox, concurrency):
+    # one future per title, awaited by every record that has it, so a title
+    # is only looked up once however many files share it
+    lookups = {}
+
+    async def resolve(label):
+        with metrics.stage('ead.lookup'):
+            return await loop.run_in_executor(lookup_pool, parser.lookup_url, label)
+
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # pass the end on to the other workers
+                await inbox.put(_DONE)
+                return
+            index, file, record = item
+            if record.label not in lookups:
+                lookups[record.label] = asyncio.ensure_future(resolve(record.label))
+            url = await lookups[record.label]
+            await outbox.put((index, file, record.replace(url=url)))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await outbox.put(_DONE)
+
+
+async def _write(inbox, writer, on_done):
+    waiting = {}
+    next_index = 0
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            break
+        index, file, record = item
+        waiting[index] = (file, record)
+        while next_index in waiting:
+            file, record = waiting.pop(next_index)
+            writer.write(record)
+            writer.file_done(file)
+            next_index += 1
+            if on_done: on_done()
+
+
+async def _run(parser, files, writer, on_done, queue_size, batch_size, lookup_concurrency):
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(3)]
+    with ThreadPoolExecutor(1, thread_name_prefix='xml') as xml_pool, \
+            ThreadPoolExecutor(1, thread_name_prefix='nlp') as nlp_pool, \
+            ThreadPoolExecutor(lookup_concurrency, thread_name_prefix='lookup') as lookup_pool:
+        await asyncio.gather(
+            _read(parser, files, loop, xml_pool, queues[0]),
+            _nlp(parser, loop, nlp_pool, queues[0], queues[1], batch_size),
+            _lookup(parser, loop, lookup_pool, queues[1], queues[2], lookup_concurrency),
+            _write(queues[2], writer, on_done))
+
+
+def run_pipeline(parser, files, writer, on_done=None, queue_size=64, batch_size=64, lookup_concurrency=None):
+    """Parses files with a FindingAidParser through the staged pipeline,
+    writing each row to writer in input order. on_done() is called as each
+    row is written."""
+    if lookup_concurrency is None:
+        lookup_concurrency = parser.searchworks.max_workers
+    asyncio.run(_run(parser, files, writer, on_done, queue_size, batch_size, max(1, lookup_concurrency)))
@@ -0,0 +1,361 @@
+"""
+Headless batch runner: parses every XML file it is pointed at and writes one
+table per format to an output directory, without the Streamlit front end.
+
+    python -m BatchRunner ~/corpus 'exports/*.xml' dump.zip old.tar.gz one.xml.gz \
+        --output-dir out --format csv.gz --workers 4
+
+Inputs can be XML files, directories (searched recursively), glob patterns,
+.zip/.tar archives and gzip-compressed .xml.gz files, in any mix. Each file is
+sent to the right parser by its root namespace, just like an upload; a file
+whose root can't be read is reported and skipped.
+
+With --service, the job is handed to a running ParseService instead, which
+already has the parsers loaded:
+
+    python -m BatchRunner ~/corpus --output-dir out --service --priority 5
+"""
+
+import argparse
+import glob
+import gzip
+import os
+import sys
+import tarfile
+import zipfile
+
+from LookupCache import DEFAULT_CACHE_PATH
+from Metrics import metrics
+from ParseManifest import DEFAULT_MANIFEST_PATH, ParseManifest
+from ParseService import DEFAULT_URL as DEFAULT_SERVICE_URL, ParseClient
+from InputFiles import NamedBuffer, open_local
+from WorkerPool import reuse_pools
+from Writers import OUTPUT_FORMATS, OutputDirectory
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_xml(name):
+    return name.lower().endswith(('.xml', '.xml.gz'))
+
+
+def is_archive(name):
+    return name.lower().endswith(('.zip',) + TAR_EXTENSIONS)
+
+
+def member_opener(name, read):
+    # archive members and .gz files are held in memory one chunk at a time
+    name = os.path.basename(name)
+
+    def opener():
+        data = read()
+        if name.lower().endswith('.gz'):
+            data = gzip.decompress(data)
+            return NamedBuffer(data, name[:-3])
+        return NamedBuffer(data, name)
+    return opener
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def archive_sources(path):
+    # Members are read as they are reached: compressed tars can only be read
+    # front to back, and the archive is closed before the chunk holding its
+    # last members is parsed.
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_xml(info.filename):
+                    data = archive.read(info)
+                    yield info.filename, member_opener(info.filename, lambda data=data: data)
+    else:
+        with tarfile.open(path) as archive:
+            for info in archive:
+                if info.isfile() and is_xml(info.name):
+                    data = archive.extractfile(info).read()
+                    yield info.name, member_opener(info.name, lambda data=data: data)
+
+
+def archive_members(path):
+    """Names of the XML files in an archive, without reading them."""
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir() and is_xml(info.filename)]
+    with tarfile.open(path) as archive:
+        return [info.name for info in archive if info.isfile() and is_xml(info.name)]
+
+
+def path_sources(path):
+    if is_archive(path):
+        yield from archive_sources(path)
+    elif path.lower().endswith('.gz'):
+        yield path, member_opener(path, lambda: read_file(path))
+    else:
+        yield path, lambda: open_local(path)
+
+
+def input_paths(inputs, warn=True):
+    """Expands inputs into the XML files and archives they name: directories
+    are searched recursively and glob patterns matched. Anything else is left
+    out, with a warning when it was named outright."""
+    for pattern in inputs:
+        if os.path.exists(pattern):
+            paths = [pattern]
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True))
+            if not paths and warn:
+                print("No files match %s" % pattern, file=sys.stderr)
+        for path in paths:
+            if not os.path.isdir(path):
+                if is_xml(path) or is_archive(path):
+                    yield path
+                elif warn and path == pattern:
+                    print("Skipping %s: not an .xml or .xml.gz file or an archive" % path, file=sys.stderr)
+                continue
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if is_xml(filename) or is_archive(filename):
+                        yield os.path.join(directory, filename)
+
+
+def collect_sources(inputs):
+    """Expands inputs into (name, opener) pairs, one per XML file. Nothing is
+    opened yet; opener() returns a named, seekable binary file."""
+    for path in input_paths(inputs):
+        yield from path_sources(path)
+
+
+def count_sources(inputs):
+    """How many files collect_sources(inputs) yields. Archives are counted
+    from their member lists; compressed tars still have to be read through
+    for that."""
+    return sum(len(archive_members(path)) if is_archive(path) else 1 for path in input_paths(inputs, warn=False))
+
+
+class ConsoleProgress:
+    """Stands in for st.progress when there's no page to draw on."""
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.last = -1
+        self.count = 0
+        self.shown = False
+
+    def progress(self, value):
+        percent = int(min(max(value, 0), 1) * 100)
+        if percent != self.last:
+            self.last = percent
+            self.show()
+
+    def done(self, count):
+        self.count = count
+        self.show()
+
+    def show(self):
+        print("\r%3d%%  %d files parsed" % (max(self.last, 0), self.count), end='', file=self.stream, flush=True)
+        self.shown = True
+
+    def close(self):
+        if self.shown:
+            print(file=self.stream)
+
+
+class ChunkProgress:
+    """Passes one chunk's progress on as progress through the whole run: the
+    chunk starts at start and covers share of it."""
+    def __init__(self, progress, start, share):
+        self.target = progress
+        self.start = start
+        self.share = share
+
+    def progress(self, value):
+        self.target.progress(self.start + min(max(value, 0), 1) * self.share)
+
+
+def report_skipped(name, error):
+    print("\nSkipping %s: %s" % (name, error), file=sys.stderr)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(inputs, output_dir, output_format='csv', workers=None, chunk_files=500, model_path=None, offline=False, quiet=False, manifest_path=None, metrics_dir=None, pipelined=False, progress=None, lookup_cache_path=DEFAULT_CACHE_PATH):
+    """Parses everything in inputs into output_dir and returns (format label,
+    path) pairs. Files are opened chunk_files at a time so a large corpus never
+    holds more than one chunk open or in memory; every chunk appends to the
+    same output tables. With manifest_path, only files that changed since an
+    earlier run with the same manifest are parsed; see ParseManifest. With
+    metrics_dir, stage timings are written there as metrics.json and
+    metrics.prom. progress, if given, replaces the console progress: it's
+    called with progress(fraction) of the whole run as files are parsed,
+    done(count) with the files parsed so far after each chunk, and close()
+    at the end. SearchWorks answers are cached in lookup_cache_path (None for
+    no cache)."""
+    # imported here so --help doesn't wait on spaCy
+    from Parser import get_parser
+    from ModelCache import DEFAULT_MODEL_PATH
+
+    parser = get_parser(
+        show_progress=False, model_path=model_path or DEFAULT_MODEL_PATH, lookup_cache_path=lookup_cache_path)
+    parser.finding_aid_parser.searchworks.offline = offline
+    parser.finding_aid_parser.pipelined = pipelined
+    manifest = ParseManifest(manifest_path) if manifest_path else None
+    outputs = OutputDirectory(output_dir, output_format)
+    if progress is None and not quiet:
+        progress = ConsoleProgress()
+    total = count_sources(inputs) if progress is not None else 0
+    count = 0
+    # service workers run one job after another, so timings asked for by one
+    # job are switched off again for the next
+    metrics_enabled = metrics.enabled
+    if metrics_dir:
+        metrics.reset()
+        metrics.enable()
+    try:
+        # worker processes, if any, are started on the first chunk and kept
+        # for the rest
+        with reuse_pools():
+            for chunk in chunked(collect_sources(inputs), chunk_files):
+                files = [opener() for name, opener in chunk]
+                chunk_progress = None
+                if progress is not None and total:
+                    chunk_progress = ChunkProgress(progress, count / total, len(files) / total)
+                try:
+                    parser.parse_files(
+                        files, workers=workers, writer_factory=outputs, progress_bar=chunk_progress, manifest=manifest,
+                        on_skip=None if quiet else report_skipped)
+                finally:
+                    for file in files:
+                        file.close()
+                count += len(files)
+                if progress is not None:
+                    if total:
+                        progress.progress(count / total)
+                    progress.done(count)
+    finally:
+        metrics.enabled = metrics_enabled
+        if progress is not None:
+            progress.close()
+        paths = outputs.close()
+        lookup_cache = parser.finding_aid_parser.searchworks.cache
+        if lookup_cache is not None:
+            lookup_cache.commit()
+        if manifest is not None:
+            if not quiet:
+                print("%d files unchanged, %d parsed" % (manifest.hits, manifest.misses), file=sys.stderr)
+            manifest.close()
+        if metrics_dir:
+            for path in metrics.write(metrics_dir):
+                if not quiet:
+                    print("Timings written to %s" % path, file=sys.stderr)
+    return paths
+
+
+def run_on_service(url, inputs, output_dir, quiet=False, **options):
+    """Like run, but hands the job to the ParseService at url and follows its
+    progress. options are ParseService.JOB_OPTIONS."""
+    client = ParseClient(url)
+    job = client.submit(inputs, output_dir, **options)
+    progress = None if quiet else ConsoleProgress()
+    files_parsed = 0
+
+    def show(job):
+        nonlocal files_parsed
+        if progress is None:
+            return
+        if job['files_parsed'] != files_parsed:
+            files_parsed = job['files_parsed']
+            progress.done(files_parsed)
+        elif job['state'] == 'running':
+            progress.progress(job['progress'])
+
+    if not quiet:
+        print("Submitted job %s" % job['id'], file=sys.stderr)
+    try:
+        job = client.wait(job['id'], on_update=show)
+    finally:
+        if progress is not None:
+            progress.close()
+    if job['state'] != 'done':
+        raise RuntimeError("job %s %s\n%s" % (job['id'], job['state'], job['error'] or ''))
+    return [tuple(output) for output in job['outputs']]
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(
+        description="Parse EAD finding aids, MODS and MARCXML into tables without the web front end.")
+    arguments.add_argument('inputs', nargs='+', help="XML files, directories, glob patterns, .zip/.tar archives or .xml.gz files")
+    arguments.add_argument('-o', '--output-dir', required=True, help="directory the tables are written to")
+    arguments.add_argument('-f', '--format', default='csv', choices=list(OUTPUT_FORMATS), help="output format (default csv)")
+    arguments.add_argument('-w', '--workers', type=int, default=None, help="worker processes (default 1)")
+    arguments.add_argument('--chunk-files', type=int, default=500, help="files opened at a time (default 500)")
+    arguments.add_argument('--model', default=None, help="spaCy model directory (default ./models/en/)")
+    arguments.add_argument('--offline', action='store_true', help="don't query SearchWorks for finding aid URLs")
+    arguments.add_argument('--pipelined', action='store_true',
+                           help="overlap finding aid parsing, NLP and SearchWorks lookups")
+    arguments.add_argument('--lookup-cache', default=DEFAULT_CACHE_PATH, metavar='PATH',
+                           help="where SearchWorks answers are cached between runs (default %s)" % DEFAULT_CACHE_PATH)
+    arguments.add_argument('--manifest', default=None, metavar='PATH',
+                           help="only re-parse files that changed since the last run with this manifest, e.g. %s" % DEFAULT_MANIFEST_PATH)
+    arguments.add_argument('--metrics', default=None, metavar='DIR',
+                           help="record stage timings and write them to DIR as JSON and Prometheus text")
+    arguments.add_argument('--service', nargs='?', const=DEFAULT_SERVICE_URL, default=None, metavar='URL',
+                           help="submit the job to a running ParseService (default %s) instead of parsing here" % DEFAULT_SERVICE_URL)
+    arguments.add_argument('--priority', type=int, default=0, help="with --service, higher runs sooner (default 0)")
+    arguments.add_argument('-q', '--quiet', action='store_true', help="no progress output")
+    args = arguments.parse_args(argv)
+
+    if args.service:
+        if args.workers or args.model or args.lookup_cache != DEFAULT_CACHE_PATH:
+            print("--workers, --model and --lookup-cache are set by the service and ignored here", file=sys.stderr)
+        try:
+            paths = run_on_service(
+                args.service,
+                args.inputs,
+                args.output_dir,
+                quiet=args.quiet,
+                format=args.format,
+                priority=args.priority,
+                chunk_files=args.chunk_files,
+                offline=args.offline,
+                pipelined=args.pipelined,
+                manifest=os.path.abspath(args.manifest) if args.manifest else None,
+                metrics_dir=os.path.abspath(args.metrics) if args.metrics else None)
+        except (OSError, RuntimeError, ValueError) as error:
+            print("Parse service: %s" % error, file=sys.stderr)
+            return 1
+    else:
+        paths = run(
+            args.inputs,
+            args.output_dir,
+            output_format=args.format,
+            workers=args.workers,
+            chunk_files=args.chunk_files,
+            model_path=args.model,
+            offline=args.offline,
+            quiet=args.quiet,
+            manifest_path=args.manifest,
+            metrics_dir=args.metrics,
+            pipelined=args.pipelined,
+            lookup_cache_path=args.lookup_cache)
+    if not paths:
+        print("No finding aid, MODS or MARC files found", file=sys.stderr)
+        return 1
+    for label, path in paths:
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
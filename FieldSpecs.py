@@ -0,0 +1,174 @@
+"""
+Declarative field extraction shared by the parsers. Each output column is a
+FieldSpec:
+
+    column      name of the value in the extracted record
+    path        element to match, e.g. 'datafield[@tag="245"]' or 'titleInfo';
+                '*' isn't allowed here
+    child       child of the matched element to read, same syntax as path;
+                '*' for every child, None for the element itself
+    occurrence  which match of path to use (0 is the first), None for all
+    select      'last', 'first', 'join' (with separator), 'list' of texts, or
+                'elements' to hand the matched elements to custom code
+    post        post-processing steps, names from POST_PROCESSORS or callables
+
+compile_specs() turns a list of specs into a FieldExtractor, which walks the
+tree once, keeping only the elements some spec asks for, and then fills in
+every column from what it kept.
+"""
+
+import re
+import string
+from collections import namedtuple
+
+FieldSpec = namedtuple(
+    'FieldSpec',
+    ['column', 'path', 'child', 'occurrence', 'select', 'separator', 'post'],
+    defaults=(None, 0, 'last', ' ', ()))
+
+
+def reverse_name(name):
+    """'Last, First,' -> 'First Last'"""
+    name = name.strip(',')
+    name = name.split(',')
+    name.reverse()
+    return ' '.join(name).strip()
+
+
+def reverse_primary_name(name):
+    name = name.split(', ')
+    name.reverse()
+    return ' '.join(name)
+
+
+POST_PROCESSORS = {
+    'strip': lambda value: value.strip(),
+    'strip_commas': lambda value: value.strip(','),
+    'reverse_name': reverse_name,
+    'reverse_primary_name': reverse_primary_name,
+    'strip_punctuation': lambda value: value.translate(str.maketrans('', '', string.punctuation)),
+    'remove_line_breaks': lambda value: value.replace('\n', '').replace('\r', ''),
+    'collapse_indents': lambda value: re.sub('\\n\\s*', '', value),
+    'remove_dashes_and_dots': lambda value: value.replace('-', '').replace('.', ''),
+}
+
+_PATH = re.compile(r'^([\w.*-]+)((?:\[@[\w:-]+="[^"]*"\])*)$')
+_PREDICATE = re.compile(r'\[@([\w:-]+)="([^"]*)"\]')
+
+_Compiled = namedtuple(
+    '_Compiled',
+    ['column', 'matcher', 'child', 'occurrence', 'select', 'separator', 'post'])
+
+
+def _compile_path(path, namespace):
+    m = _PATH.match(path)
+    if not m:
+        raise ValueError("Unsupported field path %r" % path)
+    tag = m.group(1) if m.group(1) == '*' else namespace + m.group(1)
+    return (tag, tuple(_PREDICATE.findall(m.group(2))))
+
+
+def _matches(element, tag, predicates):
+    return (tag == '*' or element.tag == tag) and all(element.get(k) == v for k, v in predicates)
+
+
+class FieldExtractor:
+    def __init__(self, specs, namespace, descendants=False):
+        self.specs = []
+        self.descendants = descendants
+        # Each distinct path is matched once per walk, however many columns
+        # read from it. Paths are dispatched on tag and then on the value of
+        # their first attribute, so a record with hundreds of datafields costs
+        # one dict lookup per element rather than one check per spec.
+        matchers = {}
+        self.dispatch = {}
+        for spec in specs:
+            path = _compile_path(spec.path, namespace)
+            if path[0] == '*':
+                # elements are dispatched on their tag, so this would never match
+                raise ValueError("Field path %r for column %r must name an element; '*' is only for child"
+                                 % (spec.path, spec.column))
+            if path not in matchers:
+                matchers[path] = len(matchers)
+                tag, predicates = path
+                plain, keyed = self.dispatch.setdefault(tag, ([], {}))
+                if predicates:
+                    (attribute, value), rest = predicates[0], predicates[1:]
+                    keyed.setdefault(attribute, {}).setdefault(value, []).append((matchers[path], rest))
+                else:
+                    plain.append(matchers[path])
+            child = _compile_path(spec.child, namespace) if spec.child else None
+            post = tuple(POST_PROCESSORS[p] if isinstance(p, str) else p for p in spec.post)
+            self.specs.append(_Compiled(
+                spec.column, matchers[path], child, spec.occurrence, spec.select, spec.separator, post))
+        self.matcher_count = len(matchers)
+        # lxml can skip every other tag in C while walking
+        self.tags = tuple(self.dispatch)
+        self.columns = [spec.column for spec in self.specs]
+
+    def collect(self, root):
+        """The single walk: for every distinct path, the elements matching it
+        in document order. Only root's children are visited unless the
+        extractor was compiled with descendants=True."""
+        found = [[] for _ in range(self.matcher_count)]
+        dispatch = self.dispatch
+        if hasattr(root, 'iterchildren'):
+            # lxml, which filters on tag before building element objects
+            if not self.tags:
+                return found
+            elements = root.iter(*self.tags) if self.descendants else root.iterchildren(*self.tags)
+        else:
+            elements = root.iter() if self.descendants else root
+        for element in elements:
+            entry = dispatch.get(element.tag)
+            if entry is None:
+                continue
+            plain, keyed = entry
+            for matcher in plain:
+                found[matcher].append(element)
+            for attribute, by_value in keyed.items():
+                for matcher, rest in by_value.get(element.get(attribute), ()):
+                    if all(element.get(k) == v for k, v in rest):
+                        found[matcher].append(element)
+        return found
+
+    def extract(self, root):
+        found = self.collect(root)
+        return {spec.column: self.value(spec, found) for spec in self.specs}
+
+    def value(self, spec, found):
+        matches = found[spec.matcher]
+        if spec.occurrence is not None:
+            matches = matches[spec.occurrence:spec.occurrence + 1]
+        items = matches
+        if spec.child:
+            tag, predicates = spec.child
+            if matches and hasattr(matches[0], 'iterchildren') and tag != '*':
+                # lxml: only children with the tag are turned into elements
+                items = [c for m in matches for c in m.iterchildren(tag)
+                         if all(c.get(k) == v for k, v in predicates)]
+            else:
+                items = [c for m in matches for c in m if _matches(c, tag, predicates)]
+
+        if spec.select == 'elements':
+            return items
+
+        texts = [node.text for item in items for node in item.iter()]
+        if spec.select == 'last':
+            value = (texts[-1] if texts else '') or ''
+        elif spec.select == 'first':
+            value = (texts[0] if texts else '') or ''
+        elif spec.select == 'join':
+            value = spec.separator.join(t for t in texts if t is not None)
+        elif spec.select == 'list':
+            value = [t for t in texts if t is not None]
+        else:
+            raise ValueError("Unknown select %r for column %r" % (spec.select, spec.column))
+
+        for post in spec.post:
+            value = post(value)
+        return value
+
+
+def compile_specs(specs, namespace, descendants=False):
+    return FieldExtractor(specs, namespace, descendants=descendants)
@@ -1,32 +1,99 @@
-import xml.etree.ElementTree as ET
 import datetime
 import re
-import csv
-import glob
-import math
 import os
-from collections import defaultdict
-import requests
-from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
-import string
-import streamlit as st
-import spacy_streamlit
+from WorkerPool import parallel_parse
+from AsyncPipeline import run_pipeline
+from ModelCache import DEFAULT_MODEL_PATH, load_nlp, model_version
+from SearchWorksClient import SearchWorksClient
+from FieldSpecs import FieldSpec, compile_specs
+from NLPCache import Entity, NLPCache
+from Writers import ColumnWriter
+from Metrics import metrics
+from XMLBackend import get_backend
+from Records import FindingAidRecord
+from InputFiles import open_local
 
 
+# Columns read straight from the finding aid, matched anywhere in the tree.
+# Names starting with _ are raw material for getters that need more than a
+# lookup.
+EAD_FIELDS = [
+    FieldSpec('_abstract', 'abstract', occurrence=None, select='join', separator='',
+              post=('strip', 'remove_line_breaks')),
+    FieldSpec('_scopecontent', 'scopecontent', occurrence=None, select='elements'),
+    FieldSpec('title', 'unittitle', select='first', post=('strip_punctuation',)),
+    FieldSpec('_unitid', 'unitid', select='list'),
+    FieldSpec('collection_size', 'physdesc', select='join', post=('collapse_indents',)),
+]
 
 class FindingAidParser:
+    # bump whenever a change alters the rows this parser produces
+    VERSION = '1'
+    # what read_header must have found for the header alone to do, compiled
+    # once per backend (see XMLBackend)
+    HEADER_PATHS = {
+        tag: './/ead:' + tag for tag in ('unittitle', 'unitid', 'physdesc', 'abstract', 'scopecontent')}
 
-    def __init__(self):
-        self.wikidata_xml_mapping = {}
+    def __init__(
+        self,
+        model_path=DEFAULT_MODEL_PATH,
+        sentence_profile='sentences',
+        entity_profile='entities',
+        max_description_chars=2000,
+        searchworks=None,
+        header_only=True,
+        nlp_cache=None,
+        pipelined=False,
+        xml_backend=None):
+        self.xml = get_backend(xml_backend)
+        self.header_paths = {tag: self.xml.compile(path) for tag, path in self.HEADER_PATHS.items()}
         self.namespace = "{urn:isbn:1-931666-22-9}"
-        self.nlp = spacy_streamlit.load_model("./models/en/")
+        self.fields = compile_specs(EAD_FIELDS, self.namespace, descendants=True)
+        self.model_path = model_path
+        self.sentence_profile = sentence_profile
+        self.entity_profile = entity_profile
+        # Only the first sentence of a description is kept, so there's no need
+        # to run the pipeline over the rest of a long abstract
+        self.max_description_chars = max_description_chars
+        self.sentence_nlp = load_nlp(model_path, profile=sentence_profile)
+        self.entity_nlp = load_nlp(model_path, profile=entity_profile)
+        # Titles and boilerplate abstracts repeat across a corpus, so each
+        # distinct text only goes through the pipeline once
+        self.nlp_cache = nlp_cache if nlp_cache is not None else NLPCache()
+        self.model_version = model_version(model_path)
+        # lookups are only cached on disk when the caller passes a client
+        # with a LookupCache (Parser does)
+        self.searchworks = searchworks or SearchWorksClient()
+        # Stop reading at <dsc>, since every field comes from the collection
+        # level description that precedes the container list
+        self.header_only = header_only
+        # Overlap parsing, NLP and lookups across files (see AsyncPipeline)
+        # instead of running them phase by phase
+        self.pipelined = pipelined
+
+    def worker_kwargs(self):
+        return {
+            'model_path': self.model_path,
+            'sentence_profile': self.sentence_profile,
+            'entity_profile': self.entity_profile,
+            'max_description_chars': self.max_description_chars,
+            'searchworks': self.searchworks,
+            'header_only': self.header_only,
+            'nlp_cache': self.nlp_cache,
+            'pipelined': self.pipelined,
+            'xml_backend': self.xml.name}
 
-    def clear_dict(self):
-        self.wikidata_xml_mapping = {k : '' for k in self.wikidata_xml_mapping}
+    def version_key(self):
+        """Everything besides the file itself that decides what a row holds."""
+        return '%s model=%s sentence_profile=%s entity_profile=%s header_only=%s max_description_chars=%s offline=%s' % (
+            self.VERSION, self.model_version, self.sentence_profile, self.entity_profile, self.header_only,
+            self.max_description_chars, self.searchworks.offline)
 
-    def __get_namespace(self, element):
-        m = re.match(r'\{.*\}', element.tag)
-        return m.group(0) if m else ''
+    def row_settled(self, row):
+        """Whether a row (as a dict) can be stored for reuse (see
+        ParseManifest): it has a URL, or its blank URL is SearchWorks' answer
+        rather than a lookup that failed."""
+        return row['url'] != '' or self.searchworks.settled(row['label'])
 
     def batch_parse_xml(
         self,
@@ -34,57 +101,196 @@ class FindingAidParser:
         show_progress=True, 
         progress_bar=None, 
         amount_done=0,
-        size=0):
+        size=0,
+        workers=None,
+        batch_size=64,
+        n_process=1,
+        chunk_size=1000,
+        writer=None):
 
-        parsed  = []
+        # the caller closes writers it passes in; ours is closed here
+        own_writer = writer is None
+        writer = writer or ColumnWriter()
         step = 1/size if size > 0 else 0
 
-        for i, file in enumerate(files):
+        def advance():
+            nonlocal amount_done
             amount_done += step 
-            parsed_file = self.parse_xml(file)
-            parsed.append(parsed_file)
             if show_progress and progress_bar: progress_bar.progress(round(amount_done, 1))
-        finding_aid_info = self.combine_parsed_files(parsed)
-        return finding_aid_info     
+
+        if workers and workers > 1:
+            results = parallel_parse(type(self), self.worker_kwargs(), files, workers, on_done=advance)
+            for file, row in zip(files, results):
+                writer.write(row)
+                writer.file_done(file)
+        elif self.pipelined:
+            run_pipeline(self, files, writer, on_done=advance, queue_size=batch_size, batch_size=batch_size)
+        else:
+            # Files go through the phases chunk_size at a time, so only one
+            # chunk of records is ever held before being written out
+            for start in range(0, len(files), chunk_size):
+                chunk = files[start:start + chunk_size]
+                parsed = []
+
+                # Phase 1: pull all the text out of the XML, no NLP yet
+                for file in chunk:
+                    with metrics.file('ead.file', file.name):
+                        parsed.append(self.extract_fields(self.read_root(file), file.name))
+
+                # Phase 2: run each NLP step once over the whole chunk
+                parsed = self.batch_nlp(parsed, batch_size=batch_size, n_process=n_process)
+
+                # Phase 3: look up every URL concurrently
+                with metrics.stage('ead.lookup', len(parsed)):
+                    urls = self.searchworks.lookup_many([r.label for r in parsed], on_done=advance)
+                for file, record, url in zip(chunk, parsed, urls):
+                    writer.write(record.replace(url=url))
+                    writer.file_done(file)
+        return writer.close() if own_writer else writer
     
     def parse_xml(self, file): 
+        res = {}
         if file:
-            self.clear_dict()
-            xmlTree = ET.parse(file)
-            root = xmlTree.getroot()
-            # self.namespace = self.__get_namespace(root)
-            self.get_description(root)
-            self.get_title_and_label(root)
-            self.get_inventory_number(root, file)
-            self.get_collection_creator()
-            self.get_collection_size(root)
-            self.get_url(file)
-            res = self.wikidata_xml_mapping
+            res = self.parse_root(self.read_root(file), file.name)
         return res
 
     def parse_xml_local(self, filepath):
         res = {}
         ext = os.path.splitext(filepath )[-1].lower()
         if ext == '.xml': 
-            self.clear_dict()
-            xmlTree = ET.parse(filepath)
-            root = xmlTree.getroot()
-            # self.namespace = self.__get_namespace(root)
-
-            self.get_description(root)
-            self.get_title_and_label(root)
-            self.get_inventory_number(root, filepath)
-            self.get_collection_creator()
-            self.get_collection_size(root)
-            self.get_url(filepath)
-            res = self.wikidata_xml_mapping
+            # large finding aids are memory-mapped rather than read in chunks
+            with open_local(filepath) as file:
+                res = self.parse_root(self.read_root(file), filepath)
         return res      
 
-    def get_alt_description(self, root):
-        alt_desc = ".//%sscopecontent" % (self.namespace)
-        alt_desc_tag = root.find(alt_desc)
-        if (alt_desc_tag is not None and len(alt_desc_tag) > 0):
-            alt_desc_tag = root.findall(alt_desc)
+    def read_root(self, file):
+        """Returns the root of file's tree, cut off at <dsc> when header_only is
+        set and everything the getters need was found before it."""
+        with metrics.stage('ead.xml_parse'):
+            if self.header_only:
+                root = self.read_header(file)
+                if self.has_header_fields(root):
+                    return root
+                file.seek(0)
+            return self.xml.parse(file)
+
+    def read_header(self, file):
+        """Builds the tree incrementally and stops reading at the first <dsc>.
+        The <dsc> and anything parsed after it are dropped, so the partial tree
+        only holds complete elements from before the container list."""
+        dsc_tag = self.namespace + 'dsc'
+        open_elements = []
+        root = None
+        for event, element in self.xml.iterparse(file, events=('start', 'end')):
+            if event == 'end':
+                open_elements.pop()
+                continue
+            if root is None:
+                root = element
+            if element.tag == dsc_tag and open_elements:
+                # the parser may have read ahead, so trim each open element
+                # back to the branch that leads to <dsc>
+                branch = open_elements + [element]
+                for parent, child in zip(branch, branch[1:]):
+                    del parent[list(parent).index(child):]
+                    if child is not element:
+                        parent.append(child)
+                break
+            open_elements.append(element)
+        return root
+
+    def has_header_fields(self, root):
+        found = lambda tag: len(self.header_paths[tag](root)) > 0
+        return (
+            root is not None
+            and found('unittitle')
+            and found('unitid')
+            and found('physdesc')
+            and (found('abstract') or found('scopecontent')))
+
+    def extract_record(self, root):
+        with metrics.stage('ead.extract'):
+            return self.fields.extract(root)
+
+    def as_record(self, record):
+        # getters take an extracted record, or a bare tree
+        if isinstance(record, dict):
+            return record
+        return self.extract_record(record)
+
+    def extract_fields(self, root, name):
+        """Fills in every field that doesn't need the NLP pipeline or the network."""
+        record = self.extract_record(root)
+        title = self.get_title_and_label(record)
+        return FindingAidRecord(
+            full_description=self.get_full_description(record),
+            description='',
+            title=title,
+            label=title,
+            inventory_number=self.get_inventory_number(record, name),
+            collection_creator='',
+            collection_size=self.get_collection_size(record),
+            url='')
+
+    def batch_nlp(self, records, batch_size=64, n_process=1):
+        """Returns copies of records with description and collection_creator
+        filled in."""
+        descriptions = [self.truncate_description(r.full_description) for r in records]
+        sentences = self.first_sentences(descriptions, batch_size=batch_size, n_process=n_process)
+
+        queries = [self.get_creator_query(r.title) for r in records]
+        found = self.entities([q for q, _ in queries], batch_size=batch_size, n_process=n_process)
+        creators = [self.get_creator_from_entities(ents, andInTitle) for (_, andInTitle), ents in zip(queries, found)]
+
+        missing = [i for i, creator in enumerate(creators) if creator == '']
+        found = self.entities([sentences[i] for i in missing], batch_size=batch_size, n_process=n_process)
+        for i, ents in zip(missing, found):
+            creators[i] = self.get_alt_creator_from_entities(ents)
+
+        return [record.replace(description=sentence, collection_creator=creator)
+                for record, sentence, creator in zip(records, sentences, creators)]
+
+    def sentence_bounds(self, doc):
+        for sent in doc.sents:
+            return (sent.start_char, sent.end_char)
+        return ()
+
+    def entity_spans(self, doc):
+        return tuple((ent.start_char, ent.end_char, ent.label_) for ent in doc.ents)
+
+    def first_sentences(self, texts, batch_size=64, n_process=1):
+        """The first sentence of each text, as get_first_sentence would find it."""
+        bounds = self.nlp_cache.pipe(
+            self.sentence_nlp, texts, self.sentence_bounds,
+            'sentences %s %s' % (self.model_version, self.sentence_profile),
+            batch_size=batch_size, n_process=n_process, stage='nlp.sentences')
+        return [text[b[0]:b[1]] if b else '' for text, b in zip(texts, bounds)]
+
+    def entities(self, texts, batch_size=64, n_process=1):
+        """The named entities in each text, as Entity(text, label_) lists."""
+        spans = self.nlp_cache.pipe(
+            self.entity_nlp, texts, self.entity_spans,
+            'entities %s %s' % (self.model_version, self.entity_profile),
+            batch_size=batch_size, n_process=n_process, stage='nlp.entities')
+        return [[Entity(text[start:end], label) for start, end, label in found] for text, found in zip(texts, spans)]
+
+    def parse_root(self, root, name):
+        record = self.extract_record(root)
+        full_description, description = self.get_description(record)
+        title = self.get_title_and_label(record)
+        return FindingAidRecord(
+            full_description=full_description,
+            description=description,
+            title=title,
+            label=title,
+            inventory_number=self.get_inventory_number(record, name),
+            collection_creator=self.get_collection_creator(title, description),
+            collection_size=self.get_collection_size(record),
+            url=self.get_url(title))
+
+    def get_alt_description(self, record):
+        alt_desc_tag = self.as_record(record)['_scopecontent']
+        if (alt_desc_tag and len(alt_desc_tag[0]) > 0):
             description = []
             for t in alt_desc_tag:
                 for node in t.iter():
@@ -92,37 +298,33 @@ class FindingAidParser:
             return description[2]
         return ''
 
-    def get_description(self, root):
-        abstract = './/%sabstract' % (self.namespace)
-        abstract_tag = root.findall(abstract)
-        description = ""
-        for t in abstract_tag:
-            for node in t.iter():
-                description += node.text
-        description = description.strip()
-        description = description.replace('\n', '').replace('\r', '')
+    def get_full_description(self, record):
+        record = self.as_record(record)
+        description = record['_abstract']
         if description == "":
-            description = self.get_alt_description(root)
-        self.wikidata_xml_mapping['full_description'] = description
+            description = self.get_alt_description(record)
+        return description
+
+    def truncate_description(self, description):
+        if not self.max_description_chars or len(description) <= self.max_description_chars:
+            return description
+        cut = description.rfind(' ', 0, self.max_description_chars)
+        return description[:cut if cut > 0 else self.max_description_chars]
+
+    def get_first_sentence(self, doc):
         first_sentence = ''
-        doc = self.nlp(description)
         for sent in doc.sents:
-            first_sentence = sent
+            first_sentence = sent.text
             break
-        self.wikidata_xml_mapping['description'] = first_sentence
+        return first_sentence
+
+    def get_description(self, record):
+        description = self.get_full_description(record)
+        first_sentence = self.first_sentences([self.truncate_description(description)])[0]
         return (description, first_sentence)
 
-    def get_title_and_label(self, root):
-        unittitle = './/%sunittitle' % (self.namespace)
-        title_tag = root.findall(unittitle)
-        res = []
-        for t in title_tag:
-            for i, node in enumerate(list(t.iter())):
-                res.append(node.text)
-        title = res[0].translate(str.maketrans('','', string.punctuation))
-        self.wikidata_xml_mapping['title'] = title
-        self.wikidata_xml_mapping['label'] = title
-        return title
+    def get_title_and_label(self, record):
+        return self.as_record(record)['title']
 
     def get_alt_inventory_number(self, filepath):
         path = filepath.upper()
@@ -132,32 +334,26 @@ class FindingAidParser:
         match = match.replace('.', '')
         return match
 
-    def get_inventory_number(self, root, filepath):
-        unitid = './/%sunitid' % (self.namespace)
-        inventory_tag = root.findall(unitid)
-        res = []
-        for t in inventory_tag:
-            for node in t.iter():
-                res.append(node.text)
+    def get_inventory_number(self, record, filepath):
+        res = self.as_record(record)['_unitid']
         if len(res) > 0:
             inventory_number = res[0].replace('-', '')
             inventory_number = inventory_number.replace(".", "")
-            self.wikidata_xml_mapping["inventory_number"] = inventory_number
         else:
-            self.wikidata_xml_mapping['inventory_number'] = self.get_alt_inventory_number(filepath)
-        return self.wikidata_xml_mapping['inventory_number']
+            inventory_number = self.get_alt_inventory_number(filepath)
+        return inventory_number
 
     def get_date_retrieved(self):
         date = datetime.datetime.now()
-        self.wikidata_xml_mapping['date_retrieved'] = date.strftime('%d %B %Y')
-        return self.wikidata_xml_mapping['date_retrieved']
+        return date.strftime('%d %B %Y')
 
-    def get_alt_collection_creator(self):
-        title = str(self.wikidata_xml_mapping['description'])
-        doc = self.nlp(title)
+    def get_alt_creator_from_doc(self, doc):
+        return self.get_alt_creator_from_entities(doc.ents)
+
+    def get_alt_creator_from_entities(self, ents):
         possible_creator = ''
         nameFound = False
-        for ent in doc.ents:
+        for ent in ents:
             if ent.label_ in ['PERSON', 'ORG']:
                 # prioritize people over orgs, choose first person found
                 if nameFound and ent.label_ == 'ORG': continue
@@ -168,74 +364,51 @@ class FindingAidParser:
                 possible_creator = ent.text
         return possible_creator
 
-    def get_collection_creator(self):
-        self.wikidata_xml_mapping['collection_creator'] = ''
-        title = self.wikidata_xml_mapping['title']
+    def get_alt_collection_creator(self, description):
+        return self.get_alt_creator_from_entities(self.entities([str(description)])[0])
+
+    def get_creator_query(self, title):
         title = title.replace('Collection', '')
         title = title.replace('The', '')
         title = title.replace('Sheet', '')
         title = title.replace('Music', '')
         andInTitle = 'and' in title
-        doc = self.nlp(title.strip())
+        return (title.strip(), andInTitle)
+
+    def get_creator_from_doc(self, doc, andInTitle):
+        return self.get_creator_from_entities(doc.ents, andInTitle)
+
+    def get_creator_from_entities(self, ents, andInTitle):
+        creator = ''
         possible_creators = []
         nameFound = False
-        for ent in doc.ents:
+        for ent in ents:
             if ent.label_ in ['PERSON', 'ORG']:
                 # prioritize names over orgs for collection creators
                 if nameFound and ent.label_ == 'ORG': continue
                 if ent.label_ == 'PERSON': nameFound = True
                 possible_creators.append(ent.text.title())
         if len(possible_creators) == 1:
-            self.wikidata_xml_mapping['collection_creator'] = possible_creators[0]
+            creator = possible_creators[0]
         else:
             if andInTitle and len(possible_creators) > 0:
-                self.wikidata_xml_mapping['collection_creator'] = ' and '.join(possible_creators)
+                creator = ' and '.join(possible_creators)
             elif len(possible_creators) > 0:
-                self.wikidata_xml_mapping['collection_creator'] = possible_creators[0]
-
-        if self.wikidata_xml_mapping['collection_creator'] == '':
-            self.wikidata_xml_mapping['collection_creator'] = self.get_alt_collection_creator()
-        return self.wikidata_xml_mapping['collection_creator']
-
-    def get_collection_size(self, root):
-        physdesc =  './/%sphysdesc' % (self.namespace)
-        physdesc_tag = root.findall(physdesc)
-        pattern = '\\n\s*'
-        outer_res = []
-        for t in physdesc_tag:
-            inner_res = []
-            for node in t.iter():
-                inner_res.append(node.text)
-            outer_res.append(inner_res)
-
-        collection_size = ' '.join(outer_res[0])
-        collection_size = re.sub('\\n\s*', '', collection_size)
-        self.wikidata_xml_mapping['collection_size'] = collection_size
-        return collection_size
-
-    def get_url(self, filepath):
-        finding_aid_url = ''
-        name = self.wikidata_xml_mapping['label']
-        querified = name.replace(" ", "%20")
-        url = "https://searchworks.stanford.edu/?q=" + querified + "&format=json"
-        try:
-            response = requests.get(url=url)
-            data = response.json()
-        except (ConnectTimeout, HTTPError, ReadTimeout, Timeout, ConnectionError):
-            pass
-
-        if len(data['response']['docs']) > 0:
-            try:
-                finding_aid_url = data['response']['docs'][0]['url_suppl'][0]
-            except KeyError:
-                pass
-
-        self.wikidata_xml_mapping['url'] = finding_aid_url
-        return finding_aid_url
-  
-    def combine_parsed_files(self, parsed): 
-        final_dict = defaultdict(list)
-        for item in parsed:
-            for k, v in item.items(): 
-                final_dict[k].append(v)
-        return final_dict
\ No newline at end of file
+                creator = possible_creators[0]
+        return creator
+
+    def get_collection_creator(self, title, description):
+        query, andInTitle = self.get_creator_query(title)
+        collection_creator = self.get_creator_from_entities(self.entities([query])[0], andInTitle)
+        if collection_creator == '':
+            collection_creator = self.get_alt_collection_creator(description)
+        return collection_creator
+
+    def get_collection_size(self, record):
+        return self.as_record(record)['collection_size']
+
+    def lookup_url(self, name):
+        return self.searchworks.lookup(name)
+
+    def get_url(self, label):
+        return self.lookup_url(label)
@@ -2,11 +2,68 @@ from FindingAidParser import *
 from MODSParser import *
 from MARCParser import *
 from Parser import *
+from ModelCache import load_stats
+from Metrics import metrics
+from ParseService import ParseClient
 import streamlit as st
 
 
+def show_load_stats():
+    stats = load_stats()
+    nlp_stats = stats.get('nlp')
+    parser_stats = stats.get('parser')
+    if nlp_stats and parser_stats:
+        st.sidebar.caption(
+            "spaCy model loads: %d (%.2fs total), warm reruns: %d"
+            % (nlp_stats['loads'], nlp_stats['load_seconds'], parser_stats['hits']))
+
+def show_nlp_cache_stats(parser):
+    stats = parser.finding_aid_parser.nlp_cache.stats()
+    if stats['hits'] or stats['misses']:
+        st.sidebar.caption(
+            "NLP cache: %d hits, %d misses, %d entries" % (stats['hits'], stats['misses'], stats['entries']))
+
+def show_metrics():
+    report = metrics.report()
+    if not report['stages']:
+        return
+    with st.expander("Stage timings"):
+        st.table([
+            {'stage': name, 'seconds': round(stage['seconds'], 3), 'calls': stage['calls'], 'items': stage['items']}
+            for name, stage in report['stages'].items()])
+        if report['slowest_files']:
+            st.caption("Slowest files")
+            st.table(report['slowest_files'])
+        st.download_button("Download timings (JSON)", data=metrics.to_json(), file_name='metrics.json', mime='application/json')
+        st.download_button("Download timings (Prometheus)", data=metrics.to_prometheus(), file_name='metrics.prom', mime='text/plain')
+
+def choose_parser(): 
+    """The parse service's stand-in when one is running and wanted, otherwise
+    this process's own warm Parser."""
+    client = ParseClient()
+    if client.available() and st.sidebar.checkbox("Parse on the local parse service", value=True): 
+        health = client.health()
+        st.sidebar.caption("Parse service: %d of %d workers ready, %d jobs queued"
+                           % (health['ready'], len(health['workers']), health['queued']))
+        return ServiceParser(client)
+    parser = get_parser()
+    show_load_stats()
+    show_nlp_cache_stats(parser)
+    return parser
+
 def main(): 
-    parser = Parser()
+    parser = choose_parser()
+    # the service sets its own workers and keeps its timings to itself, so
+    # these only apply when parsing here
+    on_service = isinstance(parser, ServiceParser)
+    workers = 1 if on_service else st.sidebar.number_input(
+        "Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1)
+    download_formats = {"CSV files": None, "Gzip-compressed CSV files": 'gzip', "One zip archive": 'zip'}
+    download_format = st.sidebar.radio("Download results as", list(download_formats))
+    if not on_service and st.sidebar.checkbox("Collect stage timings", value=metrics.enabled):
+        metrics.enable()
+    else:
+        metrics.disable()
     st.title('Parse XML Files')
     menu = ["Parse File(s)"]
     xml_files = None
@@ -27,10 +84,16 @@ def main():
             # print(multiple_files)
         if st.button("Parse Files"):
             if len(xml_files) > 0:  
-                parser.parse(xml_files)
+                metrics.reset()
+                parser.parse(xml_files, workers=workers, compression=download_formats[download_format])
 
             else: 
                 st.warning("No .xml files detected. Please double check selected file(s) and ensure the extension on each file is .xml.")
 
+    # drawn on every rerun so a download doesn't clear the results
+    parser.show_downloads()
+    if metrics.enabled:
+        show_metrics()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
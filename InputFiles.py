@@ -0,0 +1,105 @@
+"""
+The file objects the parsers read. Uploads arrive as in-memory buffers
+(Streamlit's UploadedFile is a BytesIO) and are parsed and hashed straight
+from getbuffer() rather than copied out with read(). Local files at or above
+MMAP_THRESHOLD are memory-mapped, so their bytes are read from the page cache
+in place instead of through another buffer. Either way a file's bytes are in
+memory once, from upload or disk to parse tree.
+
+Views from buffer_of() must be released before the file is closed; use it as
+a context manager.
+"""
+
+import io
+import mmap
+import os
+from contextlib import contextmanager
+
+MMAP_THRESHOLD = 1 << 20
+
+
+class NamedBuffer(io.BytesIO):
+    """In-memory file with a name, like Streamlit's UploadedFile."""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+class LocalFile(io.BufferedReader):
+    """A file on disk that goes by its base name, as an upload would, so
+    identifiers taken from file names don't pick up the directory."""
+    def __init__(self, path, name=None):
+        super().__init__(io.FileIO(path, 'rb'))
+        self.path = path
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name or os.path.basename(self.path)
+
+
+class MappedFile(io.RawIOBase):
+    """A LocalFile read through mmap. getbuffer() hands out the mapped bytes
+    themselves, like BytesIO.getbuffer()."""
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.map.read(size)
+
+    def readinto(self, buffer):
+        data = self.map.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.map.seek(offset, whence)
+        return self.map.tell()
+
+    def tell(self):
+        return self.map.tell()
+
+    def getbuffer(self):
+        return memoryview(self.map)
+
+    def close(self):
+        if not self.closed:
+            self.map.close()
+        super().close()
+
+
+def open_local(path, name=None, mmap_threshold=MMAP_THRESHOLD):
+    """Opens a local file by size: mapped at or above mmap_threshold bytes,
+    buffered below it. Either way it's named by its base name unless name is
+    given."""
+    if os.path.getsize(path) >= mmap_threshold:
+        return MappedFile(path, name)
+    return LocalFile(path, name)
+
+
+@contextmanager
+def buffer_of(file):
+    """A memoryview of file's bytes from its current position on, without
+    copying them, or None for files with no getbuffer(). The view is released
+    on leaving the block."""
+    getbuffer = getattr(file, 'getbuffer', None)
+    if getbuffer is None:
+        yield None
+        return
+    whole = getbuffer()
+    view = whole[file.tell():]
+    try:
+        yield view
+    finally:
+        view.release()
+        whole.release()
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "./.cache/searchworks.sqlite"
+
+
+class LookupCache:
+    """
+    Persistent title -> URL cache for SearchWorks lookups, stored in SQLite.
+    Keys are normalised labels. A stored empty URL records a lookup that found
+    nothing (negative caching) and expires after negative_ttl instead of ttl.
+    Once more than max_entries are stored, the least recently used are evicted.
+
+    Answers are committed as they are stored, but a hit only notes when the
+    entry was used; those times are written commit_every hits at a time, with
+    the next put, or on commit() and close(), so a warm run doesn't write to
+    disk for every lookup.
+    """
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        ttl=30 * 24 * 3600,
+        negative_ttl=7 * 24 * 3600,
+        max_entries=100000,
+        commit_every=500):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.open()
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS lookups ('
+            'key TEXT PRIMARY KEY, url TEXT NOT NULL, fetched_at REAL NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS lookups_last_used ON lookups (last_used)')
+        self.connection.commit()
+        self.size = self.connection.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+        # key -> when it was last used, not yet written
+        self.touched = {}
+
+    def __getstate__(self):
+        # Connections can't cross processes; each worker opens its own
+        state = self.__dict__.copy()
+        for name in ('lock', 'connection', 'size', 'touched'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def normalise_label(self, label):
+        return ' '.join(label.lower().split())
+
+    def get(self, label):
+        """Returns the cached URL ('' for a cached miss), or None when the label
+        isn't cached or its entry has expired."""
+        key = self.normalise_label(label)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT url, fetched_at FROM lookups WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            url, fetched_at = row
+            if now - fetched_at > (self.ttl if url else self.negative_ttl):
+                self.misses += 1
+                return None
+            self.touched[key] = now
+            if len(self.touched) >= self.commit_every:
+                self.write_touched()
+                self.connection.commit()
+            self.hits += 1
+            return url
+
+    def peek(self, label):
+        """Like get, but doesn't count as a hit or a use of the entry."""
+        key = self.normalise_label(label)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT url, fetched_at FROM lookups WHERE key = ?', (key,)).fetchone()
+        if row is None or time.time() - row[1] > (self.ttl if row[0] else self.negative_ttl):
+            return None
+        return row[0]
+
+    def put(self, label, url):
+        key = self.normalise_label(label)
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                'UPDATE lookups SET url = ?, fetched_at = ?, last_used = ? WHERE key = ?',
+                (url, now, now, key))
+            if cursor.rowcount == 0:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO lookups (key, url, fetched_at, last_used) VALUES (?, ?, ?, ?)',
+                    (key, url, now, now))
+                self.size += 1
+            self.write_touched()
+            if self.max_entries and self.size > self.max_entries:
+                self.evict()
+            self.connection.commit()
+
+    def write_touched(self):
+        # caller holds the lock and commits
+        if self.touched:
+            self.connection.executemany(
+                'UPDATE lookups SET last_used = ? WHERE key = ?',
+                [(used, key) for key, used in self.touched.items()])
+            self.touched = {}
+
+    def evict(self):
+        # least recently used first; caller holds the lock
+        self.connection.execute(
+            'DELETE FROM lookups WHERE key IN '
+            '(SELECT key FROM lookups ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,))
+        self.size = self.connection.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM lookups')
+            self.connection.commit()
+            self.size = 0
+            self.touched = {}
+
+    def commit(self):
+        with self.lock:
+            self.write_touched()
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.write_touched()
+            self.connection.commit()
+            self.connection.close()
@@ -1,245 +1,240 @@
-import xml.etree.ElementTree as ET
-import datetime
 import re
-import csv
-import glob
-import math
-import os
-from collections import defaultdict
-import requests
-from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
-import string
-import streamlit as st
+from WorkerPool import parallel_parse
+from FieldSpecs import FieldSpec, compile_specs, reverse_name
+from Writers import ColumnWriter
+from Metrics import metrics
+from XMLBackend import get_backend
+from Records import MARCRecord
+
+
+def marc_008_dates(text): 
+    date = ''
+    if len(text) >= 11: 
+        date += text[7:11]
+    if len(text) >= 15 and text[11:15].isdigit(): 
+        date += ', ' + text[11:15]
+    return date
+
+
+def subfield(column, tag, code, occurrence=0, post=()): 
+    return FieldSpec(column, 'datafield[@tag="%s"]' % tag, 'subfield[@code="%s"]' % code, occurrence, post=post)
+
+
+# Columns read straight from the record. Names starting with _ are raw
+# material for the getters that need more than a lookup.
+MARC_FIELDS = [
+    subfield('title', '245', 'a'),
+    subfield('subtitle', '245', 'b'),
+    subfield('composer', '100', 'a', post=('reverse_name',)),
+    subfield('publisher', '264', 'b', post=('strip_commas',)),
+    subfield('size', '300', 'c'),
+    subfield('catalog_number', '028', 'a'),
+    FieldSpec('date', 'controlfield[@tag="008"]', select='first', post=(marc_008_dates,)),
+    subfield('collection', '690', 'a', post=('strip',)),
+    subfield('citation_a', '510', 'a'),
+    subfield('citation_c', '510', 'c'),
+    subfield('roll_type', '500', 'a', occurrence=1),
+    FieldSpec('_composer_roles', 'datafield[@tag="100"]', 'subfield[@code="e"]', select='list'),
+    FieldSpec('_added_entries', 'datafield[@tag="700"]', occurrence=None, select='elements'),
+    FieldSpec('_control_number', 'controlfield[@tag="001"]', select='first', post=('strip',)),
+    subfield('_system_number', '035', 'a', post=('strip',)),
+]
 
 
 class MARCParser(): 
-    def __init__(self): 
-        self.namespace = "{http://www.loc.gov/MARC21/slim}"
+    # bump whenever a change alters the rows this parser produces
+    VERSION = '1'
 
-    def get_composer(self, root): 
-        composer = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="100"]')
-        if tag_in_xml: 
-            composer_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'subfield[@code="a"]')
-            for t in composer_tag_in_xml: 
-                for node in t.iter(): 
-                    composer = node.text.strip(',')
-                    composer = composer.split(',')
-                    composer.reverse()
-                    composer = ' '.join(composer).strip()                     
-        return composer
-
-    def get_size(self, root): 
-        size = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="300"]')
-        if tag_in_xml: 
-            size_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'subfield[@code="c"]')
-            for t in size_tag_in_xml: 
-                for node in t.iter(): 
-                    size = node.text
-                    
-        return size
-
-    def get_publisher_info(self, root): 
-        publisher = ''
-        issue_num = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="264"]')
-        if tag_in_xml: 
-            publisher_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'subfield[@code="b"]')
-            for t in publisher_tag_in_xml: 
-                for node in t.iter(): 
-                    publisher = node.text.strip(',')
-                
-        return publisher
-
-
-    def get_catalog_number(self, root): 
-        catalog_num = ''
-        
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="028"]')
-        
-        if tag_in_xml:         
-            catalog_number_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'subfield[@code="a"]')
-            for t in catalog_number_tag_in_xml: 
-                for node in t.iter(): 
-                    catalog_num = node.text
-                
-        return catalog_num
-
-    def get_identifier(self, root, filename): 
-        name = filename.split('.xml')[0]
-        match = re.findall('[0-9]{8}', name)[0]
-        return match
-
-    def should_use_composer(self, root, role_of_interest): 
-        alt = ''
-        tag_needed = None
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="100"]')
-        if tag_in_xml: 
-            alt_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'subfield[@code="e"]')
-            for t in alt_tag_in_xml: 
-                for node in t.iter(): 
-                    if 'instrumentalist' in node.text.lower() and role_of_interest.lower() == 'instrumentalist': 
-                        return True
-                    if 'arranger' in node.text.lower() and role_of_interest.lower() == 'arranger': 
-                        return True
+    def __init__(self, xml_backend=None): 
+        self.xml = get_backend(xml_backend)
+        self.namespace = "{http://www.loc.gov/MARC21/slim}"
+        self.fields = compile_specs(MARC_FIELDS, self.namespace)
+
+    def worker_kwargs(self): 
+        return {'xml_backend': self.xml.name}
+
+    def version_key(self): 
+        return self.VERSION
+
+    def extract_record(self, root): 
+        return self.fields.extract(root)
+
+    def as_record(self, record): 
+        # getters take an extracted record, or a bare <record> element
+        if isinstance(record, dict): 
+            return record
+        return self.extract_record(record)
+
+    def get_composer(self, record): 
+        return self.as_record(record)['composer']
+
+    def get_size(self, record): 
+        return self.as_record(record)['size']
+
+    def get_publisher_info(self, record): 
+        return self.as_record(record)['publisher']
+
+    def get_catalog_number(self, record): 
+        return self.as_record(record)['catalog_number']
+
+    def get_identifier(self, record, filename=None): 
+        if filename: 
+            name = filename.split('.xml')[0]
+            match = re.findall('[0-9]{8}', name)
+            if match: 
+                return match[0]
+        # no per-record file name (e.g. a record from a collection), so use
+        # the control number, or failing that the system control number
+        record = self.as_record(record)
+        return record['_control_number'] or record['_system_number']
+
+    def should_use_composer(self, record, role_of_interest): 
+        for text in self.as_record(record)['_composer_roles']: 
+            if 'instrumentalist' in text.lower() and role_of_interest.lower() == 'instrumentalist': 
+                return True
+            if 'arranger' in text.lower() and role_of_interest.lower() == 'arranger': 
+                return True
         return False
 
-    def get_arranger_or_instrumentalist(self, root, role_of_interest): 
+    def get_arranger_or_instrumentalist(self, record, role_of_interest): 
+        record = self.as_record(record)
         role = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="700"]')
-        for t in tag_in_xml:
+        for t in record['_added_entries']: 
             name = ''
             for i, node in enumerate(t.iter()): 
                 if i == 1: 
                     name = node.text
                 if node.text and role_of_interest.lower() in node.text.lower(): 
-                    role = name
-                    role = role.strip(',')
-                    role = role.split(',')
-                    role.reverse()
-                    role = ' '.join(role).strip()
+                    role = reverse_name(name)
                     break
-        if role == '' and self.should_use_composer(root, role_of_interest): 
-            role = self.get_composer(root)
+        if role == '' and self.should_use_composer(record, role_of_interest): 
+            role = self.get_composer(record)
 
         return role
 
-    def get_collection(self, root): 
-        collection = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="690"]')
-        if tag_in_xml: 
-            collection_tag = tag_in_xml[0].findall(self.namespace + 'subfield[@code="a"]')
-            for t in collection_tag: 
-                for node in t.iter(): 
-                    collection = node.text
-        return collection.strip()
-
-    def get_roll_type(self, root): 
-        roll_type = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="500"]')
-        if tag_in_xml and len(tag_in_xml) >= 2: 
-            roll_type_tag = tag_in_xml[1].findall(self.namespace + 'subfield[@code="a"]')
-            for t in roll_type_tag: 
-                for node in t.iter(): 
-                    roll_type = node.text
-        return roll_type
-
-    def get_citation_a(self, root): 
-        citation = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="510"]')
-        if tag_in_xml: 
-            citation_tag = tag_in_xml[0].findall(self.namespace + 'subfield[@code="a"]')
-            for t in citation_tag: 
-                for node in t.iter(): 
-                    citation = node.text
-        return citation
-
-    def get_citation_c(self, root): 
-        citation = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="510"]')
-        if tag_in_xml: 
-            citation_tag = tag_in_xml[0].findall(self.namespace + 'subfield[@code="c"]')
-            for t in citation_tag: 
-                for node in t.iter(): 
-                    citation = node.text
-        return citation
-        
+    def get_collection(self, record): 
+        return self.as_record(record)['collection']
+
+    def get_roll_type(self, record): 
+        return self.as_record(record)['roll_type']
 
-    def get_date(self, root): 
-        date = ''
-        tag_in_xml = root.findall(self.namespace + 'controlfield[@tag="008"]')
-        if tag_in_xml: 
-            for node in tag_in_xml[0].iter(): 
-                if len(node.text) >= 11: 
-                    date += node.text[7:11]
-                
-                if len(node.text) >= 15 and node.text[11:15].isdigit(): 
-                    date += ', ' + node.text[11:15]
-        return date
+    def get_citation_a(self, record): 
+        return self.as_record(record)['citation_a']
+
+    def get_citation_c(self, record): 
+        return self.as_record(record)['citation_c']
+
+    def get_date(self, record): 
+        return self.as_record(record)['date']
         
-    def get_title(self, root): 
-        title = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="245"]')
-        if tag_in_xml: 
-            title_tag = tag_in_xml[0].findall(self.namespace + 'subfield[@code="a"]')
-            for t in title_tag: 
-                for node in t.iter(): 
-                    title = node.text
-        return title
-
-    def get_subtitle(self, root): 
-    #     245!
-        subtitle = ''
-        tag_in_xml = root.findall(self.namespace + 'datafield[@tag="245"]')
-        if tag_in_xml: 
-            subtitle_tag = tag_in_xml[0].findall(self.namespace + 'subfield[@code="b"]')
-            for t in subtitle_tag: 
-                for node in t.iter(): 
-                    subtitle = node.text
-        return subtitle
+    def get_title(self, record): 
+        return self.as_record(record)['title']
+
+    def get_subtitle(self, record): 
+        return self.as_record(record)['subtitle']
     
     def parse_xml(self, file): 
-        xmlTree = ET.parse(file)
-        root = xmlTree.getroot()
+        with metrics.stage('marc.xml_parse'):
+            root = self.xml.parse(file)
+        with metrics.stage('marc.extract'):
+            return self.parse_root(root, file.name)
+
+    def iter_rows(self, file): 
+        """Yields one row per record in file, streaming with iterparse so a
+        marc:collection of any size is parsed in constant memory. A file holding
+        a single <record> gives one row identified by its file name, as in
+        parse_xml; records in a collection are identified by their 001/035.
+        Only batch_parse_xml's serial path writes rows as they come from here;
+        see parse_rows.
+        """
+        record_tag = self.namespace + 'record'
+        records = metrics.timed('marc.xml_parse', self.xml.iter_records(file, record_tag))
+        for element, is_root in records: 
+            name = getattr(file, 'name', file) if is_root else None
+            with metrics.stage('marc.extract'):
+                row = self.parse_root(element, name)
+            yield row
+
+    def parse_rows(self, file): 
+        """Every row of file in a list, which is what a worker process sends
+        back when batch_parse_xml runs with workers > 1. That path isn't
+        constant memory: a collection's rows are all held by the worker and
+        then by this process, which keeps every file's rows until the pool
+        is done, and a collection is parsed by one worker however large it
+        is."""
+        return list(self.iter_rows(file))
+
+    def parse_root(self, root, name): 
+        record = self.extract_record(root)
+
+        title = self.get_title(record)
+        subtitle = self.get_subtitle(record)
         
-        title = self.get_title(root)
-        subtitle = self.get_subtitle(root)
+        composer = self.get_composer(record)
+        arranger = self.get_arranger_or_instrumentalist(record, 'arranger')
+        instrumentalist = self.get_arranger_or_instrumentalist(record, 'instrumentalist')
+        publisher = self.get_publisher_info(record)
         
-        composer = self.get_composer(root)
-        arranger = self.get_arranger_or_instrumentalist(root, 'arranger')
-        instrumentalist = self.get_arranger_or_instrumentalist(root, 'instrumentalist')
-        publisher = self.get_publisher_info(root)
-        
-        size = self.get_size(root)
-        catalog_number = self.get_catalog_number(root)
-        date = self.get_date(root)
+        size = self.get_size(record)
+        catalog_number = self.get_catalog_number(record)
+        date = self.get_date(record)
 
-        identifier = self.get_identifier(root, file.name)
+        identifier = self.get_identifier(record, name)
         
-        collection = self.get_collection(root)
-        citation_a = self.get_citation_a(root)
-        citation_c = self.get_citation_c(root)
-        roll_type = self.get_roll_type(root)
-
-        return {'title': title, 
-                'subtitle': subtitle,
-                'composer': composer, 
-                'arranger': arranger, 
-                'instrumentalist': instrumentalist, 
-                'publisher': publisher, 
-                'size': size, 
-                'catalog_number': catalog_number, 
-                'date': date,
-                'identifier': identifier,
-                'collection': collection, 
-                'citation_a': citation_a, 
-                'citation_c': citation_c, 
-                'roll_type': roll_type}
+        collection = self.get_collection(record)
+        citation_a = self.get_citation_a(record)
+        citation_c = self.get_citation_c(record)
+        roll_type = self.get_roll_type(record)
+
+        return MARCRecord(
+            title=title, 
+            subtitle=subtitle,
+            composer=composer, 
+            arranger=arranger, 
+            instrumentalist=instrumentalist, 
+            publisher=publisher, 
+            size=size, 
+            catalog_number=catalog_number, 
+            date=date,
+            identifier=identifier,
+            collection=collection, 
+            citation_a=citation_a, 
+            citation_c=citation_c, 
+            roll_type=roll_type)
             
     def batch_parse_xml(
-        self, 
-        files, 
-        show_progress=True,
+        self,
+        files,
+        show_progress=True, 
         progress_bar=None, 
         amount_done=0,
-        size=0): 
-
-        parsed  = []
+        size=0,
+        workers=None,
+        writer=None):
 
+        # the caller closes writers it passes in; ours is closed here
+        own_writer = writer is None
+        writer = writer or ColumnWriter()
         step = 1/size if size > 0 else 0
 
-        for i, file in enumerate(files):
+        def advance():
+            nonlocal amount_done
             amount_done += step 
-            parsed_file = self.parse_xml(file)
-            parsed.append(parsed_file)
             if show_progress and progress_bar: progress_bar.progress(round(amount_done, 1))
-        marc_info = self.combine_parsed_files(parsed)
-        return marc_info                
-
-    def combine_parsed_files(self, parsed): 
-        final_dict = defaultdict(list)
-        for item in parsed:
-            for k, v in item.items(): 
-                final_dict[k].append(v)
-        return final_dict
\ No newline at end of file
+
+        # a single file gains nothing from a pool, and parsed here its rows
+        # are streamed to the writer
+        if workers and workers > 1 and len(files) > 1:
+            results = parallel_parse(type(self), self.worker_kwargs(), files, workers, on_done=advance, method='parse_rows')
+            for file, rows in zip(files, results):
+                for row in rows:
+                    writer.write(row)
+                writer.file_done(file)
+        else:
+            for file in files:
+                with metrics.file('marc.file', getattr(file, 'name', file)):
+                    for row in self.iter_rows(file):
+                        writer.write(row)
+                writer.file_done(file)
+                advance()
+        return writer.close() if own_writer else writer                
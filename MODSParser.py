@@ -1,235 +1,236 @@
-import xml.etree.ElementTree as ET
-import datetime
-import re
-import csv
-import glob
-import math
-import os
-from collections import defaultdict
-import requests
-from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
-import string
-import streamlit as st
+from WorkerPool import parallel_parse
+from FieldSpecs import FieldSpec, compile_specs, reverse_name
+from Writers import ColumnWriter
+from Metrics import metrics
+from XMLBackend import get_backend
+from Records import MODSRecord
+
+
+# Columns read straight from the record. Names starting with _ are raw
+# material for the getters that need more than a lookup.
+MODS_FIELDS = [
+    FieldSpec('title', 'titleInfo', '*', select='join'),
+    FieldSpec('uniform_title', 'titleInfo[@type="uniform"]', occurrence=None),
+    FieldSpec('subtitle', 'titleInfo', 'subTitle'),
+    FieldSpec('composer', 'name[@usage="primary"]', '*', select='first', post=('reverse_primary_name',)),
+    FieldSpec('performer', 'note[@type="performers"]', occurrence=None),
+    FieldSpec('publisher', 'originInfo[@eventType="publication"]', 'publisher'),
+    FieldSpec('extent', 'physicalDescription', 'extent'),
+    FieldSpec('date_issued', 'originInfo', 'dateIssued', select='join', separator=', '),
+    FieldSpec('alt_date_issued', 'originInfo[@eventType="publication"]', 'dateIssued'),
+    FieldSpec('genre', 'genre', occurrence=None, select='list'),
+    FieldSpec('third_note', 'note', occurrence=2),
+    FieldSpec('issue_number', 'identifier[@type="issue number"]', occurrence=None),
+    FieldSpec('record_identifier', 'recordInfo', 'recordIdentifier[@source="SIRSI"]'),
+    FieldSpec('_any_record_identifier', 'recordInfo', 'recordIdentifier', post=('strip',)),
+    FieldSpec('_identifiers', 'identifier', occurrence=None, select='elements'),
+    FieldSpec('_names', 'name', occurrence=None, select='elements'),
+]
 
 
 class MODSParser: 
-    def __init__(self): 
+    # bump whenever a change alters the rows this parser produces
+    VERSION = '1'
+    # compiled once per backend, see XMLBackend
+    ROLE_PATH = 'mods:role'
+    NAME_PART_PATH = 'mods:namePart'
+
+    def __init__(self, xml_backend=None): 
+        self.xml = get_backend(xml_backend)
         self.namespace = "{http://www.loc.gov/mods/v3}"
-        self.wikidata_xml_mapping = {}
-
-    def get_title(self, root): 
-        title = []
-        tag_in_xml = root.findall(self.namespace + 'titleInfo')[0]
-
-        for t in tag_in_xml: 
-            for node in t.iter(): 
-                title.append(node.text)
-        return ' '.join(title)
-
-    def get_subtitle(self, root): 
-        subtitle = ''
-        tag_in_xml = root.findall(self.namespace + 'titleInfo')[0]
-        subtitle_tag_in_xml = tag_in_xml.findall(self.namespace + 'subTitle')
-        
-        for t in subtitle_tag_in_xml: 
-            for node in t.iter():
-                subtitle = node.text           
-        return subtitle
-
-    def get_uniform_title(self, root): 
-        uniform_title = ''
-        tag_in_xml = root.findall(self.namespace + 'titleInfo[@type="uniform"]')
-        
-        for t in tag_in_xml: 
-            for node in t.iter(): 
-                uniform_title = node.text
-        return uniform_title
-
-    def get_composer(self, root): 
-        composer_info = []
-        tag_in_xml = root.findall(self.namespace + 'name[@usage="primary"]')
-        
-        if len(tag_in_xml) == 0: 
-            return ''
-        
-        for t in tag_in_xml[0]: 
-            for node in t.iter(): 
-                composer_info.append(node.text)
-                
-        composer = composer_info[0].split(', ')
-        composer.reverse()
-        composer = ' '.join(composer)
-        return composer
-
-    def get_role(self, root, role_of_interest): 
-        arranger_info = []    
-        parent_node = None
-        res = ''
-        names = root.findall(self.namespace + 'name')
-
-        for name in names: 
-            roles = name.findall(self.namespace + 'role')
-            for role in roles: 
+        self.fields = compile_specs(MODS_FIELDS, self.namespace)
+        self.roles_of = self.xml.compile(self.ROLE_PATH)
+        self.name_parts_of = self.xml.compile(self.NAME_PART_PATH)
+
+    def worker_kwargs(self): 
+        return {'xml_backend': self.xml.name}
+
+    def version_key(self): 
+        return self.VERSION
+
+    def extract_record(self, root): 
+        return self.fields.extract(root)
+
+    def as_record(self, record): 
+        # getters take an extracted record, or a bare <mods> element
+        if isinstance(record, dict): 
+            return record
+        return self.extract_record(record)
+
+    def get_title(self, record): 
+        return self.as_record(record)['title']
+
+    def get_subtitle(self, record): 
+        return self.as_record(record)['subtitle']
+
+    def get_uniform_title(self, record): 
+        return self.as_record(record)['uniform_title']
+
+    def get_composer(self, record): 
+        return self.as_record(record)['composer']
+
+    def get_roles(self, record, roles_of_interest): 
+        """Finds the first name holding each role in one pass over the names"""
+        wanted = {role.lower(): role for role in roles_of_interest}
+        res = {role: '' for role in roles_of_interest}
+
+        for name in self.as_record(record)['_names']: 
+            if not wanted: 
+                break
+            for role in self.roles_of(name): 
                 for r in role.iter(): 
-                    if r.text.lower() == role_of_interest.lower(): 
-                        parent_node = name
-                        break
-        
-        if parent_node: 
-            name_of_interest = parent_node.findall(self.namespace + 'namePart')[0]
-            for n in name_of_interest.iter(): 
-                res = n.text.split(',')
-                res.reverse()
-                res = ' '.join(res).strip()
+                    role_of_interest = wanted.pop((r.text or '').lower(), None)
+                    if role_of_interest is None: 
+                        continue
+                    name_of_interest = self.name_parts_of(name)[0]
+                    for n in name_of_interest.iter(): 
+                        res[role_of_interest] = reverse_name(n.text)
         return res
 
-    def get_publisher(self, root): 
-        publisher_info = ''
-        tag_in_xml = root.findall(self.namespace + 'originInfo[@eventType="publication"]')
-        if len(tag_in_xml) == 0: 
-            return publisher_info
-
-        publisher_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'publisher')
-        
-        for t in publisher_tag_in_xml: 
-            for node in t.iter(): 
-                publisher_info = node.text
-                
-        return publisher_info
-
-    def get_genre(self, root): 
-        genres = []
-        tag_in_xml = root.findall(self.namespace + 'genre')
-
-        for t in tag_in_xml: 
-            for node in t.iter(): 
-                genres.append(node.text)
-        return genres
-
-    def get_note_tag(self, root): 
-        third_note = ''
-        tag_in_xml = root.findall(self.namespace + 'note')
-
-        if len(tag_in_xml) >= 3: 
-            for t in [tag_in_xml[2]]: 
-                for node in t.iter(): 
-                    third_note = node.text
-        return third_note
-
-    def get_performer(self, root): 
-        performer = ''
-        tag_in_xml = root.findall(self.namespace + 'note[@type="performers"]')
-
-        for t in tag_in_xml: 
-            for node in t.iter(): 
-                performer = node.text
-        return performer
-
-    def get_alt_date_issued(self, root): 
-        date_issued = []
-        tag_in_xml = root.findall(self.namespace + 'originInfo[@eventType="publication"]')
-        date_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'dateIssued')
-
-        for t in date_tag_in_xml: 
-            for node in t.iter(): 
-                date_issued = node.text
-        return date_issued
-
-    def get_date_issued(self, root): 
-        date_issued = []
-        tag_in_xml = root.findall(self.namespace + 'originInfo')
-
-        if len(tag_in_xml) > 0: 
-            date_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'dateIssued')
-            for t in date_tag_in_xml: 
-                for node in t.iter(): 
-                    date_issued.append(node.text)
-        return ', '.join(date_issued)
-
-    def get_issue_number(self, root): 
-        issue_number = ''
-        tag_in_xml = root.findall(self.namespace + 'identifier[@type="issue number"]')
-        
-        for t in tag_in_xml: 
-            for node in t.iter(): 
-                issue_number = node.text
-        return issue_number
-
-    def get_record_identifier(self, root): 
-        record_identifier = ''
-        tag_in_xml = root.findall(self.namespace + 'recordInfo')
-        record_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'recordIdentifier[@source="SIRSI"]')
-        
-        for t in record_tag_in_xml: 
-            for node in t.iter(): 
-                record_identifier = node.text
-        return record_identifier
-
-    def get_physical_description(self, root): 
-        extent = ''
-        tag_in_xml = root.findall(self.namespace + 'physicalDescription')
-        extent_tag_in_xml = tag_in_xml[0].findall(self.namespace + 'extent')
-
-        for t in extent_tag_in_xml: 
-            for node in t.iter(): 
-                extent = node.text
-        return extent
-
-    def get_identifier(self, filename): 
-        name = filename.split('.xml')[0]
-        return name.split('druid_')[1]
+    def get_role(self, record, role_of_interest): 
+        return self.get_roles(record, [role_of_interest])[role_of_interest]
+
+    def get_publisher(self, record): 
+        return self.as_record(record)['publisher']
+
+    def get_genre(self, record): 
+        return self.as_record(record)['genre']
+
+    def get_note_tag(self, record): 
+        return self.as_record(record)['third_note']
+
+    def get_performer(self, record): 
+        return self.as_record(record)['performer']
+
+    def get_alt_date_issued(self, record): 
+        return self.as_record(record)['alt_date_issued']
+
+    def get_date_issued(self, record): 
+        return self.as_record(record)['date_issued']
+
+    def get_issue_number(self, record): 
+        return self.as_record(record)['issue_number']
+
+    def get_record_identifier(self, record): 
+        return self.as_record(record)['record_identifier']
+
+    def get_physical_description(self, record): 
+        return self.as_record(record)['extent']
+
+    def get_druid(self, record): 
+        for identifier in self.as_record(record)['_identifiers']: 
+            text = (identifier.text or '').strip()
+            if text.startswith('druid:'): 
+                return text[len('druid:'):]
+            if identifier.get('type') == 'druid': 
+                return text
+        return ''
+
+    def get_identifier(self, filename, record=None): 
+        if filename and 'druid_' in filename: 
+            name = filename.split('.xml')[0]
+            return name.split('druid_')[1]
+        # no druid_ file name (e.g. a record from a modsCollection), so take
+        # it from the record itself
+        identifier = ''
+        if record is not None: 
+            record = self.as_record(record)
+            identifier = self.get_druid(record) or record['_any_record_identifier']
+        return identifier.strip()
 
     def parse_xml(self, file): 
-        xmlTree = ET.parse(file)
-        root = xmlTree.getroot()
-        title = self.get_title(root)
-        uniform_title = self.get_uniform_title(root)
-        subtitle = self.get_subtitle(root)
-        composer = self.get_composer(root)
-        arranger = self.get_role(root, 'arranger')
-        instrumentalist = self.get_role(root, 'instrumentalist')
-        performer = self.get_performer(root)
-
-        publisher = self.get_publisher(root)
-        extent = self.get_physical_description(root)
-        date_issued = self.get_date_issued(root)
-        identifier = self.get_identifier(file.name)
-
-        return {'title': title, 
-                'uniform_title': uniform_title, 
-                'subtitle': subtitle,
-                'composer': composer, 
-                'arranger': arranger, 
-                'instrumentalist': instrumentalist, 
-                'performer': performer, 
-                'publisher': publisher, 
-                'extent': extent, 
-                'date_issued': date_issued,
-                'identifier': identifier}
+        with metrics.stage('mods.xml_parse'):
+            root = self.xml.parse(file)
+        with metrics.stage('mods.extract'):
+            return self.parse_root(root, file.name)
+
+    def iter_rows(self, file): 
+        """Yields one row per <mods> record in file, streaming with iterparse so
+        a modsCollection of any size is parsed in constant memory. A file whose
+        root is a single <mods> gives one row identified by its file name, as in
+        parse_xml; records in a collection are identified from the record.
+        Only batch_parse_xml's serial path writes rows as they come from here;
+        see parse_rows.
+        """
+        mods_tag = self.namespace + 'mods'
+        records = metrics.timed('mods.xml_parse', self.xml.iter_records(file, mods_tag))
+        for element, is_root in records: 
+            name = getattr(file, 'name', file) if is_root else None
+            with metrics.stage('mods.extract'):
+                row = self.parse_root(element, name)
+            yield row
+
+    def parse_rows(self, file): 
+        """Every row of file in a list, which is what a worker process sends
+        back when batch_parse_xml runs with workers > 1. That path isn't
+        constant memory: a collection's rows are all held by the worker and
+        then by this process, which keeps every file's rows until the pool
+        is done, and a collection is parsed by one worker however large it
+        is."""
+        return list(self.iter_rows(file))
+
+    def parse_root(self, root, name): 
+        record = self.extract_record(root)
+        title = self.get_title(record)
+        uniform_title = self.get_uniform_title(record)
+        subtitle = self.get_subtitle(record)
+        composer = self.get_composer(record)
+        roles = self.get_roles(record, ['arranger', 'instrumentalist'])
+        arranger = roles['arranger']
+        instrumentalist = roles['instrumentalist']
+        performer = self.get_performer(record)
+
+        publisher = self.get_publisher(record)
+        extent = self.get_physical_description(record)
+        date_issued = self.get_date_issued(record)
+        identifier = self.get_identifier(name, record)
+
+        return MODSRecord(
+            title=title, 
+            uniform_title=uniform_title, 
+            subtitle=subtitle,
+            composer=composer, 
+            arranger=arranger, 
+            instrumentalist=instrumentalist, 
+            performer=performer, 
+            publisher=publisher, 
+            extent=extent, 
+            date_issued=date_issued,
+            identifier=identifier)
     
     def batch_parse_xml(
-        self, 
-        files, 
-        show_progress=True,
+        self,
+        files,
+        show_progress=True, 
         progress_bar=None, 
         amount_done=0,
-        size=0): 
-
-        parsed  = []
+        size=0,
+        workers=None,
+        writer=None):
 
+        # the caller closes writers it passes in; ours is closed here
+        own_writer = writer is None
+        writer = writer or ColumnWriter()
         step = 1/size if size > 0 else 0
 
-        for i, file in enumerate(files):
+        def advance():
+            nonlocal amount_done
             amount_done += step 
-            parsed_file = self.parse_xml(file)
-            parsed.append(parsed_file)
             if show_progress and progress_bar: progress_bar.progress(round(amount_done, 1))
-        mods_info = self.combine_parsed_files(parsed)
-        return mods_info        
-
-    def combine_parsed_files(self, parsed): 
-        final_dict = defaultdict(list)
-        for item in parsed:
-            for k, v in item.items(): 
-                final_dict[k].append(v)
-        return final_dict
\ No newline at end of file
+
+        # a single file gains nothing from a pool, and parsed here its rows
+        # are streamed to the writer
+        if workers and workers > 1 and len(files) > 1:
+            results = parallel_parse(type(self), self.worker_kwargs(), files, workers, on_done=advance, method='parse_rows')
+            for file, rows in zip(files, results):
+                for row in rows:
+                    writer.write(row)
+                writer.file_done(file)
+        else:
+            for file in files:
+                with metrics.file('mods.file', getattr(file, 'name', file)):
+                    for row in self.iter_rows(file):
+                        writer.write(row)
+                writer.file_done(file)
+                advance()
+        return writer.close() if own_writer else writer        
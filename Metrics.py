@@ -0,0 +1,178 @@
+"""
+Per-stage timing for the parsers. Code marks a stage with
+
+    with metrics.stage('ead.xml_parse'):
+        ...
+
+and metrics keeps the wall time, the number of calls and the number of items
+(files, records or texts) per stage, plus the slowest files seen. Results can
+be exported as a JSON report or a Prometheus text file.
+
+Collection is off unless metrics.enable() is called or PARSER_METRICS=1 is set
+in the environment. While it's off, stage() hands back one shared do-nothing
+context manager, so instrumented code pays a method call and nothing more.
+
+Stages recorded in a worker process (workers > 1) stay in that process; the
+main process still records its own stages, such as NLP and lookups done after
+the pool returns.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+_DISABLED = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'items', 'start')
+
+    def __init__(self, metrics, name, items):
+        self.metrics = metrics
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.items)
+
+
+class _File(_Stage):
+    __slots__ = ('file_name',)
+
+    def __init__(self, metrics, name, file_name):
+        super().__init__(metrics, name, 1)
+        self.file_name = file_name
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.metrics.record(self.name, seconds, 1)
+        self.metrics.record_file(self.name, self.file_name, seconds)
+
+
+class Metrics:
+    def __init__(self, enabled=False, slowest=20):
+        self.enabled = enabled
+        self.slowest = slowest
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.slowest_files = []
+            self.started = time.time()
+
+    def stage(self, name, items=1):
+        """Context manager timing one call of stage name covering items things."""
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, name, items)
+
+    def file(self, name, file_name):
+        """Like stage(), and also remembers file_name if it's among the slowest."""
+        if not self.enabled:
+            return _DISABLED
+        return _File(self, name, file_name)
+
+    def record(self, name, seconds, items=1):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'calls': 0, 'items': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            stage['calls'] += 1
+            stage['items'] += items
+            stage['seconds'] += seconds
+            if seconds > stage['max_seconds']:
+                stage['max_seconds'] = seconds
+
+    def record_file(self, name, file_name, seconds):
+        with self.lock:
+            entry = (seconds, name, str(file_name))
+            if len(self.slowest_files) < self.slowest:
+                heapq.heappush(self.slowest_files, entry)
+            elif entry > self.slowest_files[0]:
+                heapq.heapreplace(self.slowest_files, entry)
+
+    def timed(self, name, iterator):
+        """Yields from iterator, counting only the time spent inside it (not in
+        the consumer) towards stage name. For iterparse, where parsing and
+        per-record work interleave."""
+        if not self.enabled:
+            yield from iterator
+            return
+        clock = time.perf_counter
+        seconds = 0.0
+        iterator = iter(iterator)
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += clock() - start
+                    break
+                seconds += clock() - start
+                yield item
+        finally:
+            self.record(name, seconds, 1)
+
+    def report(self):
+        with self.lock:
+            stages = {
+                name: dict(stage, mean_seconds=stage['seconds'] / stage['calls'] if stage['calls'] else 0.0)
+                for name, stage in sorted(self.stages.items())}
+            slowest = [{'stage': name, 'file': file_name, 'seconds': seconds}
+                       for seconds, name, file_name in sorted(self.slowest_files, reverse=True)]
+        return {
+            'started': self.started,
+            'elapsed_seconds': time.time() - self.started,
+            'stages': stages,
+            'slowest_files': slowest,
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self, prefix='xml_parser'):
+        """The stage totals in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+        for metric, key, help_text in (
+                ('stage_seconds_total', 'seconds', 'Wall time spent in each stage.'),
+                ('stage_calls_total', 'calls', 'Times each stage ran.'),
+                ('stage_items_total', 'items', 'Files, records or texts each stage handled.'),
+                ('stage_max_seconds', 'max_seconds', 'Longest single run of each stage.')):
+            name = '%s_%s' % (prefix, metric)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, 'gauge' if key == 'max_seconds' else 'counter'))
+            for stage, values in report['stages'].items():
+                value = values[key]
+                lines.append('%s{stage="%s"} %s' % (name, stage.replace('"', '\\"'), repr(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir, name='metrics'):
+        """Writes <name>.json and <name>.prom to output_dir and returns the paths."""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for extension, text in (('.json', self.to_json()), ('.prom', self.to_prometheus())):
+            path = os.path.join(output_dir, name + extension)
+            with open(path, 'w') as file:
+                file.write(text)
+            paths.append(path)
+        return paths
+
+
+metrics = Metrics(enabled=os.environ.get('PARSER_METRICS', '') not in ('', '0'))
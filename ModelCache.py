@@ -0,0 +1,118 @@
+"""
+Process-wide cache for expensive resources (spaCy pipelines, parser instances).
+Streamlit re-executes the front end script on every interaction but keeps imported
+modules alive, so anything stored here survives reruns. Entries are keyed by the
+model path, the model's on-disk fingerprint and the load configuration; a change
+to any of them loads a fresh copy and drops the stale one.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import spacy
+
+DEFAULT_MODEL_PATH = "./models/en/"
+
+# Components each profile keeps; everything else the model ships with is
+# excluded at load time. None keeps the pipeline exactly as configured.
+PIPELINE_PROFILES = {
+    'full': None,
+    # sentence boundaries only, for the first sentence of a description
+    'sentences': ['senter'],
+    # named entities only, for collection creators
+    'entities': ['ner'],
+}
+
+_lock = threading.RLock()
+_resources = {}
+_stats = defaultdict(lambda: {'loads': 0, 'hits': 0, 'load_seconds': 0.0, 'last_load_seconds': 0.0})
+
+
+def model_fingerprint(model_path=DEFAULT_MODEL_PATH):
+    fingerprint = []
+    for name in ('config.cfg', 'meta.json'):
+        try:
+            stat = os.stat(os.path.join(model_path, name))
+            fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append((name, None, None))
+    return tuple(fingerprint)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def get_resource(kind, key, version, factory):
+    """Returns the cached resource for (kind, key), building it with factory() when
+    it is missing or was built for a different version."""
+    with _lock:
+        entry = _resources.get((kind, key))
+        if entry is not None and entry[0] == version:
+            _stats[kind]['hits'] += 1
+            return entry[1]
+
+        start = time.perf_counter()
+        resource = factory()
+        elapsed = time.perf_counter() - start
+
+        _resources[(kind, key)] = (version, resource)
+        _stats[kind]['loads'] += 1
+        _stats[kind]['load_seconds'] += elapsed
+        _stats[kind]['last_load_seconds'] = elapsed
+        return resource
+
+
+def model_version(model_path=DEFAULT_MODEL_PATH):
+    """'en_core_web_sm-3.0.0' style name of the packaged model, from meta.json."""
+    with open(os.path.join(model_path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    return '%s_%s-%s' % (meta.get('lang', ''), meta.get('name', ''), meta.get('version', ''))
+
+
+def model_components(model_path=DEFAULT_MODEL_PATH):
+    with open(os.path.join(model_path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    return meta.get('components', meta.get('pipeline', []))
+
+
+def _load_profile(model_path, profile, config):
+    keep = PIPELINE_PROFILES[profile]
+    if keep is not None:
+        config = dict(config)
+        config.setdefault('exclude', [c for c in model_components(model_path) if c not in keep])
+    nlp = spacy.load(model_path, **config)
+    for name in keep or []:
+        # senter ships disabled in favour of the parser's sentence boundaries
+        if name in nlp.disabled:
+            nlp.enable_pipe(name)
+    return nlp
+
+
+def load_nlp(model_path=DEFAULT_MODEL_PATH, profile='full', **config):
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError("Unknown pipeline profile %r, expected one of %s" % (profile, ', '.join(PIPELINE_PROFILES)))
+    key = (os.path.abspath(model_path), profile, _freeze(config))
+    return get_resource(
+        'nlp',
+        key,
+        model_fingerprint(model_path),
+        lambda: _load_profile(model_path, profile, config))
+
+
+def load_stats():
+    with _lock:
+        return {kind: dict(stats) for kind, stats in _stats.items()}
+
+
+def clear():
+    with _lock:
+        _resources.clear()
+        _stats.clear()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+
+from Metrics import metrics
+
+# An entity as the creator getters read it; spaCy's Span has the same two
+# attributes, so the getters take either.
+Entity = namedtuple('Entity', ['text', 'label_'])
+
+
+class NLPCache:
+    """
+    Memoises what the finding aid parser takes from spaCy, keyed by a hash of
+    the text and of what produced the result (model version and pipeline
+    profile). Values are small tuples, such as a first sentence's character
+    offsets or (start, end, label) entity spans, never Doc objects.
+
+    The most recently used max_entries results are kept in memory. With a path
+    they are also written to SQLite, so later runs start warm.
+    """
+    def __init__(self, max_entries=50000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.open()
+
+    def open(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.connection = None
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.connection.commit()
+
+    def __getstate__(self):
+        # workers start with an empty memory and their own connection
+        state = self.__dict__.copy()
+        for name in ('lock', 'entries', 'connection'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def make_key(self, namespace, text):
+        digest = hashlib.blake2b(namespace.encode('utf-8'), digest_size=16)
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if self.connection is not None:
+                row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value = self.thaw(json.loads(row[0]))
+                    self.remember(key, value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items:
+                self.remember(key, value)
+            if self.connection is not None and items:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+                    [(key, json.dumps(value)) for key, value in items])
+                self.connection.commit()
+
+    def remember(self, key, value):
+        # caller holds the lock
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def thaw(self, value):
+        # JSON turns tuples into lists
+        if isinstance(value, list):
+            return tuple(self.thaw(v) for v in value)
+        return value
+
+    def pipe(self, nlp, texts, analyse, namespace, batch_size=64, n_process=1, stage='nlp'):
+        """Returns analyse(doc) for every text, in order. Only texts without a
+        cached result are run through nlp, each distinct one once; that time is
+        recorded under stage in Metrics."""
+        keys = [self.make_key(namespace, text) for text in texts]
+        results = {}
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key in results or key in pending:
+                continue
+            value = self.get(key)
+            if value is None:
+                pending[key] = text
+            else:
+                results[key] = value
+
+        if pending:
+            with metrics.stage(stage, len(pending)):
+                docs = nlp.pipe(list(pending.values()), batch_size=batch_size, n_process=n_process)
+                computed = [(key, analyse(doc)) for key, doc in zip(pending, docs)]
+            self.put_many(computed)
+            results.update(computed)
+        return [results[key] for key in keys]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM results')
+                self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
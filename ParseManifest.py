@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from InputFiles import buffer_of, open_local
+from Records import as_dict
+
+DEFAULT_MANIFEST_PATH = "./.cache/manifest.sqlite"
+
+
+class ParseManifest:
+    """
+    Remembers the rows parsed from every file, keyed by a SHA-256 of the file's
+    name and bytes (identifiers can come from the name), so an unchanged file
+    doesn't have to be parsed, run through the NLP pipeline or looked up
+    again. Each entry records the parser's version_key() (the parser version,
+    plus the model version and settings for finding aids); an entry made
+    under a different version is treated as missing and replaced.
+    """
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, commit_every=500):
+        self.path = path
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.open()
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'digest TEXT PRIMARY KEY, version TEXT NOT NULL, rows TEXT NOT NULL, last_used REAL NOT NULL)')
+        self.connection.commit()
+        self.pending = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('lock', 'connection', 'pending'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def content_hash(self, file, block_size=1 << 20):
+        """SHA-256 of a file object's (or path's) name and bytes. File objects
+        are rewound afterwards."""
+        if isinstance(file, str):
+            with open_local(file, name=file) as local_file:
+                return self.content_hash(local_file, block_size)
+        digest = hashlib.sha256()
+        digest.update(file.name.encode('utf-8') + b'\0')
+        file.seek(0)
+        try:
+            with buffer_of(file) as buffer:
+                if buffer is not None:
+                    # uploads and mapped files are hashed in place
+                    digest.update(buffer)
+                else:
+                    for block in iter(lambda: file.read(block_size), b''):
+                        digest.update(block)
+        finally:
+            file.seek(0)
+        return digest.hexdigest()
+
+    def get(self, digest, version):
+        """Returns the rows stored for digest under version, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT version, rows FROM files WHERE digest = ?', (digest,)).fetchone()
+            if row is None or row[0] != version:
+                self.misses += 1
+                return None
+            self.connection.execute('UPDATE files SET last_used = ? WHERE digest = ?', (time.time(), digest))
+            self.note_change()
+            self.hits += 1
+            return json.loads(row[1])
+
+    def put(self, digest, version, rows):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (digest, version, rows, last_used) VALUES (?, ?, ?, ?)',
+                (digest, version, json.dumps(rows, default=str), time.time()))
+            self.note_change()
+
+    def note_change(self):
+        # caller holds the lock; commits are batched for large runs
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    def split(self, files, version):
+        """Sorts files into those that need parsing and those with stored rows.
+        Returns (files to parse, their digests, stored rows by id(file))."""
+        to_parse, digests, cached = [], {}, {}
+        for file in files:
+            digest = self.content_hash(file)
+            rows = self.get(digest, version)
+            if rows is None:
+                to_parse.append(file)
+                digests[id(file)] = digest
+            else:
+                cached[id(file)] = rows
+        return to_parse, digests, cached
+
+    def recorder(self, writer, files, digests, cached, version, settled=None):
+        return ManifestRecorder(self, writer, files, digests, cached, version, settled)
+
+    def prune(self, older_than):
+        """Drops entries not used in the last older_than seconds."""
+        with self.lock:
+            self.connection.execute('DELETE FROM files WHERE last_used < ?', (time.time() - older_than,))
+            self.connection.commit()
+            self.pending = 0
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM files')
+            self.connection.commit()
+            self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class ManifestRecorder:
+    """Writer that passes rows through to writer and, as each file finishes,
+    stores that file's rows in the manifest. files is every file of the batch,
+    in order; the stored rows of those in cached are written in their place
+    among the parsed ones, so the output keeps the order of the input.
+
+    settled(row), if given, says whether a row may be stored. A file is only
+    stored when all its rows are, so one whose finding aid URL lookup failed
+    is parsed again next time rather than kept without its URL.
+    """
+    def __init__(self, manifest, writer, files, digests, cached, version, settled=None):
+        self.manifest = manifest
+        self.writer = writer
+        self.files = iter(files)
+        self.digests = digests
+        self.cached = cached
+        self.version = version
+        self.settled = settled
+        self.rows = []
+        self.in_file = False
+
+    def write_cached(self):
+        # writes stored rows up to the next file that was parsed
+        for file in self.files:
+            rows = self.cached.get(id(file))
+            if rows is None:
+                return
+            for row in rows:
+                self.writer.write(row)
+            self.writer.file_done(file)
+
+    def write(self, row):
+        if not self.in_file:
+            self.write_cached()
+            self.in_file = True
+        self.writer.write(row)
+        self.rows.append(row)
+
+    def file_done(self, file):
+        if not self.in_file:
+            self.write_cached()
+        self.in_file = False
+        self.writer.file_done(file)
+        digest = self.digests.get(id(file))
+        rows = [as_dict(row) for row in self.rows]
+        if digest is not None and (self.settled is None or all(self.settled(row) for row in rows)):
+            self.manifest.put(digest, self.version, rows)
+        self.rows = []
+
+    def finish(self):
+        """Writes the stored rows of files after the last one parsed."""
+        self.write_cached()
+
+    def close(self):
+        self.finish()
+        self.manifest.commit()
+        return self.writer.close()
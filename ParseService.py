@@ -0,0 +1,669 @@
+"""
+Local parse service: a long-running process that keeps a pool of worker
+processes with the Parser and spaCy pipelines already loaded, and runs parse
+jobs sent to it over HTTP on the loopback interface. Only the first start-up
+pays for loading; every job after that goes straight to parsing.
+
+    python -m ParseService --workers 2 --port 8765
+
+Jobs are queued by priority (higher first, then in the order they came in)
+and each one runs BatchRunner.run in a free worker. A worker that dies is
+started again, retrying after each of RESTART_DELAYS. If a slot still can't
+be filled it's reported dead in /health, and once every slot is dead the
+queued jobs fail and new ones are turned away. A job names local paths,
+so the service and whoever submits to it must share a file system:
+
+    POST   /jobs              {"inputs": [...], "output_dir": ..., "format": "csv",
+                               "priority": 0, "offline": false, "pipelined": false,
+                               "manifest": null, "metrics_dir": null}
+    GET    /jobs              every job
+    GET    /jobs/<id>         one job
+    GET    /jobs/<id>/events  the job as one JSON line per change, until it finishes
+    DELETE /jobs/<id>         cancels a job that hasn't started
+    GET    /health            workers and queue length
+
+ParseClient submits jobs and follows them; BatchRunner --service and the
+Streamlit front end use it. Paths aren't checked beyond what BatchRunner
+does, so the service only listens on 127.0.0.1 and only answers its own
+clients. Each start writes a fresh token to TOKEN_FILE (readable by the
+owner only), and every request must carry it in an X-Parse-Token header.
+Requests with an Origin header, or a Host other than the loopback address,
+are refused, and POST bodies must be application/json. A web page can
+therefore neither submit jobs with a form or a text/plain fetch nor reach
+the service through DNS rebinding.
+"""
+
+import argparse
+import heapq
+import hmac
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import secrets
+import signal
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+DEFAULT_URL = os.environ.get('PARSE_SERVICE_URL', 'http://127.0.0.1:%d' % DEFAULT_PORT)
+DEFAULT_JOBS_DIR = "./.cache/jobs"
+TOKEN_FILE = os.environ.get('PARSE_SERVICE_TOKEN_FILE', "./.cache/parse-service.token")
+TOKEN_HEADER = 'X-Parse-Token'
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# states of a worker slot
+STARTING, READY, RESTARTING, DEAD = 'starting', 'ready', 'restarting', 'dead'
+# seconds to wait before each further attempt at restarting a worker
+RESTART_DELAYS = (1, 5, 15, 60)
+
+# what a submission may set, with defaults
+JOB_OPTIONS = {
+    'format': 'csv',
+    'priority': 0,
+    'chunk_files': 500,
+    'offline': False,
+    'pipelined': False,
+    'manifest': None,
+    'metrics_dir': None,
+}
+
+
+class JobError(ValueError):
+    pass
+
+
+class ServiceUnavailable(JobError):
+    pass
+
+
+class Job:
+    def __init__(self, inputs, output_dir, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.inputs = inputs
+        self.output_dir = output_dir
+        self.options = options
+        self.priority = options['priority']
+        self.state = QUEUED
+        self.files_parsed = 0
+        self.progress = 0.0
+        self.outputs = []
+        self.error = None
+        self.worker = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # bumped on every change, so followers know when to report
+        self.revision = 0
+
+    def request(self):
+        """The keyword arguments for BatchRunner.run."""
+        return {
+            'inputs': self.inputs,
+            'output_dir': self.output_dir,
+            'output_format': self.options['format'],
+            'chunk_files': self.options['chunk_files'],
+            'offline': self.options['offline'],
+            'pipelined': self.options['pipelined'],
+            'manifest_path': self.options['manifest'],
+            'metrics_dir': self.options['metrics_dir'],
+        }
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'priority': self.priority,
+            'inputs': self.inputs,
+            'output_dir': self.output_dir,
+            'options': self.options,
+            'files_parsed': self.files_parsed,
+            'progress': self.progress,
+            'outputs': self.outputs,
+            'error': self.error,
+            'worker': self.worker,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+def make_job(spec, jobs_dir):
+    if not isinstance(spec, dict):
+        raise JobError("expected a JSON object")
+    unknown = set(spec) - set(JOB_OPTIONS) - {'inputs', 'output_dir'}
+    if unknown:
+        raise JobError("unknown fields: %s" % ', '.join(sorted(unknown)))
+    inputs = spec.get('inputs')
+    if not inputs or not isinstance(inputs, list) or not all(isinstance(i, str) for i in inputs):
+        raise JobError("inputs must be a non-empty list of paths")
+    options = {name: spec.get(name, default) for name, default in JOB_OPTIONS.items()}
+    from Writers import OUTPUT_FORMATS
+    if options['format'] not in OUTPUT_FORMATS:
+        raise JobError("format must be one of %s" % ', '.join(OUTPUT_FORMATS))
+    if not isinstance(options['priority'], int):
+        raise JobError("priority must be an integer")
+    job = Job([os.path.abspath(i) for i in inputs], None, options)
+    job.output_dir = os.path.abspath(spec.get('output_dir') or os.path.join(jobs_dir, job.id))
+    return job
+
+
+class JobQueue:
+    """Jobs by priority, highest first, then first come first served."""
+    def __init__(self):
+        self.heap = []
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, job):
+        with self.condition:
+            heapq.heappush(self.heap, (-job.priority, next(self.order), job))
+            self.condition.notify()
+
+    def get(self):
+        """Blocks for the next job still queued, or returns None once closed."""
+        with self.condition:
+            while True:
+                while self.heap and self.heap[0][2].state != QUEUED:
+                    heapq.heappop(self.heap)
+                if self.heap:
+                    return heapq.heappop(self.heap)[2]
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+    def __len__(self):
+        with self.condition:
+            return sum(1 for _, _, job in self.heap if job.state == QUEUED)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class _JobProgress:
+    """BatchRunner progress that reports to the service instead of the console."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.last = -1
+
+    def progress(self, value):
+        percent = int(min(max(value, 0), 1) * 100)
+        if percent != self.last:
+            self.last = percent
+            self.connection.send(('progress', {'progress': percent / 100}))
+
+    def done(self, count):
+        self.connection.send(('progress', {'files_parsed': count}))
+
+    def close(self):
+        pass
+
+
+def _worker_main(connection, model_path):
+    # Ctrl+C is the service's to handle; it stops the workers in turn
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # loading happens once here, before the first job; BatchRunner.run then
+    # gets the same Parser back from ModelCache for every job
+    start = time.perf_counter()
+    try:
+        import BatchRunner
+        from Parser import get_parser
+        get_parser(show_progress=False, model_path=model_path)
+    except Exception:
+        connection.send(('failed', traceback.format_exc()))
+        return
+    connection.send(('ready', {'pid': os.getpid(), 'load_seconds': time.perf_counter() - start}))
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        try:
+            paths = BatchRunner.run(
+                model_path=model_path, quiet=True, progress=_JobProgress(connection), **request)
+        except Exception:
+            connection.send(('failed', traceback.format_exc()))
+        else:
+            connection.send(('done', paths))
+    connection.close()
+
+
+class _Worker:
+    def __init__(self, context, model_path):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, model_path), daemon=True)
+        self.process.start()
+        child.close()
+        self.info = None
+
+    def wait_ready(self):
+        try:
+            kind, info = self.connection.recv()
+        except EOFError:
+            kind, info = 'failed', "the worker exited while starting"
+        if kind != 'ready':
+            self.stop()
+            raise RuntimeError("A parse worker failed to start:\n%s" % info)
+        self.info = info
+        return info
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ParseService:
+    def __init__(self, workers=1, model_path=None, jobs_dir=DEFAULT_JOBS_DIR):
+        from ModelCache import DEFAULT_MODEL_PATH
+        self.worker_count = max(1, workers)
+        self.model_path = model_path or DEFAULT_MODEL_PATH
+        self.jobs_dir = jobs_dir
+        self.jobs = {}
+        self.queue = JobQueue()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [None] * self.worker_count
+        self.slots = [STARTING] * self.worker_count
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """Starts the workers, returning once all have loaded the parser."""
+        workers = [_Worker(self.context, self.model_path) for _ in range(self.worker_count)]
+        try:
+            for slot, worker in enumerate(workers):
+                self.ready(slot, worker)
+        except RuntimeError:
+            for worker in workers:
+                worker.stop()
+            raise
+        for slot in range(self.worker_count):
+            thread = threading.Thread(target=self.dispatch, args=(slot,), name='dispatch-%d' % slot, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.queue.close()
+        for thread in self.threads:
+            thread.join()
+
+    def start_worker(self, slot):
+        return self.ready(slot, _Worker(self.context, self.model_path))
+
+    def ready(self, slot, worker):
+        info = worker.wait_ready()
+        with self.lock:
+            self.workers[slot] = worker
+            self.slots[slot] = READY
+        print("Worker %d ready (pid %d, loaded in %.1fs)" % (slot, info['pid'], info['load_seconds']), file=sys.stderr)
+        return worker
+
+    def restart_worker(self, slot):
+        """Starts the worker in slot again, retrying after each of
+        RESTART_DELAYS. Returns None if it never comes up or the service is
+        stopping; the slot is dead after that."""
+        with self.lock:
+            self.workers[slot] = None
+            self.slots[slot] = RESTARTING
+        for delay in (0,) + RESTART_DELAYS:
+            if self.stopping.wait(delay):
+                return None
+            try:
+                return self.start_worker(slot)
+            except Exception:
+                print("Worker %d failed to restart:\n%s" % (slot, traceback.format_exc()), file=sys.stderr)
+        print("Giving up on worker %d" % slot, file=sys.stderr)
+        with self.changed:
+            self.slots[slot] = DEAD
+            if all(state == DEAD for state in self.slots):
+                self.fail_queued("no parse workers could be started")
+        return None
+
+    def fail_queued(self, error):
+        # called with the lock held
+        now = time.time()
+        for job in self.jobs.values():
+            if job.state == QUEUED:
+                job.state, job.finished, job.error = FAILED, now, error
+                job.revision += 1
+        self.changed.notify_all()
+
+    def dispatch(self, slot):
+        """Feeds jobs to one worker process, starting it again if it dies."""
+        worker = self.workers[slot]
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+                if not self.claim(job, worker.info['pid']):
+                    continue
+                worker.connection.send(job.request())
+                while True:
+                    try:
+                        kind, value = worker.connection.recv()
+                    except EOFError:
+                        kind, value = 'exited', None
+                    if kind == 'exited':
+                        self.update(job, state=FAILED, finished=time.time(),
+                                    error="worker %d exited while parsing" % worker.info['pid'])
+                        worker.stop()
+                        worker = self.restart_worker(slot)
+                        if worker is None:
+                            return
+                        break
+                    elif kind == 'progress':
+                        self.update(job, **value)
+                    elif kind == 'done':
+                        self.update(job, state=DONE, finished=time.time(), outputs=[list(p) for p in value])
+                        break
+                    elif kind == 'failed':
+                        self.update(job, state=FAILED, finished=time.time(), error=value)
+                        break
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def update(self, job, **changes):
+        with self.changed:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.revision += 1
+            self.changed.notify_all()
+
+    def claim(self, job, pid):
+        # a job cancelled after leaving the queue mustn't start
+        with self.changed:
+            if job.state != QUEUED:
+                return False
+            job.state, job.started, job.worker = RUNNING, time.time(), pid
+            job.revision += 1
+            self.changed.notify_all()
+        return True
+
+    def submit(self, spec):
+        job = make_job(spec, self.jobs_dir)
+        with self.lock:
+            # checked under the lock, so a job can't slip in after fail_queued
+            if all(state == DEAD for state in self.slots):
+                raise ServiceUnavailable("no parse workers are running")
+            self.jobs[job.id] = job
+            self.queue.put(job)
+        return job
+
+    def cancel(self, job):
+        with self.changed:
+            if job.state != QUEUED:
+                return False
+            job.state = CANCELLED
+            job.finished = time.time()
+            job.revision += 1
+            self.changed.notify_all()
+        return True
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def follow(self, job, heartbeat=15):
+        """Yields the job as a dict whenever it changes (or every heartbeat
+        seconds), ending with its finished state."""
+        revision = None
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: job.revision != revision, timeout=heartbeat)
+                revision = job.revision
+                snapshot = job.as_dict()
+            yield snapshot
+            if snapshot['state'] in FINISHED:
+                return
+
+    def health(self):
+        with self.lock:
+            workers = [dict(worker.info if worker is not None else {}, slot=slot, state=state)
+                       for slot, (worker, state) in enumerate(zip(self.workers, self.slots))]
+            running = sum(1 for job in self.jobs.values() if job.state == RUNNING)
+        return {'workers': workers,
+                'ready': sum(1 for worker in workers if worker['state'] == READY),
+                'starting': sum(1 for worker in workers if worker['state'] in (STARTING, RESTARTING)),
+                'dead': sum(1 for worker in workers if worker['state'] == DEAD),
+                'queued': len(self.queue), 'running': running, 'model_path': self.model_path}
+
+
+def write_token(path):
+    """Writes a new random token to path, readable by the owner only."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write(token)
+    return token
+
+
+def read_token(path):
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    JOB_PATH = re.compile(r'^/jobs/([0-9a-f]+)(/events)?$')
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def refused(self, json_body=False):
+        """Answers and returns True unless the request comes from a client of
+        this service: one that has read the token and isn't a browser page."""
+        port = self.server.server_address[1]
+        if self.headers.get('Host') not in ('127.0.0.1:%d' % port, 'localhost:%d' % port):
+            self.send_json(403, {'error': 'unexpected Host header'})
+        elif 'Origin' in self.headers:
+            self.send_json(403, {'error': 'cross-origin requests are not accepted'})
+        elif not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.server.token):
+            self.send_json(403, {'error': 'missing or wrong %s; it is in %s' % (TOKEN_HEADER, self.server.token_file)})
+        elif json_body and self.headers.get_content_type() != 'application/json':
+            self.send_json(415, {'error': 'expected application/json'})
+        else:
+            return False
+        return True
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def find_job(self):
+        match = self.JOB_PATH.match(self.path)
+        job = self.service.get(match.group(1)) if match else None
+        if job is None:
+            self.send_json(404, {'error': 'no such job'})
+        return job, match
+
+    def do_GET(self):
+        if self.refused():
+            return
+        if self.path == '/health':
+            return self.send_json(200, self.service.health())
+        if self.path == '/jobs':
+            with self.service.lock:
+                jobs = [job.as_dict() for job in self.service.jobs.values()]
+            return self.send_json(200, jobs)
+        job, match = self.find_job()
+        if job is None:
+            return
+        if not match.group(2):
+            return self.send_json(200, job.as_dict())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for snapshot in self.service.follow(job):
+                self.wfile.write(json.dumps(snapshot).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        if self.refused(json_body=True):
+            return
+        if self.path != '/jobs':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = self.service.submit(json.loads(self.rfile.read(length) or b'null'))
+        except ServiceUnavailable as error:
+            return self.send_json(503, {'error': str(error)})
+        except (ValueError, JobError) as error:
+            return self.send_json(400, {'error': str(error)})
+        self.send_json(201, job.as_dict())
+
+    def do_DELETE(self):
+        if self.refused():
+            return
+        job, match = self.find_job()
+        if job is None:
+            return
+        if not self.service.cancel(job):
+            return self.send_json(409, {'error': 'job is %s' % job.state})
+        self.send_json(200, job.as_dict())
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service, port=DEFAULT_PORT, verbose=False, token_file=TOKEN_FILE):
+    # workers load before the port opens, so clients never wait on start-up
+    service.start()
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    except OSError:
+        service.stop()
+        raise
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    server.token_file = token_file
+    server.token = write_token(token_file)
+    print("Parse service listening on http://127.0.0.1:%d (token in %s)" % (server.server_address[1], token_file),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        # only remove the token if a later start hasn't replaced it
+        if read_token(token_file) == server.token:
+            os.remove(token_file)
+
+
+class ParseClient:
+    """Submits jobs to a running ParseService and follows them."""
+    def __init__(self, url=DEFAULT_URL, timeout=10, token_file=TOKEN_FILE):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.token_file = token_file
+
+    def headers(self):
+        # read on every call, since each start of the service makes a new token
+        return {'Content-Type': 'application/json', TOKEN_HEADER: read_token(self.token_file) or ''}
+
+    def call(self, method, path, body=None, timeout=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=self.headers())
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as error:
+            raise JobError(json.load(error).get('error', str(error)))
+
+    def available(self):
+        try:
+            self.call('GET', '/health', timeout=1)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def health(self):
+        return self.call('GET', '/health')
+
+    def submit(self, inputs, output_dir=None, **options):
+        """Queues a job; options are those of JOB_OPTIONS. Returns the job."""
+        spec = dict(options, inputs=[os.path.abspath(i) for i in inputs])
+        if output_dir:
+            spec['output_dir'] = os.path.abspath(output_dir)
+        return self.call('POST', '/jobs', spec)
+
+    def job(self, job_id):
+        return self.call('GET', '/jobs/' + job_id)
+
+    def cancel(self, job_id):
+        return self.call('DELETE', '/jobs/' + job_id)
+
+    def events(self, job_id):
+        """Yields the job each time it changes, ending once it has finished."""
+        request = urllib.request.Request(self.url + '/jobs/%s/events' % job_id, headers=self.headers())
+        with urllib.request.urlopen(request) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    def wait(self, job_id, on_update=None):
+        """Follows the job to the end and returns its final state."""
+        job = None
+        for job in self.events(job_id):
+            if on_update: on_update(job)
+        return job
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description="Run the local parse service with warm worker processes.")
+    arguments.add_argument('-w', '--workers', type=int, default=1, help="worker processes, one job each (default 1)")
+    arguments.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help="port on 127.0.0.1 (default %d)" % DEFAULT_PORT)
+    arguments.add_argument('--model', default=None, help="spaCy model directory (default ./models/en/)")
+    arguments.add_argument('--jobs-dir', default=DEFAULT_JOBS_DIR,
+                           help="where jobs without an output_dir write (default %s)" % DEFAULT_JOBS_DIR)
+    arguments.add_argument('--token-file', default=TOKEN_FILE,
+                           help="where clients find the access token (default %s)" % TOKEN_FILE)
+    arguments.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = arguments.parse_args(argv)
+    try:
+        serve(ParseService(workers=args.workers, model_path=args.model, jobs_dir=args.jobs_dir),
+              port=args.port, verbose=args.verbose, token_file=args.token_file)
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,41 +1,73 @@
 from FindingAidParser import * 
 from MODSParser import *
 from MARCParser import *
-import base64
+from ModelCache import DEFAULT_MODEL_PATH, get_resource, model_fingerprint
+from LookupCache import DEFAULT_CACHE_PATH, LookupCache
+from SearchWorksClient import SearchWorksClient
+from Writers import ColumnWriter, OutputDirectory
+from Metrics import metrics
+from InputFiles import buffer_of
+from XMLBackend import get_backend
 
 import os
-import xml.etree.ElementTree as ET
-
-from random import randint
-
-import copy
 import re
-import pandas as pd
+import shutil
+import tempfile
+import zipfile
 
 """
 Wrapper class for FindingAidParser, ModsParser, and any other type of parser
 """
 class Parser: 
-    def __init__(self, show_progress=True): 
-        self.finding_aid_parser = FindingAidParser()
-        self.mods_parser = MODSParser()
-        self.marc_parser = MARCParser()
+    def __init__(self, show_progress=True, model_path=DEFAULT_MODEL_PATH, xml_backend=None, lookup_cache_path=DEFAULT_CACHE_PATH): 
+        self.xml = get_backend(xml_backend)
+        # SearchWorks answers are kept in lookup_cache_path across runs; None
+        # looks every title up again
+        cache = LookupCache(lookup_cache_path) if lookup_cache_path else None
+        self.finding_aid_parser = FindingAidParser(
+            model_path=model_path, searchworks=SearchWorksClient(cache=cache), xml_backend=self.xml.name)
+        self.mods_parser = MODSParser(xml_backend=self.xml.name)
+        self.marc_parser = MARCParser(xml_backend=self.xml.name)
         self.show_progress = show_progress
     
     def __get_namespace(self, root):
         m = re.match(r'\{.*\}', root.tag)
         return m.group(0) if m else ''
 
-    def parse(self, files: list): 
+    def sniff_namespace(self, file, chunk_size=1024):
+        """Reads only as far as the root start tag and returns its namespace.
+        The file is rewound afterwards so the format parser can parse it once.
+        """
+        pull_parser = self.xml.pull_parser(events=('start',))
+        namespace = ''
+        try:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                pull_parser.feed(chunk)
+                root_event = next(pull_parser.read_events(), None)
+                if root_event:
+                    namespace = self.__get_namespace(root_event[1])
+                    break
+        finally:
+            file.seek(0)
+        return namespace
+
+    def classify(self, files, on_skip=None): 
+        """Sorts files by format. A file whose root can't be read is left out,
+        and reported with on_skip(name, error) if given."""
         finding_aids = []        
         mods = []
         marcs = []
 
         for file in files: 
-            xmlTree = ET.parse(copy.deepcopy(file))
-            
-            root = xmlTree.getroot()
-            namespace = self.__get_namespace(root) 
+            with metrics.stage('parser.classify'):
+                try:
+                    namespace = self.sniff_namespace(file)
+                except self.xml.errors as error:
+                    if on_skip: on_skip(file.name, error)
+                    continue
 
             if namespace == self.finding_aid_parser.namespace: 
                 finding_aids.append(file)
@@ -43,66 +75,190 @@ class Parser:
                 mods.append(file)
             elif namespace == self.marc_parser.namespace: 
                 marcs.append(file)
-    
-        finding_aid_res = []
-        mods_res = []
-        marcs_res = []
+        return finding_aids, marcs, mods
+
+    def parse_files(self, files, workers=None, writer_factory=None, progress_bar=None, manifest=None, on_skip=None): 
+        """Parses files by format without touching the page. Returns a list of
+        (format label, result) pairs. writer_factory(label), when given, returns
+        the writer each format's rows are streamed to and the result is that
+        writer, left open; otherwise results are columns.
+
+        With a ParseManifest, files whose bytes were parsed before by the same
+        parser and model version aren't parsed again: their stored rows are
+        written in their place among the rows of the files that did need
+        parsing, so either way rows come out in input order. on_skip is passed
+        to classify.
+        """
+        finding_aids, marcs, mods = self.classify(files, on_skip=on_skip)
+
+        batches = []
+        for label, parser, batch in ( 
+                ('Finding aids', self.finding_aid_parser, finding_aids), 
+                ('MARCS', self.marc_parser, marcs), 
+                ('MODS', self.mods_parser, mods)): 
+            if not batch: 
+                continue
+            to_parse, digests, cached = batch, {}, {}
+            if manifest is not None: 
+                to_parse, digests, cached = manifest.split(batch, parser.version_key())
+            batches.append((label, parser, batch, to_parse, digests, cached))
 
         res = []
-        size = len(finding_aids) + len(marcs) + len(mods)
+        size = sum(len(to_parse) for label, parser, batch, to_parse, digests, cached in batches)
         amount_done=0
-        progress_bar = None
-        if self.show_progress: progress_bar = st.progress(0)
 
-        if finding_aids: 
-            finding_aid_res = self.finding_aid_parser.batch_parse_xml(
-                finding_aids, 
-                progress_bar=progress_bar,
-                amount_done=amount_done,
-                size=size
-            )
-            res.append(
-                ('Finding aids', finding_aid_res)
-            )
-            amount_done += round(len(finding_aids)/size, 3)
+        for label, parser, batch, to_parse, digests, cached in batches: 
+            writer = writer_factory(label) if writer_factory else None
+            own_writer = manifest is not None and writer is None
+            if own_writer: 
+                writer = ColumnWriter()
+            if manifest is not None: 
+                writer = manifest.recorder(
+                    writer, batch, digests, cached, parser.version_key(), settled=getattr(parser, 'row_settled', None))
 
-        if marcs: 
-            marcs_res = self.marc_parser.batch_parse_xml(
-                marcs,
-                progress_bar=progress_bar,
-                amount_done=amount_done,
-                size=size)
+            with metrics.stage('parser.' + label.lower().replace(' ', '_'), len(to_parse)): 
+                batch_res = parser.batch_parse_xml(
+                    to_parse,
+                    progress_bar=progress_bar,
+                    amount_done=amount_done,
+                    size=size,
+                    workers=workers,
+                    writer=writer
+                )
+            if manifest is not None: 
+                writer.finish()
+                manifest.commit()
+                writer = writer.writer
+                batch_res = writer.close() if own_writer else writer
             res.append(
-                ('MARCS', marcs_res)
+                (label, batch_res)
             )
-            amount_done += round(len(marcs)/size, 3)
+            if size: 
+                amount_done += round(len(to_parse)/size, 3)
+        return res
 
-        if mods: 
-            mods_res = self.mods_parser.batch_parse_xml(
-                mods,
-                progress_bar=progress_bar,
-                amount_done=amount_done,
-                size=size
-            )
-            res.append(
-                ('MODS', mods_res)
-            )
-            amount_done += round(len(mods)/size, 3)
-        
+    def parse_to_files(self, files, output_dir, output_format='csv', workers=None, progress_bar=None, manifest=None, on_skip=None): 
+        """Streams each format's rows into output_dir/<label>.<format> and returns
+        (format label, path) pairs."""
+        outputs = OutputDirectory(output_dir, output_format)
+        try:
+            self.parse_files(
+                files, workers=workers, writer_factory=outputs, progress_bar=progress_bar, manifest=manifest,
+                on_skip=on_skip)
+        finally:
+            paths = outputs.close()
+        return paths
 
-        for r in res: 
-            df = pd.DataFrame(r[1])
-            st.markdown(self.get_table_download_link(df, r[0]+'.csv', r[0]), unsafe_allow_html=True)
+    def zip_outputs(self, outputs, archive_path): 
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive: 
+            for label, path in outputs: 
+                archive.write(path, arcname=os.path.basename(path))
+        return archive_path
 
-    
-    def get_table_download_link(self, df, filename, xml_type):
-        """Generates a link allowing the data in a given panda dataframe to be downloaded
-        in:  dataframe
-        out: href string
+    def new_output_dir(self): 
+        # one output directory per browser session, replaced on every parse
+        import streamlit as st
+        previous = st.session_state.get('output_dir')
+        if previous: 
+            shutil.rmtree(previous, ignore_errors=True)
+        st.session_state['output_dir'] = tempfile.mkdtemp(prefix='parsed-xml-')
+        return st.session_state['output_dir']
+
+    def parse(self, files: list, workers=None, compression=None): 
+        """Parses files and keeps the results for show_downloads. Rows are
+        written to files on the server and streamed from there; compression is
+        None for plain CSVs, 'gzip' for .csv.gz files, or 'zip' for one archive
+        holding every table.
         """
-        csv = df.to_csv(index=False)
-        b64 = base64.b64encode(csv.encode()).decode()  # some strings <-> bytes conversions necessary here
-        # href = f'<a href="data:file/csv;base64,{b64}">Download csv file</a>'
-        href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">Download {xml_type} csv files</a>'
-        # f'<a href="data:file/csv;base64,{b64}" download="myfilename.csv">Download csv file</a>'
-        return href
+        # only the page needs Streamlit; BatchRunner and the service use
+        # parse_files and parse_to_files without it
+        import streamlit as st
+        progress_bar = None
+        if self.show_progress: progress_bar = st.progress(0)
+
+        output_dir = self.new_output_dir()
+        output_format = 'csv.gz' if compression == 'gzip' else 'csv'
+        with metrics.stage('parser.parse', len(files)): 
+            res = self.parse_to_files(
+                files,
+                output_dir,
+                output_format=output_format,
+                workers=workers,
+                progress_bar=progress_bar,
+                on_skip=lambda name, error: st.warning("Skipped %s: %s" % (name, error)))
+
+            if compression == 'zip' and res: 
+                with metrics.stage('parser.zip'): 
+                    res = [('all', self.zip_outputs(res, os.path.join(output_dir, 'parsed.zip')))]
+
+        st.session_state['outputs'] = res
+        return res
+
+    def show_downloads(self): 
+        """Offers the last parse's results as downloads. The page calls this on
+        every rerun, not just the one that parsed, since clicking a download
+        button reruns the page and would otherwise take the other buttons
+        away."""
+        import streamlit as st
+        for label, path in st.session_state.get('outputs', []): 
+            if not os.path.exists(path): 
+                continue
+            with open(path, 'rb') as output: 
+                st.download_button(
+                    'Download %s' % ('all tables (zip)' if label == 'all' else label + ' csv files'),
+                    data=output,
+                    file_name=os.path.basename(path),
+                    mime=self.get_mime_type(path),
+                    key='download-' + os.path.basename(path))
+
+    def get_mime_type(self, path): 
+        if path.endswith('.zip'): 
+            return 'application/zip'
+        if path.endswith('.gz'): 
+            return 'application/gzip'
+        return 'text/csv'
+
+
+class ServiceParser(Parser): 
+    """Stands in for Parser in the front end when a ParseService is running:
+    parse() works the same, but the parsing itself is done by the service's
+    warm workers rather than in this process. Uploads are written once, from
+    their buffers, to the job's output directory for the service to read."""
+    def __init__(self, client, show_progress=True): 
+        self.client = client
+        self.show_progress = show_progress
+
+    def write_inputs(self, files, input_dir): 
+        os.makedirs(input_dir, exist_ok=True)
+        for file in files: 
+            file.seek(0)
+            with open(os.path.join(input_dir, os.path.basename(file.name)), 'wb') as output, buffer_of(file) as buffer: 
+                if buffer is not None: 
+                    output.write(buffer)
+                else: 
+                    shutil.copyfileobj(file, output)
+            file.seek(0)
+
+    def parse_to_files(self, files, output_dir, output_format='csv', workers=None, progress_bar=None, manifest=None, on_skip=None): 
+        # workers, manifest and reporting skipped files belong to the service
+        input_dir = os.path.join(output_dir, 'inputs')
+        self.write_inputs(files, input_dir)
+        job = self.client.submit([input_dir], output_dir, format=output_format)
+
+        def show(job): 
+            if progress_bar is not None: progress_bar.progress(job['progress'])
+
+        job = self.client.wait(job['id'], on_update=show)
+        if job['state'] != 'done': 
+            raise RuntimeError("Parse job %s %s: %s" % (job['id'], job['state'], job['error']))
+        return [tuple(output) for output in job['outputs']]
+
+
+def get_parser(show_progress=True, model_path=DEFAULT_MODEL_PATH, lookup_cache_path=DEFAULT_CACHE_PATH):
+    """Returns a warm Parser shared by every caller in this process. A new one is
+    only built when the arguments or the model files on disk change."""
+    return get_resource(
+        'parser',
+        (show_progress, os.path.abspath(model_path), lookup_cache_path and os.path.abspath(lookup_cache_path)),
+        model_fingerprint(model_path),
+        lambda: Parser(show_progress=show_progress, model_path=model_path, lookup_cache_path=lookup_cache_path))
@@ -0,0 +1,156 @@
+"""
+Row types the parsers return. Each parsed record is a new frozen dataclass with
+__slots__, so rows are small, can't be changed by whoever receives them, and
+parsers don't keep any per-record state between calls. Writers take these or
+plain dicts (e.g. rows read back from a ParseManifest), since both have
+items().
+
+ColumnBuffer collects many rows column by column for bulk results. Each column
+is an array of indexes into one table of distinct values, so a million rows
+cost a few bytes per cell instead of a million dicts, and repeated values such
+as empty fields or a common publisher are stored once.
+"""
+
+from array import array
+from collections.abc import Mapping
+from dataclasses import dataclass, replace
+
+
+class RowRecord:
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls):
+        # the slots are the dataclass fields, in order
+        return cls.__slots__
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.columns())
+
+    def items(self):
+        return zip(self.columns(), self.values())
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def replace(self, **changes):
+        return replace(self, **changes)
+
+    def __reduce__(self):
+        # frozen slots can't be restored with setattr, so rows coming back
+        # from worker processes are rebuilt through the constructor
+        return (type(self), self.values())
+
+
+@dataclass(frozen=True)
+class FindingAidRecord(RowRecord):
+    __slots__ = ('full_description', 'description', 'title', 'label', 'inventory_number',
+                 'collection_creator', 'collection_size', 'url')
+    full_description: str
+    description: str
+    title: str
+    label: str
+    inventory_number: str
+    collection_creator: str
+    collection_size: str
+    url: str
+
+
+@dataclass(frozen=True)
+class MODSRecord(RowRecord):
+    __slots__ = ('title', 'uniform_title', 'subtitle', 'composer', 'arranger', 'instrumentalist',
+                 'performer', 'publisher', 'extent', 'date_issued', 'identifier')
+    title: str
+    uniform_title: str
+    subtitle: str
+    composer: str
+    arranger: str
+    instrumentalist: str
+    performer: str
+    publisher: str
+    extent: str
+    date_issued: str
+    identifier: str
+
+
+@dataclass(frozen=True)
+class MARCRecord(RowRecord):
+    __slots__ = ('title', 'subtitle', 'composer', 'arranger', 'instrumentalist', 'publisher', 'size',
+                 'catalog_number', 'date', 'identifier', 'collection', 'citation_a', 'citation_c', 'roll_type')
+    title: str
+    subtitle: str
+    composer: str
+    arranger: str
+    instrumentalist: str
+    publisher: str
+    size: str
+    catalog_number: str
+    date: str
+    identifier: str
+    collection: str
+    citation_a: str
+    citation_c: str
+    roll_type: str
+
+
+def row_columns(row):
+    if isinstance(row, RowRecord):
+        return row.columns()
+    return tuple(row)
+
+
+def as_dict(row):
+    if isinstance(row, RowRecord):
+        return row.as_dict()
+    return dict(row)
+
+
+class ColumnBuffer(Mapping):
+    """Column -> list of values for every row appended, stored as arrays of
+    indexes into a shared table of distinct values. Reads like the dict of
+    lists the parsers used to return."""
+    def __init__(self):
+        self.codes = {}
+        self.distinct = []
+        self.arrays = {}
+        self.rows = 0
+
+    def code(self, value):
+        try:
+            code = self.codes.get(value)
+        except TypeError:
+            # unhashable values (lists) are stored every time they appear
+            self.distinct.append(value)
+            return len(self.distinct) - 1
+        if code is None:
+            code = self.codes[value] = len(self.distinct)
+            self.distinct.append(value)
+        return code
+
+    def append(self, row):
+        for column, value in row.items():
+            codes = self.arrays.get(column)
+            if codes is None:
+                # a column first seen now is empty for the rows before it
+                codes = self.arrays[column] = array('I', [self.code(None)]) * self.rows
+            codes.append(self.code(value))
+        self.rows += 1
+        for codes in self.arrays.values():
+            if len(codes) < self.rows:
+                codes.append(self.code(None))
+
+    def __getitem__(self, column):
+        distinct = self.distinct
+        return [distinct[code] for code in self.arrays[column]]
+
+    def __iter__(self):
+        return iter(self.arrays)
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def row(self, index):
+        return {column: self.distinct[codes[index]] for column, codes in self.arrays.items()}
+
+    def nbytes(self):
+        return sum(codes.itemsize * len(codes) for codes in self.arrays.values())
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Metrics import metrics
+
+SEARCHWORKS_URL = "https://searchworks.stanford.edu/"
+
+
+class SearchWorksClient:
+    """
+    Looks up finding aid URLs on SearchWorks by collection title. A single pooled
+    session is shared by every lookup, each request is bounded by connect/read
+    timeouts, and transient failures are retried with exponential backoff.
+    base_url can point at a local stand-in server for testing.
+
+    With a LookupCache, resolved titles (including ones with no match) are
+    served from the cache; offline=True never touches the network and treats
+    anything uncached as having no URL.
+    """
+    def __init__(
+        self,
+        base_url=SEARCHWORKS_URL,
+        timeout=(3.05, 10),
+        retries=3,
+        backoff_factor=0.5,
+        max_workers=8,
+        cache=None,
+        offline=False):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_workers = max_workers
+        self.cache = cache
+        self.offline = offline
+        self.session = self.make_session()
+
+    def make_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=self.max_workers)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def __getstate__(self):
+        # Sessions hold sockets, so worker processes build their own
+        state = self.__dict__.copy()
+        del state['session']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session = self.make_session()
+
+    def fetch(self, label):
+        with metrics.stage('http.searchworks'):
+            response = self.session.get(
+                self.base_url,
+                params={'q': label, 'format': 'json'},
+                timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        finding_aid_url = ''
+        docs = data.get('response', {}).get('docs', [])
+        if len(docs) > 0:
+            try:
+                finding_aid_url = docs[0]['url_suppl'][0]
+            except (KeyError, IndexError):
+                pass
+        return finding_aid_url
+
+    def from_cache(self, label):
+        if self.cache is None:
+            return None
+        return self.cache.get(label)
+
+    def resolve(self, label):
+        if self.offline:
+            return ''
+        try:
+            finding_aid_url = self.fetch(label)
+        except (RequestException, ValueError):
+            # don't cache failures, only real answers
+            return ''
+        if self.cache is not None:
+            self.cache.put(label, finding_aid_url)
+        return finding_aid_url
+
+    def settled(self, label):
+        """Whether the URL a lookup of label gave would be given again: always
+        offline, otherwise when the cache holds an answer for label. A lookup
+        that failed isn't cached, so its blank URL isn't settled."""
+        if self.offline:
+            return True
+        return self.cache is not None and self.cache.peek(label) is not None
+
+    def lookup(self, label):
+        cached = self.from_cache(label)
+        if cached is not None:
+            return cached
+        return self.resolve(label)
+
+    def lookup_many(self, labels, on_done=None):
+        """Looks up every label and returns the URLs in the same order. Cached
+        labels are answered straight away; the rest are fetched concurrently.
+        on_done() is called from this thread as each label resolves."""
+        results = [''] * len(labels)
+        positions = {}
+        for i, label in enumerate(labels):
+            positions.setdefault(label, []).append(i)
+
+        def fill(label, url):
+            for i in positions[label]:
+                results[i] = url
+                if on_done: on_done()
+
+        pending = []
+        for label in positions:
+            cached = self.from_cache(label)
+            if cached is None:
+                pending.append(label)
+            else:
+                fill(label, cached)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {pool.submit(self.resolve, label): label for label in pending}
+                for future in as_completed(futures):
+                    fill(futures[future], future.result())
+        return results
@@ -0,0 +1,123 @@
+"""
+Process pool used by the parsers' batch_parse_xml when workers > 1. Each worker
+builds its own parser (and so loads the spaCy pipeline) once in the pool
+initializer, then parses whole files sent to it as (name, bytes) payloads.
+
+A pool normally lasts for one parallel_parse call. Inside a reuse_pools()
+block it's kept and handed to every later call for the same parser class and
+worker count, so a run parsed in chunks (see BatchRunner) starts its workers
+and loads their models once rather than once per chunk.
+"""
+
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from InputFiles import NamedBuffer, open_local
+
+_worker_parser = None
+
+# (parser class, workers) -> pool, while a reuse_pools() block is open
+_pools = None
+
+
+def _init_worker(parser_class, parser_kwargs):
+    global _worker_parser
+    _worker_parser = parser_class(**parser_kwargs)
+
+
+def _parse_payload(payload, method):
+    name, data, path = payload
+    parse = getattr(_worker_parser, method)
+    if path is not None:
+        with open_local(path, name) as file:
+            return parse(file)
+    return parse(NamedBuffer(data, name))
+
+
+def file_size(file):
+    if isinstance(file, str):
+        return os.path.getsize(file)
+    size = getattr(file, 'size', None)
+    if size is not None:
+        return size
+    position = file.tell()
+    size = file.seek(0, io.SEEK_END)
+    file.seek(position)
+    return size
+
+
+def to_payload(file):
+    # Local files are opened (and mapped, if large) by the worker itself, so
+    # only in-memory uploads are shipped over
+    if isinstance(file, str):
+        return (file, None, file)
+    path = getattr(file, 'path', None)
+    if path is not None:
+        return (file.name, None, path)
+    file.seek(0)
+    return (file.name, file.read(), None)
+
+
+@contextmanager
+def reuse_pools():
+    """Keeps the pools parallel_parse starts inside the block and shuts them
+    down on leaving it. The parsers' settings mustn't change inside the block,
+    since a kept pool's workers were built with the settings of the first
+    call. Nested blocks share the outermost one's pools."""
+    global _pools
+    if _pools is not None:
+        yield
+        return
+    _pools = {}
+    try:
+        yield
+    finally:
+        pools, _pools = _pools, None
+        for pool in pools.values():
+            pool.shutdown()
+
+
+def _start_pool(parser_class, parser_kwargs, workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(parser_class, parser_kwargs))
+
+
+def parallel_parse(parser_class, parser_kwargs, files, workers, on_done=None, method='parse_xml'):
+    """Parses files across a pool of worker processes, largest first, and
+    returns the results in the same order as files. Each worker calls the
+    parser's method (parse_xml by default) on one file at a time. on_done() is
+    called in this process each time a file finishes, e.g. to advance a
+    progress bar.
+    """
+    results = [None] * len(files)
+    largest_first = sorted(range(len(files)), key=lambda i: file_size(files[i]), reverse=True)
+
+    key = (parser_class, workers)
+    kept = _pools is not None
+    pool = _pools.get(key) if kept else None
+    if pool is None:
+        pool = _start_pool(parser_class, parser_kwargs, workers)
+        if kept:
+            _pools[key] = pool
+    try:
+        futures = {pool.submit(_parse_payload, to_payload(files[i]), method): i for i in largest_first}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_done: on_done()
+    except BrokenProcessPool:
+        # a worker died; the next call starts a fresh pool
+        if kept:
+            del _pools[key]
+        pool.shutdown()
+        raise
+    finally:
+        if not kept:
+            pool.shutdown()
+    return results
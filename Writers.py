@@ -0,0 +1,163 @@
+"""
+Output writers for parsed rows. batch_parse_xml hands every row (a record from
+Records, or a dict) to a writer as soon as it is ready, so a writer that goes
+to disk keeps memory flat no matter how many files are parsed. Every writer
+has write(row) and close(); close() returns what the batch produced (a
+ColumnBuffer for ColumnWriter, the output path for the file writers).
+batch_parse_xml only closes the ColumnWriter it makes for itself; writers
+passed in are left open for the caller to close. After the last row of each
+input file it calls file_done(file), which only matters to writers that track
+where rows came from.
+"""
+
+import abc
+import csv
+import gzip
+import os
+from collections import defaultdict
+
+from Metrics import metrics
+from Records import ColumnBuffer, row_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+class RowWriter(abc.ABC):
+    @abc.abstractmethod
+    def write(self, row):
+        pass
+
+    def file_done(self, file):
+        pass
+
+    def close(self):
+        pass
+
+
+class ColumnWriter(RowWriter):
+    """Keeps everything in memory as column -> values, the shape the parsers
+    have always returned, in a compact ColumnBuffer."""
+    def __init__(self):
+        self.columns = ColumnBuffer()
+
+    def write(self, row):
+        self.columns.append(row)
+
+    def close(self):
+        return self.columns
+
+
+class CSVWriter(RowWriter):
+    """Writes rows to a CSV file, gzip-compressed when compress is set or the
+    path ends in .gz. The file is flushed every chunk_rows rows."""
+    def __init__(self, path, compress=None, chunk_rows=1000):
+        self.path = path
+        if compress is None:
+            compress = path.endswith('.gz')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if compress:
+            self.file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.csv_writer = None
+
+    def write(self, row):
+        with metrics.stage('write.csv'):
+            if self.csv_writer is None:
+                self.fieldnames = row_columns(row)
+                self.csv_writer = csv.writer(self.file)
+                self.csv_writer.writerow(self.fieldnames)
+            if isinstance(row, dict):
+                self.csv_writer.writerow([row.get(k, '') for k in self.fieldnames])
+            else:
+                self.csv_writer.writerow(row.values())
+        self.rows += 1
+        if self.rows % self.chunk_rows == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+        return self.path
+
+
+class ParquetWriter(RowWriter):
+    """Writes rows to a Parquet file as one Arrow record batch per chunk_rows
+    rows. Needs pyarrow."""
+    def __init__(self, path, chunk_rows=10000):
+        if pa is None:
+            raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.chunk_rows = chunk_rows
+        self.buffer = defaultdict(list)
+        self.buffered = 0
+        self.schema = None
+        self.parquet_writer = None
+
+    def write(self, row):
+        for k, v in row.items():
+            self.buffer[k].append('' if v is None else str(v))
+        self.buffered += 1
+        if self.buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        if self.schema is None:
+            self.schema = pa.schema([(k, pa.string()) for k in self.buffer])
+            self.parquet_writer = pq.ParquetWriter(self.path, self.schema)
+        with metrics.stage('write.parquet', self.buffered):
+            batch = pa.RecordBatch.from_pydict(dict(self.buffer), schema=self.schema)
+            self.parquet_writer.write_table(pa.Table.from_batches([batch]))
+        self.buffer = defaultdict(list)
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        return self.path
+
+
+OUTPUT_FORMATS = {
+    'csv': ('.csv', lambda path: CSVWriter(path, compress=False)),
+    'csv.gz': ('.csv.gz', lambda path: CSVWriter(path, compress=True)),
+    'parquet': ('.parquet', lambda path: ParquetWriter(path)),
+}
+
+
+def open_writer(output_dir, name, output_format='csv'):
+    """Opens a file writer for output_dir/name plus the format's extension."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format %r, expected one of %s" % (output_format, ', '.join(OUTPUT_FORMATS)))
+    extension, factory = OUTPUT_FORMATS[output_format]
+    return factory(os.path.join(output_dir, name + extension))
+
+
+class OutputDirectory:
+    """Opens one writer per format label in output_dir the first time it is
+    asked for, so it can be passed as Parser.parse_files' writer_factory across
+    several calls, and closes them all at the end."""
+    def __init__(self, output_dir, output_format='csv'):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.writers = {}
+
+    def __call__(self, label):
+        if label not in self.writers:
+            self.writers[label] = open_writer(self.output_dir, label, self.output_format)
+        return self.writers[label]
+
+    def close(self):
+        return [(label, writer.close()) for label, writer in self.writers.items()]
@@ -0,0 +1,145 @@
+"""
+The XML library the parsers read with. lxml is used when it is installed and
+the standard library's ElementTree otherwise; PARSER_XML_BACKEND=etree (or
+lxml) in the environment picks one explicitly. Both give the parsers the same
+element API (tag, text, get, iter, iteration over children) and the same ways
+of reading a file: parse(), iterparse(), pull_parser() and iter_records(),
+which streams the records of a collection. Each also has errors, the
+exceptions its parsers raise on malformed XML. parse() reads uploads and
+mapped files straight from their buffers (see InputFiles). Comments and
+processing instructions are dropped under lxml, so trees look the same as
+under ElementTree.
+
+Paths the parsers look up outside the FieldSpecs walk are written once with
+the prefixes in NAMESPACES, e.g. './/ead:unittitle', and compiled once per
+backend with compile(): an XPath object under lxml, a findall under
+ElementTree. Either way the result is a callable returning a list of
+elements.
+"""
+
+import functools
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from InputFiles import buffer_of
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# Shared by every parser's compiled paths
+NAMESPACES = {
+    'ead': 'urn:isbn:1-931666-22-9',
+    'mods': 'http://www.loc.gov/mods/v3',
+    'marc': 'http://www.loc.gov/MARC21/slim',
+}
+
+
+class ElementTreeBackend:
+    name = 'etree'
+    errors = (ElementTree.ParseError,)
+
+    def parse(self, file):
+        with buffer_of(file) as buffer:
+            if buffer is None:
+                return ElementTree.parse(file).getroot()
+            # expat reads the buffer in place rather than in copied chunks
+            parser = ElementTree.XMLParser()
+            parser.feed(buffer)
+            root = parser.close()
+        file.seek(0, os.SEEK_END)
+        return root
+
+    def iterparse(self, file, events=('end',)):
+        return ElementTree.iterparse(file, events=events)
+
+    def pull_parser(self, events=('end',)):
+        return ElementTree.XMLPullParser(events=events)
+
+    def iter_records(self, file, tag):
+        """Yields (element, is_root) for each element called tag, streaming,
+        and drops each one once the caller moves on so the tree never grows."""
+        context = ElementTree.iterparse(file, events=('start', 'end'))
+        _, root = next(context)
+        for event, element in context:
+            if event == 'end' and element.tag == tag:
+                yield element, element is root
+                element.clear()
+                if root is not element:
+                    root.clear()
+
+    @functools.lru_cache(maxsize=None)
+    def compile(self, path):
+        return lambda element: element.findall(path, NAMESPACES)
+
+
+class LxmlBackend:
+    name = 'lxml'
+    errors = (lxml_etree.XMLSyntaxError,) if lxml_etree is not None else ()
+
+    def __init__(self):
+        # lxml parsers mustn't be shared between threads
+        self.local = threading.local()
+
+    def parse(self, file):
+        parser = getattr(self.local, 'parser', None)
+        if parser is None:
+            parser = self.local.parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True)
+        with buffer_of(file) as buffer:
+            if buffer is None:
+                return lxml_etree.parse(file, parser).getroot()
+            root = lxml_etree.fromstring(buffer, parser)
+        file.seek(0, os.SEEK_END)
+        return root
+
+    def iterparse(self, file, events=('end',)):
+        return lxml_etree.iterparse(file, events=events, remove_comments=True, remove_pis=True)
+
+    def pull_parser(self, events=('end',)):
+        return lxml_etree.XMLPullParser(events=events, remove_comments=True, remove_pis=True)
+
+    def iter_records(self, file, tag):
+        # lxml filters on tag itself, so only the records' end events reach Python
+        for _, element in lxml_etree.iterparse(file, tag=tag, remove_comments=True, remove_pis=True):
+            parent = element.getparent()
+            yield element, parent is None
+            element.clear(keep_tail=True)
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+    @functools.lru_cache(maxsize=None)
+    def compile(self, path):
+        prefix, _, local = path.partition(':')
+        if prefix in NAMESPACES and local.isidentifier():
+            # a plain child step: iterchildren filters in C without the cost
+            # of evaluating an XPath expression
+            tag = '{%s}%s' % (NAMESPACES[prefix], local)
+            return lambda element: list(element.iterchildren(tag))
+        return lxml_etree.XPath(path, namespaces=NAMESPACES)
+
+
+BACKENDS = {'etree': ElementTreeBackend}
+if lxml_etree is not None:
+    BACKENDS['lxml'] = LxmlBackend
+
+DEFAULT_BACKEND = os.environ.get('PARSER_XML_BACKEND') or ('lxml' if lxml_etree is not None else 'etree')
+
+_backends = {}
+
+
+def get_backend(name=None):
+    """The backend called name, or the default one. Backends are shared, so
+    paths compiled by one parser are reused by every other."""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError("Unknown or unavailable XML backend %r (available: %s)" % (name, ', '.join(BACKENDS)))
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def available_backends():
+    return list(BACKENDS)
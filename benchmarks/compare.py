@@ -0,0 +1,74 @@
+"""
+Compares two benchmarks.run result files stage by stage and flags stages that
+got slower by more than the threshold. Exits with status 1 when anything
+regressed, so it can gate a CI job.
+
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline, candidate, threshold=0.1, noise_seconds=0.001):
+    """Returns (stage, baseline seconds, candidate seconds, ratio, status) rows.
+    A stage regressed when it is more than threshold slower and the difference
+    is above noise_seconds."""
+    rows = []
+    before, after = baseline['stages'], candidate['stages']
+    for stage in sorted(set(before) | set(after)):
+        if stage not in after:
+            rows.append((stage, before[stage]['seconds'], None, None, 'missing'))
+            continue
+        if stage not in before:
+            rows.append((stage, None, after[stage]['seconds'], None, 'new'))
+            continue
+        old, new = before[stage]['seconds'], after[stage]['seconds']
+        ratio = new / old if old else None
+        status = 'ok'
+        if ratio is not None and new - old > noise_seconds:
+            if ratio > 1 + threshold:
+                status = 'REGRESSION'
+        if ratio is not None and old - new > noise_seconds and ratio < 1 - threshold:
+            status = 'faster'
+        rows.append((stage, old, new, ratio, status))
+    return rows
+
+
+def format_seconds(value):
+    return '%10.4f' % value if value is not None else '%10s' % '-'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('baseline')
+    arg_parser.add_argument('candidate')
+    arg_parser.add_argument('--threshold', type=float, default=0.1, help="allowed slowdown, 0.1 is 10%% (default)")
+    arg_parser.add_argument('--noise', type=float, default=0.001, help="ignore differences below this many seconds")
+    args = arg_parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline['meta'].get('corpus') != candidate['meta'].get('corpus'):
+        print('warning: the runs used different corpus settings', file=sys.stderr)
+
+    rows = compare(baseline, candidate, args.threshold, args.noise)
+    print('%-28s %10s %10s %8s  %s' % ('stage', 'baseline', 'candidate', 'ratio', ''))
+    for stage, old, new, ratio, status in rows:
+        print('%-28s %s %s %8s  %s' % (
+            stage, format_seconds(old), format_seconds(new), '%.2fx' % ratio if ratio else '-', status))
+
+    regressions = [row for row in rows if row[4] == 'REGRESSION']
+    if regressions:
+        print('%d stage(s) regressed by more than %d%%' % (len(regressions), args.threshold * 100), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Generates synthetic EAD finding aids, MODS and MARCXML files for benchmarking.
+Everything is derived from the seed, so the same arguments always give the
+same corpus.
+
+    python -m benchmarks.corpus /tmp/corpus --ead 20 --mods 500 --marc 500 \
+        --mods-per-file 50 --marc-per-file 50 --dsc-depth 4 --marc-datafields 40
+"""
+
+import argparse
+import os
+import random
+from xml.sax.saxutils import escape
+
+EAD_NAMESPACE = "urn:isbn:1-931666-22-9"
+MODS_NAMESPACE = "http://www.loc.gov/mods/v3"
+MARC_NAMESPACE = "http://www.loc.gov/MARC21/slim"
+
+SURNAMES = ['Smith', 'Baker', 'Liszt', 'Joplin', 'Gershwin', 'Ellington', 'Schumann', 'Hernandez',
+            'Okafor', 'Nakamura', 'Ivanova', 'Dubois', 'Rossi', 'Novak', 'Larsen', 'Mehta']
+FORENAMES = ['Clara', 'Scott', 'George', 'Duke', 'Franz', 'Maria', 'Chidi', 'Yuki', 'Olga',
+             'Pierre', 'Lucia', 'Jan', 'Ingrid', 'Ravi', 'Ada', 'Louis']
+WORDS = ['piano', 'roll', 'recording', 'score', 'sheet', 'music', 'letters', 'photographs',
+         'programs', 'concert', 'opera', 'ragtime', 'waltz', 'correspondence', 'manuscript',
+         'broadside', 'phonograph', 'cylinder', 'player', 'orchestra', 'series', 'box']
+ROLES = ['composer', 'arranger', 'instrumentalist', 'performer', 'lyricist', 'publisher']
+
+
+class CorpusConfig:
+    """What to generate. Sizes are targets: a file's records are padded with
+    filler (notes, 500 fields, container list components) until the file is
+    at least that many kilobytes."""
+    def __init__(
+        self,
+        ead=10,
+        mods=100,
+        marc=100,
+        mods_per_file=1,
+        marc_per_file=1,
+        dsc_depth=3,
+        dsc_components=20,
+        abstract_sentences=4,
+        marc_datafields=20,
+        mods_names=4,
+        ead_kb=0,
+        mods_kb=0,
+        marc_kb=0,
+        seed=0):
+        self.ead = ead
+        self.mods = mods
+        self.marc = marc
+        self.mods_per_file = max(1, mods_per_file)
+        self.marc_per_file = max(1, marc_per_file)
+        self.dsc_depth = dsc_depth
+        self.dsc_components = dsc_components
+        self.abstract_sentences = abstract_sentences
+        self.marc_datafields = marc_datafields
+        self.mods_names = mods_names
+        self.ead_kb = ead_kb
+        self.mods_kb = mods_kb
+        self.marc_kb = marc_kb
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def person(rng):
+    return '%s, %s' % (rng.choice(SURNAMES), rng.choice(FORENAMES))
+
+
+def sentence(rng, words=10):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng, sentences):
+    return ' '.join(sentence(rng, rng.randint(6, 16)) for _ in range(sentences))
+
+
+def pad(parts, target_kb, filler):
+    """Appends filler() to parts until they add up to target_kb."""
+    size = sum(len(part) for part in parts)
+    while size < target_kb * 1024:
+        part = filler()
+        parts.append(part)
+        size += len(part)
+    return parts
+
+
+def ead_component(rng, level, depth):
+    tag = 'c%02d' % level
+    inner = ''
+    if level < depth:
+        inner = ead_component(rng, level + 1, depth)
+    return ('<%s level="file"><did><unittitle>%s</unittitle><container type="box">%d</container></did>%s</%s>'
+            % (tag, escape(sentence(rng, 4)), rng.randint(1, 99), inner, tag))
+
+
+def make_ead(rng, index, config):
+    title = rng.choice([
+        'The {0} Collection of Sheet Music',
+        '{0} Family Papers',
+        'Collection of {0} piano rolls',
+        '{0} and {1} Recordings',
+    ]).format(rng.choice(SURNAMES), rng.choice(SURNAMES))
+    forename, surname = rng.choice(FORENAMES), rng.choice(SURNAMES)
+    abstract = 'Collected by %s %s. %s' % (forename, surname, paragraph(rng, config.abstract_sentences))
+    header = ('<?xml version="1.0" encoding="UTF-8"?>\n<ead xmlns="%s"><eadheader><eadid>ars%04d</eadid>'
+              '<filedesc><titlestmt><titleproper>%s</titleproper></titlestmt></filedesc></eadheader>'
+              '<archdesc level="collection"><did><unittitle>%s</unittitle><unitid>ARS.%04d</unitid>'
+              '<physdesc><extent>%d boxes</extent>\n    <extent>%d linear feet</extent></physdesc>'
+              '<abstract>%s</abstract></did><scopecontent><head>Scope and Contents</head><p>%s</p></scopecontent><dsc>'
+              % (EAD_NAMESPACE, index, escape(title), escape(title), index, rng.randint(1, 40), rng.randint(1, 20),
+                 escape(abstract), escape(paragraph(rng, 3))))
+    parts = [header]
+    parts.extend(ead_component(rng, 1, config.dsc_depth) for _ in range(config.dsc_components))
+    pad(parts, config.ead_kb, lambda: ead_component(rng, 1, config.dsc_depth))
+    parts.append('</dsc></archdesc></ead>\n')
+    return ''.join(parts)
+
+
+def mods_record(rng, index, config, wrapped):
+    names = []
+    for i in range(config.mods_names):
+        usage = ' usage="primary"' if i == 0 else ''
+        role = 'composer' if i == 0 else rng.choice(ROLES)
+        names.append('<name type="personal"%s><namePart>%s</namePart><role><roleTerm type="text">%s</roleTerm></role></name>'
+                     % (usage, escape(person(rng)), role))
+    parts = ['<mods%s>' % ('' if wrapped else ' xmlns="%s"' % MODS_NAMESPACE),
+             '<titleInfo><title>%s</title><subTitle>%s</subTitle></titleInfo>' % (escape(sentence(rng, 4)), escape(sentence(rng, 3))),
+             '<titleInfo type="uniform"><title>%s</title></titleInfo>' % escape(sentence(rng, 3)),
+             ''.join(names),
+             '<originInfo><publisher>%s</publisher><dateIssued>%d</dateIssued></originInfo>' % (escape(person(rng)), rng.randint(1880, 1960)),
+             '<physicalDescription><extent>1 roll</extent></physicalDescription>',
+             '<genre>piano rolls</genre>',
+             '<note>%s</note><note type="performers">%s</note>' % (escape(sentence(rng)), escape(person(rng))),
+             '<identifier type="local">druid:bb%09d</identifier>' % index,
+             '<recordInfo><recordIdentifier source="SIRSI">a%08d</recordIdentifier></recordInfo>' % index]
+    pad(parts, config.mods_kb / config.mods_per_file, lambda: '<note>%s</note>' % escape(sentence(rng, 20)))
+    parts.append('</mods>')
+    return ''.join(parts)
+
+
+def marc_record(rng, index, config):
+    fields = [
+        '<controlfield tag="001">a%08d</controlfield>' % index,
+        '<controlfield tag="008">850101s%4d    xx</controlfield>' % rng.randint(1880, 1960),
+        '<datafield tag="035" ind1=" " ind2=" "><subfield code="a">(OCoLC)%d</subfield></datafield>' % index,
+        '<datafield tag="100" ind1="1" ind2=" "><subfield code="a">%s,</subfield><subfield code="e">composer.</subfield></datafield>' % escape(person(rng)),
+        '<datafield tag="245" ind1="1" ind2="0"><subfield code="a">%s</subfield><subfield code="b">%s</subfield></datafield>'
+        % (escape(sentence(rng, 4)), escape(sentence(rng, 3))),
+        '<datafield tag="264" ind1=" " ind2="1"><subfield code="b">%s,</subfield></datafield>' % escape(person(rng)),
+        '<datafield tag="300" ind1=" " ind2=" "><subfield code="c">%d in.</subfield></datafield>' % rng.randint(10, 14),
+        '<datafield tag="028" ind1=" " ind2=" "><subfield code="a">%d</subfield></datafield>' % rng.randint(1000, 99999),
+    ]
+    for i in range(max(0, config.marc_datafields - len(fields))):
+        tag = rng.choice(['500', '510', '650', '690', '700', '856'])
+        if tag == '700':
+            fields.append('<datafield tag="700" ind1="1" ind2=" "><subfield code="a">%s,</subfield><subfield code="e">%s.</subfield></datafield>'
+                          % (escape(person(rng)), rng.choice(ROLES)))
+        else:
+            fields.append('<datafield tag="%s" ind1=" " ind2=" "><subfield code="a">%s</subfield><subfield code="c">%s</subfield></datafield>'
+                          % (tag, escape(sentence(rng, 6)), escape(sentence(rng, 2))))
+    pad(fields, config.marc_kb / config.marc_per_file,
+        lambda: '<datafield tag="500" ind1=" " ind2=" "><subfield code="a">%s</subfield></datafield>' % escape(sentence(rng, 20)))
+    return '<record>%s</record>' % ''.join(fields)
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    return path
+
+
+def generate(output_dir, config):
+    """Writes the corpus to output_dir and returns the file paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(config.seed)
+    paths = []
+
+    for i in range(config.ead):
+        paths.append(write(os.path.join(output_dir, 'ARS-%04d.xml' % i), make_ead(rng, i, config)))
+
+    for start in range(0, config.mods, config.mods_per_file):
+        count = min(config.mods_per_file, config.mods - start)
+        if config.mods_per_file == 1:
+            text = mods_record(rng, start, config, wrapped=False)
+            name = 'druid_bb%09d.xml' % start
+        else:
+            text = ('<modsCollection xmlns="%s">%s</modsCollection>'
+                    % (MODS_NAMESPACE, ''.join(mods_record(rng, start + i, config, wrapped=True) for i in range(count))))
+            name = 'mods-collection-%06d.xml' % start
+        paths.append(write(os.path.join(output_dir, name), '<?xml version="1.0" encoding="UTF-8"?>\n' + text))
+
+    for start in range(0, config.marc, config.marc_per_file):
+        count = min(config.marc_per_file, config.marc - start)
+        records = ''.join(marc_record(rng, start + i, config) for i in range(count))
+        if config.marc_per_file == 1:
+            text = records.replace('<record>', '<record xmlns="%s">' % MARC_NAMESPACE, 1)
+            name = 'a%08d.xml' % start
+        else:
+            text = '<collection xmlns="%s">%s</collection>' % (MARC_NAMESPACE, records)
+            name = 'marc-collection-%06d.xml' % start
+        paths.append(write(os.path.join(output_dir, name), '<?xml version="1.0" encoding="UTF-8"?>\n' + text))
+    return paths
+
+
+def add_arguments(arg_parser):
+    defaults = CorpusConfig()
+    arg_parser.add_argument('--ead', type=int, default=defaults.ead, help="finding aids")
+    arg_parser.add_argument('--mods', type=int, default=defaults.mods, help="MODS records")
+    arg_parser.add_argument('--marc', type=int, default=defaults.marc, help="MARC records")
+    arg_parser.add_argument('--mods-per-file', type=int, default=defaults.mods_per_file,
+                            help="MODS records per file; more than 1 wraps them in a modsCollection")
+    arg_parser.add_argument('--marc-per-file', type=int, default=defaults.marc_per_file,
+                            help="MARC records per file; more than 1 wraps them in a collection")
+    arg_parser.add_argument('--dsc-depth', type=int, default=defaults.dsc_depth, help="nesting of <dsc> components")
+    arg_parser.add_argument('--dsc-components', type=int, default=defaults.dsc_components, help="top level <dsc> components")
+    arg_parser.add_argument('--abstract-sentences', type=int, default=defaults.abstract_sentences)
+    arg_parser.add_argument('--marc-datafields', type=int, default=defaults.marc_datafields, help="datafields per MARC record")
+    arg_parser.add_argument('--mods-names', type=int, default=defaults.mods_names, help="<name> entries per MODS record")
+    arg_parser.add_argument('--ead-kb', type=float, default=defaults.ead_kb, help="minimum finding aid size")
+    arg_parser.add_argument('--mods-kb', type=float, default=defaults.mods_kb, help="minimum MODS file size")
+    arg_parser.add_argument('--marc-kb', type=float, default=defaults.marc_kb, help="minimum MARC file size")
+    arg_parser.add_argument('--seed', type=int, default=defaults.seed)
+
+
+def config_from_args(args):
+    return CorpusConfig(**{name: getattr(args, name) for name in CorpusConfig().as_dict()})
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('output_dir')
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    paths = generate(args.output_dir, config_from_args(args))
+    print('%d files, %.1f MB in %s' % (
+        len(paths), sum(os.path.getsize(p) for p in paths) / 1e6, args.output_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares MARCParser's single-pass field extraction (see FieldSpecs) against
+the repeated findall scans the getters used to do, on records with many
+datafields.
+
+    python -m benchmarks.marc_index
+"""
+
+import argparse
+import random
+import timeit
+import xml.etree.ElementTree as ET
+
+from MARCParser import MARCParser
+
+NAMESPACE = "{http://www.loc.gov/MARC21/slim}"
+
+# (tag, code, occurrence) of every datafield lookup parse_root used to make,
+# one root.findall per entry
+LEGACY_LOOKUPS = [
+    ('245', 'a', 0), ('245', 'b', 0),
+    ('100', 'a', 0), ('100', 'e', 0), ('100', 'e', 0),
+    ('700', None, 0), ('700', None, 0),
+    ('264', 'b', 0), ('300', 'c', 0), ('028', 'a', 0),
+    ('690', 'a', 0), ('510', 'a', 0), ('510', 'c', 0), ('500', 'a', 1),
+]
+
+
+def make_record(datafields, seed=0):
+    rng = random.Random(seed)
+    record = ET.Element(NAMESPACE + 'record')
+    control = ET.SubElement(record, NAMESPACE + 'controlfield', tag='008')
+    control.text = '850101s1925    xx'
+    tags = ['100', '245', '264', '300', '028', '500', '510', '690', '700', '650', '856']
+    for i in range(datafields):
+        field = ET.SubElement(record, NAMESPACE + 'datafield', tag=rng.choice(tags))
+        for code in 'abce'[:rng.randint(1, 4)]:
+            subfield = ET.SubElement(field, NAMESPACE + 'subfield', code=code)
+            subfield.text = 'Value %d%s, arranger' % (i, code)
+    return record
+
+
+def legacy_scan(root):
+    for tag, code, occurrence in LEGACY_LOOKUPS:
+        fields = root.findall(NAMESPACE + 'datafield[@tag="%s"]' % tag)
+        if code is None:
+            for field in fields:
+                for node in field.iter():
+                    node.text
+        elif len(fields) > occurrence:
+            fields[occurrence].findall(NAMESPACE + 'subfield[@code="%s"]' % code)
+    root.findall(NAMESPACE + 'controlfield[@tag="008"]')
+
+
+def indexed_scan(parser, root):
+    record = parser.extract_record(root)
+    parser.get_title(record)
+    parser.get_subtitle(record)
+    parser.get_composer(record)
+    parser.get_arranger_or_instrumentalist(record, 'arranger')
+    parser.get_arranger_or_instrumentalist(record, 'instrumentalist')
+    parser.get_publisher_info(record)
+    parser.get_size(record)
+    parser.get_catalog_number(record)
+    parser.get_date(record)
+    parser.get_collection(record)
+    parser.get_citation_a(record)
+    parser.get_citation_c(record)
+    parser.get_roll_type(record)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 2000])
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    parser = MARCParser()
+    print('%10s %14s %14s %8s' % ('datafields', 'findall (ms)', 'one pass (ms)', 'speedup'))
+    for size in args.sizes:
+        root = make_record(size)
+        number = max(1, 2000 // size)
+        legacy = min(timeit.repeat(lambda: legacy_scan(root), number=number, repeat=args.repeat)) / number
+        indexed = min(timeit.repeat(lambda: indexed_scan(parser, root), number=number, repeat=args.repeat)) / number
+        print('%10d %14.3f %14.3f %7.1fx' % (size, legacy * 1000, indexed * 1000, legacy / indexed))
+
+
+if __name__ == '__main__':
+    main()
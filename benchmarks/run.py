@@ -0,0 +1,252 @@
+"""
+Times every parser stage by stage on a synthetic corpus (see benchmarks.corpus)
+and saves the results as JSON, for comparing runs with benchmarks.compare.
+Finding aid URLs are looked up on a local stand-in for SearchWorks.
+
+    python -m benchmarks.run --output benchmarks/results/base.json --ead 20 --mods 500 --marc 500
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json
+
+The finding aid and Parser stages need spaCy and the model; without them only
+the MODS and MARC stages run. Parser.parse itself draws Streamlit widgets, so
+the Parser stages time parse_to_files, which is everything parse does short of
+offering the downloads.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import add_arguments, config_from_args, generate
+from benchmarks.searchworks_stub import StubSearchWorks
+from MARCParser import MARCParser
+from MODSParser import MODSParser
+from InputFiles import NamedBuffer
+from Writers import CSVWriter
+from XMLBackend import get_backend
+
+DEFAULT_OUTPUT = os.path.join('benchmarks', 'results', 'latest.json')
+
+
+class StageTimer:
+    """Runs each stage repeat times and keeps the wall times."""
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = {}
+
+    def measure(self, name, run, setup=None, files=0, records=0, size=0):
+        seconds = []
+        for _ in range(self.repeat):
+            state = setup() if setup else None
+            start = time.perf_counter()
+            run(state)
+            seconds.append(time.perf_counter() - start)
+        median = statistics.median(seconds)
+        self.results[name] = {
+            'seconds': median,
+            'min_seconds': min(seconds),
+            'runs': seconds,
+            'files': files,
+            'records': records,
+            'bytes': size,
+            'records_per_second': records / median if median else None,
+        }
+        print('%-28s %10.4fs  %s' % (name, median, '%8.0f records/s' % (records / median) if records and median else ''),
+              file=sys.stderr)
+
+
+def load(paths):
+    """Reads the corpus into memory, so disk speed doesn't count."""
+    files = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            files.append(NamedBuffer(file.read(), os.path.basename(path)))
+    return files
+
+
+def rewound(files):
+    for file in files:
+        file.seek(0)
+    return files
+
+
+def record_elements(root, tag):
+    return [root] if root.tag == tag else list(root.iter(tag))
+
+
+def write_csv(rows, output_dir, name):
+    writer = CSVWriter(os.path.join(output_dir, name + '.csv'))
+    for row in rows:
+        writer.write(row)
+    return writer.close()
+
+
+def time_streaming_parser(timer, label, parser, record_tag, files, output_dir):
+    """MODS and MARC: whole-tree XML parse, field extraction, CSV writing, and
+    batch_parse_xml end to end."""
+    size = sum(len(file.getbuffer()) for file in files)
+    roots = [get_backend().parse(file) for file in rewound(files)]
+    count = sum(len(record_elements(root, record_tag)) for root in roots)
+    rows = []
+
+    def extract(roots):
+        rows.clear()
+        for file, root in zip(files, roots):
+            name = file.name if root.tag == record_tag else None
+            rows.extend(parser.parse_root(element, name) for element in record_elements(root, record_tag))
+
+    timer.measure(label + '.xml_parse', lambda _: [get_backend().parse(file) for file in rewound(files)],
+                  files=len(files), records=count, size=size)
+    timer.measure(label + '.extract', extract,
+                  setup=lambda: [get_backend().parse(file) for file in rewound(files)],
+                  files=len(files), records=count, size=size)
+    timer.measure(label + '.write_csv', lambda _: write_csv(rows, output_dir, label),
+                  files=len(files), records=count, size=size)
+    timer.measure(label + '.batch_parse_xml', lambda _: parser.batch_parse_xml(rewound(files), show_progress=False),
+                  files=len(files), records=count, size=size)
+
+
+def fresh_lookups(parser, stub):
+    # every run starts cold: no NLP results or URLs remembered from the last
+    from NLPCache import NLPCache
+    from SearchWorksClient import SearchWorksClient
+    parser.nlp_cache = NLPCache()
+    parser.searchworks = SearchWorksClient(base_url=stub.url)
+
+
+def time_finding_aids(timer, parser, files, stub, output_dir):
+    """Finding aids: the three phases of batch_parse_xml one at a time, CSV
+    writing, and batch_parse_xml end to end, phased and pipelined."""
+    size = sum(len(file.getbuffer()) for file in files)
+    count = len(files)
+    roots = []
+    records = []
+    finished = []
+
+    def read(_):
+        roots[:] = [parser.read_root(file) for file in rewound(files)]
+
+    def extract(_):
+        records[:] = [parser.extract_fields(root, file.name) for file, root in zip(files, roots)]
+
+    def nlp(_):
+        finished[:] = parser.batch_nlp(records)
+
+    def lookup(_):
+        parser.searchworks.lookup_many([record.label for record in finished])
+
+    timer.measure('ead.read_root', read, files=count, records=count, size=size)
+    timer.measure('ead.extract', extract, files=count, records=count, size=size)
+    timer.measure('ead.nlp', nlp, setup=lambda: fresh_lookups(parser, stub), files=count, records=count, size=size)
+    timer.measure('ead.lookup', lookup, setup=lambda: fresh_lookups(parser, stub), files=count, records=count, size=size)
+    timer.measure('ead.write_csv', lambda _: write_csv(finished, output_dir, 'ead'), files=count, records=count, size=size)
+    timer.measure('ead.batch_parse_xml', lambda _: parser.batch_parse_xml(rewound(files), show_progress=False),
+                  setup=lambda: fresh_lookups(parser, stub), files=count, records=count, size=size)
+
+    def pipelined(_):
+        parser.pipelined = True
+        try:
+            parser.batch_parse_xml(rewound(files), show_progress=False)
+        finally:
+            parser.pipelined = False
+
+    timer.measure('ead.batch_parse_xml_pipelined', pipelined,
+                  setup=lambda: fresh_lookups(parser, stub), files=count, records=count, size=size)
+
+
+def time_parser(timer, parser, files, stub, output_dir):
+    size = sum(len(file.getbuffer()) for file in files)
+
+    def parse_to_files(_):
+        parser.parse_to_files(rewound(files), os.path.join(output_dir, 'parser'))
+
+    timer.measure('parser.classify', lambda _: parser.classify(rewound(files)), files=len(files), size=size)
+    timer.measure('parser.parse_to_files', parse_to_files,
+                  setup=lambda: fresh_lookups(parser.finding_aid_parser, stub), files=len(files), size=size)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--output', default=DEFAULT_OUTPUT, help="results file (default %s)" % DEFAULT_OUTPUT)
+    arg_parser.add_argument('--repeat', type=int, default=3, help="runs per stage; the median is reported")
+    arg_parser.add_argument('--corpus-dir', default=None, help="keep the generated corpus here instead of a temp dir")
+    arg_parser.add_argument('--model', default=None, help="spaCy model directory (default ./models/en/)")
+    arg_parser.add_argument('--latency', type=float, default=0.02, help="seconds the stand-in SearchWorks takes per lookup")
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    config = config_from_args(args)
+    work_dir = tempfile.mkdtemp(prefix='parser-benchmark-')
+    corpus_dir = args.corpus_dir or os.path.join(work_dir, 'corpus')
+    output_dir = os.path.join(work_dir, 'output')
+    os.makedirs(output_dir)
+    timer = StageTimer(args.repeat)
+    skipped = []
+
+    try:
+        paths = generate(corpus_dir, config)
+        files = load(paths)
+        ead_files = [f for f in files if f.name.startswith('ARS-')]
+        mods_files = [f for f in files if f.name.startswith(('druid_', 'mods-'))]
+        marc_files = [f for f in files if f.name.startswith(('a', 'marc-'))]
+
+        mods_parser = MODSParser()
+        marc_parser = MARCParser()
+        time_streaming_parser(timer, 'mods', mods_parser, mods_parser.namespace + 'mods', mods_files, output_dir)
+        time_streaming_parser(timer, 'marc', marc_parser, marc_parser.namespace + 'record', marc_files, output_dir)
+
+        with StubSearchWorks(latency=args.latency) as stub:
+            try:
+                from ModelCache import DEFAULT_MODEL_PATH
+                from Parser import Parser
+            except ImportError as error:
+                skipped.append('ead and parser stages: %s' % error)
+            else:
+                parser = Parser(show_progress=False, model_path=args.model or DEFAULT_MODEL_PATH, lookup_cache_path=None)
+                if ead_files:
+                    time_finding_aids(timer, parser.finding_aid_parser, ead_files, stub, output_dir)
+                time_parser(timer, parser, files, stub, output_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'xml_backend': get_backend().name,
+            'searchworks_latency': args.latency,
+            'corpus': config.as_dict(),
+            'skipped': skipped,
+        },
+        'stages': timer.results,
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    for reason in skipped:
+        print('skipped %s' % reason, file=sys.stderr)
+    print(args.output)
+
+
+if __name__ == '__main__':
+    main()
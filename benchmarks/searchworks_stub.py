@@ -0,0 +1,71 @@
+"""
+A local stand-in for the SearchWorks JSON endpoint, so benchmarks don't depend
+on (or hammer) the real catalogue. Answers ?q=<title>&format=json with one
+finding aid URL, or no docs for a fixed share of titles, after an optional
+delay.
+
+    with StubSearchWorks(latency=0.05) as stub:
+        client = SearchWorksClient(base_url=stub.url)
+"""
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubSearchWorks:
+    def __init__(self, latency=0.0, miss_rate=0.2, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.miss_rate = miss_rate
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+                body = json.dumps(stub.answer(query)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def answer(self, query):
+        # the same title always gets the same answer
+        digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+        if int(digest[:8], 16) / 0xffffffff < self.miss_rate:
+            return {'response': {'docs': []}}
+        return {'response': {'docs': [{'url_suppl': ['https://oac.cdlib.org/findaid/ark:/13030/%s' % digest[:10]]}]}}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
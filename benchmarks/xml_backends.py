@@ -0,0 +1,153 @@
+"""
+Runs the MODS, MARC and finding aid parsers over one synthetic corpus (see
+benchmarks.corpus) with every available XML backend, checks that they all
+produce the same rows, and times them side by side. Exits with status 1 if
+any backend's rows differ from ElementTree's, so it doubles as the
+conformance check for XMLBackend.
+
+    python -m benchmarks.xml_backends --output benchmarks/results/xml_backends.json --mods 2000 --marc 2000
+
+Finding aids are compared up to extract_fields, the last step before NLP and
+SearchWorks, and only when spaCy can be imported. Results are saved in the
+benchmarks.run format with stages named <stage>[<backend>].
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from benchmarks.corpus import add_arguments, config_from_args, generate
+from benchmarks.run import StageTimer, load, rewound
+from MARCParser import MARCParser
+from MODSParser import MODSParser
+from Records import as_dict
+from XMLBackend import available_backends, get_backend
+
+DEFAULT_OUTPUT = os.path.join('benchmarks', 'results', 'xml_backends.json')
+REFERENCE = 'etree'
+
+
+def streaming_rows(parser, files):
+    return [as_dict(row) for file in rewound(files) for row in parser.parse_rows(file)]
+
+
+def finding_aid_rows(parser, files):
+    return [as_dict(parser.extract_fields(parser.read_root(file), file.name)) for file in rewound(files)]
+
+
+def first_difference(expected, actual):
+    if len(expected) != len(actual):
+        return '%d rows instead of %d' % (len(actual), len(expected))
+    for index, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            columns = [column for column in want if want[column] != got.get(column)]
+            return 'row %d differs in %s: %r != %r' % (
+                index, ', '.join(columns), {c: got.get(c) for c in columns}, {c: want[c] for c in columns})
+    return None
+
+
+def time_backend(timer, backend, kind, parser, files, rows):
+    size = sum(len(file.getbuffer()) for file in files)
+    count = len(rows)
+    timer.measure('%s.xml_parse[%s]' % (kind, backend.name),
+                  lambda _: [backend.parse(file) for file in rewound(files)],
+                  files=len(files), records=count, size=size)
+    if kind == 'ead':
+        timer.measure('ead.read_root[%s]' % backend.name,
+                      lambda _: [parser.read_root(file) for file in rewound(files)],
+                      files=len(files), records=count, size=size)
+        timer.measure('ead.extract_fields[%s]' % backend.name, lambda _: finding_aid_rows(parser, files),
+                      files=len(files), records=count, size=size)
+    else:
+        timer.measure('%s.parse_rows[%s]' % (kind, backend.name), lambda _: streaming_rows(parser, files),
+                      files=len(files), records=count, size=size)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--output', default=DEFAULT_OUTPUT, help="results file (default %s)" % DEFAULT_OUTPUT)
+    arg_parser.add_argument('--repeat', type=int, default=3, help="runs per stage; the median is reported")
+    arg_parser.add_argument('--corpus-dir', default=None, help="keep the generated corpus here instead of a temp dir")
+    arg_parser.add_argument('--model', default=None, help="spaCy model directory (default ./models/en/)")
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    config = config_from_args(args)
+    work_dir = tempfile.mkdtemp(prefix='xml-backend-benchmark-')
+    corpus_dir = args.corpus_dir or os.path.join(work_dir, 'corpus')
+    timer = StageTimer(args.repeat)
+    backends = [get_backend(name) for name in available_backends()]
+    skipped = []
+    mismatches = []
+    if len(backends) < 2:
+        skipped.append('lxml is not installed, so there is nothing to compare ElementTree with')
+
+    try:
+        files = load(generate(corpus_dir, config))
+        kinds = [
+            ('mods', MODSParser, streaming_rows, [f for f in files if f.name.startswith(('druid_', 'mods-'))]),
+            ('marc', MARCParser, streaming_rows, [f for f in files if f.name.startswith(('a', 'marc-'))]),
+        ]
+        ead_files = [f for f in files if f.name.startswith('ARS-')]
+        if ead_files:
+            try:
+                from FindingAidParser import FindingAidParser
+                from ModelCache import DEFAULT_MODEL_PATH
+            except ImportError as error:
+                skipped.append('finding aids: %s' % error)
+            else:
+                model_path = args.model or DEFAULT_MODEL_PATH
+                kinds.append(('ead', lambda xml_backend: FindingAidParser(model_path=model_path, xml_backend=xml_backend),
+                              finding_aid_rows, ead_files))
+
+        for kind, make_parser, parse_all, kind_files in kinds:
+            if not kind_files:
+                continue
+            reference = None
+            for backend in backends:
+                parser = make_parser(xml_backend=backend.name)
+                rows = parse_all(parser, kind_files)
+                if backend.name == REFERENCE:
+                    reference = rows
+                else:
+                    difference = first_difference(reference, rows)
+                    if difference:
+                        mismatches.append('%s under %s: %s' % (kind, backend.name, difference))
+                time_backend(timer, backend, kind, parser, kind_files, rows)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'backends': [backend.name for backend in backends],
+            'corpus': config.as_dict(),
+            'skipped': skipped,
+            'mismatches': mismatches,
+        },
+        'stages': timer.results,
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    for reason in skipped:
+        print('skipped %s' % reason, file=sys.stderr)
+    for mismatch in mismatches:
+        print('MISMATCH %s' % mismatch, file=sys.stderr)
+    print(args.output)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
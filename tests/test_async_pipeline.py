@@ -0,0 +1,83 @@
+"""
+The pipelined finding aid path (AsyncPipeline) must write the same rows, in
+the same order, as the phased one, look each title up only once, and record
+the same metrics stages. Needs spaCy and the model; lookups go to the local
+stand-in in benchmarks.searchworks_stub.
+"""
+
+import pytest
+
+pytest.importorskip('spacy')
+pytest.importorskip('requests')
+
+from benchmarks.corpus import CorpusConfig, generate
+from benchmarks.run import load, rewound
+from benchmarks.searchworks_stub import StubSearchWorks
+from FindingAidParser import FindingAidParser
+from InputFiles import NamedBuffer
+from Metrics import metrics
+from NLPCache import NLPCache
+from Records import as_dict
+from SearchWorksClient import SearchWorksClient
+from Writers import RowWriter
+
+
+class ListWriter(RowWriter):
+    def __init__(self):
+        self.rows = []
+        self.files = []
+
+    def write(self, row):
+        self.rows.append(as_dict(row))
+
+    def file_done(self, file):
+        self.files.append(file.name)
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    files = load(generate(str(tmp_path_factory.mktemp('corpus')), CorpusConfig(ead=12, mods=0, marc=0, seed=22)))
+    # copies share their original's title, and so its lookup
+    return files + [NamedBuffer(file.getvalue(), 'copy-' + file.name) for file in files[:4]]
+
+
+@pytest.fixture(scope='module')
+def stub():
+    with StubSearchWorks() as stub:
+        yield stub
+
+
+def parse(files, stub, pipelined):
+    parser = FindingAidParser(
+        searchworks=SearchWorksClient(base_url=stub.url), nlp_cache=NLPCache(), pipelined=pipelined)
+    writer = ListWriter()
+    stub.requests = 0
+    parser.batch_parse_xml(rewound(files), chunk_size=5, batch_size=4, writer=writer)
+    return writer
+
+
+def test_pipelined_rows_match_phased(files, stub):
+    phased = parse(files, stub, pipelined=False)
+    pipelined = parse(files, stub, pipelined=True)
+    assert pipelined.files == phased.files == [file.name for file in files]
+    assert pipelined.rows == phased.rows
+    assert any(row['url'] for row in pipelined.rows)
+
+
+def test_pipelined_looks_each_title_up_once(files, stub):
+    writer = parse(files, stub, pipelined=True)
+    assert stub.requests == len({row['label'] for row in writer.rows}) < len(files)
+
+
+def test_pipelined_records_stages(files, stub):
+    enabled = metrics.enabled
+    metrics.enable()
+    metrics.reset()
+    try:
+        parse(files, stub, pipelined=True)
+        stages = metrics.report()['stages']
+    finally:
+        metrics.enabled = enabled
+        metrics.reset()
+    assert stages['ead.file']['items'] == len(files)
+    assert stages['ead.lookup']['calls'] == stub.requests
@@ -0,0 +1,26 @@
+"""
+compile_specs must refuse specs that could never match, rather than leave
+their columns silently empty.
+"""
+
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from FieldSpecs import FieldSpec, compile_specs
+
+NS = '{urn:example}'
+
+
+def test_star_path_is_rejected():
+    with pytest.raises(ValueError, match="'\\*' is only for child"):
+        compile_specs([FieldSpec('all', '*'), FieldSpec('title', 'title')], NS)
+    with pytest.raises(ValueError):
+        compile_specs([FieldSpec('typed', '*[@type="uniform"]')], NS)
+
+
+def test_star_child_reads_every_child():
+    root = ElementTree.fromstring(
+        '<record xmlns="urn:example"><titleInfo><title>Rag</title><subTitle>for piano</subTitle></titleInfo></record>')
+    extractor = compile_specs([FieldSpec('title', 'titleInfo', '*', select='join')], NS)
+    assert extractor.extract(root) == {'title': 'Rag for piano'}
@@ -0,0 +1,149 @@
+"""
+MARCParser against randomised records. Each record is built from plain Python
+data and the expected row is worked out from that data, following the rules
+the getters have always had: a column reads the last matching subfield of the
+first matching datafield, roll_type the second 500, arrangers and
+instrumentalists come from the last 700 whose subfields mention the role,
+falling back to the composer when 100$e does.
+"""
+
+import random
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from InputFiles import NamedBuffer
+from MARCParser import MARCParser
+from Records import as_dict
+from XMLBackend import available_backends
+
+NS = 'http://www.loc.gov/MARC21/slim'
+
+# subfield text -> the text reversed as a name ('Last, First,' -> 'First Last')
+NAMES = {
+    'Smith, John,': 'John Smith',
+    'Doe, Jane': 'Jane Doe',
+    'Joplin, Scott,': 'Scott Joplin',
+    'Ampico': 'Ampico',
+}
+TEXTS = list(NAMES) + ['Roll 1', 'Piano', 'Welte-Mignon,', ' 88-note ', 'arranger', 'Instrumentalist', 'performer']
+TAGS = ['100', '245', '264', '300', '028', '500', '510', '690', '700', '700', '650']
+DATES = {
+    '850101s1925    xx': '1925',
+    '850101q19251930xx': '1925, 1930',
+    '850101s19u-': '19u-',
+    'short': '',
+}
+
+
+def random_record(rng):
+    record = {
+        'fields': [
+            (rng.choice(TAGS), [(rng.choice('abce4'), rng.choice(TEXTS)) for _ in range(rng.randint(1, 4))])
+            for _ in range(rng.randint(0, 30))],
+        'date': rng.choice(list(DATES) + [None]),
+        'control_number': rng.choice([' a123 ', None]),
+        'system_number': rng.choice(['(OCoLC)9 ', None]),
+    }
+    rng.shuffle(record['fields'])
+    return record
+
+
+def to_element(record):
+    root = ElementTree.Element('{%s}record' % NS)
+    if record['control_number'] is not None:
+        ElementTree.SubElement(root, '{%s}controlfield' % NS, tag='001').text = record['control_number']
+    if record['date'] is not None:
+        ElementTree.SubElement(root, '{%s}controlfield' % NS, tag='008').text = record['date']
+    if record['system_number'] is not None:
+        field = ElementTree.SubElement(root, '{%s}datafield' % NS, tag='035')
+        ElementTree.SubElement(field, '{%s}subfield' % NS, code='a').text = record['system_number']
+    for tag, subfields in record['fields']:
+        field = ElementTree.SubElement(root, '{%s}datafield' % NS, tag=tag)
+        for code, text in subfields:
+            ElementTree.SubElement(field, '{%s}subfield' % NS, code=code).text = text
+    return root
+
+
+def subfield(record, tag, code, occurrence=0):
+    fields = [subfields for field_tag, subfields in record['fields'] if field_tag == tag]
+    if len(fields) <= occurrence:
+        return ''
+    texts = [text for field_code, text in fields[occurrence] if field_code == code]
+    return texts[-1] if texts else ''
+
+
+def reversed_name(text):
+    return NAMES.get(text, text.strip(',').strip())
+
+
+def role(record, wanted):
+    found = ''
+    for tag, subfields in record['fields']:
+        if tag == '700' and any(wanted in text.lower() for code, text in subfields):
+            found = reversed_name(subfields[0][1])
+    if not found and any(wanted in text.lower() for text in composer_roles(record)):
+        found = expected_composer(record)
+    return found
+
+
+def composer_roles(record):
+    fields = [subfields for tag, subfields in record['fields'] if tag == '100']
+    return [text for code, text in fields[0] if code == 'e'] if fields else []
+
+
+def expected_composer(record):
+    composer = subfield(record, '100', 'a')
+    return reversed_name(composer) if composer else ''
+
+
+def expected_row(record, identifier):
+    return {
+        'title': subfield(record, '245', 'a'),
+        'subtitle': subfield(record, '245', 'b'),
+        'composer': expected_composer(record),
+        'arranger': role(record, 'arranger'),
+        'instrumentalist': role(record, 'instrumentalist'),
+        'publisher': subfield(record, '264', 'b').strip(','),
+        'size': subfield(record, '300', 'c'),
+        'catalog_number': subfield(record, '028', 'a'),
+        'date': DATES[record['date']] if record['date'] is not None else '',
+        'identifier': identifier,
+        'collection': subfield(record, '690', 'a').strip(),
+        'citation_a': subfield(record, '510', 'a'),
+        'citation_c': subfield(record, '510', 'c'),
+        'roll_type': subfield(record, '500', 'a', occurrence=1),
+    }
+
+
+def record_identifier(record):
+    # records in a collection have no file name of their own
+    if record['control_number'] is not None:
+        return record['control_number'].strip()
+    return (record['system_number'] or '').strip()
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('seed', range(5))
+def test_collection_rows(backend, seed):
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(200)]
+    collection = ElementTree.Element('{%s}collection' % NS)
+    collection.extend(to_element(record) for record in records)
+    file = NamedBuffer(ElementTree.tostring(collection), 'marc-collection.xml')
+
+    rows = [as_dict(row) for row in MARCParser(xml_backend=backend).parse_rows(file)]
+
+    assert rows == [expected_row(record, record_identifier(record)) for record in records]
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_single_record_is_identified_by_file_name(backend):
+    record = random_record(random.Random(7))
+    file = NamedBuffer(ElementTree.tostring(to_element(record)), 'a12345678.xml')
+
+    parser = MARCParser(xml_backend=backend)
+
+    assert as_dict(parser.parse_xml(file)) == expected_row(record, '12345678')
+    file.seek(0)
+    assert [as_dict(row) for row in parser.parse_rows(file)] == [expected_row(record, '12345678')]
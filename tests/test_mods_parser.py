@@ -0,0 +1,149 @@
+"""
+MODSParser against randomised records. Each record is built from plain Python
+data and the expected row is worked out from that data, following the rules
+the getters have always had: titles and dates come from the first titleInfo
+and originInfo, the composer from the first primary name, each role from the
+first name holding it, and records in a collection are identified by their
+druid or record identifier.
+"""
+
+import random
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from InputFiles import NamedBuffer
+from MODSParser import MODSParser
+from Records import as_dict
+from XMLBackend import available_backends
+
+NS = 'http://www.loc.gov/mods/v3'
+
+SURNAMES = ['Smith', 'Joplin', 'Gershwin', 'Nakamura', 'Okafor']
+FORENAMES = ['Clara', 'Scott', 'George', 'Yuki', 'Chidi']
+ROLES = ['arranger', 'Arranger', 'instrumentalist', 'INSTRUMENTALIST', 'composer', 'performer', 'arranger.']
+
+
+def random_record(rng):
+    names = []
+    for _ in range(rng.randint(0, 6)):
+        names.append({
+            'surname': rng.choice(SURNAMES),
+            'forename': rng.choice(FORENAMES),
+            'role': rng.choice(ROLES + [None]),
+            'primary': rng.random() < 0.3,
+        })
+    return {
+        'title': rng.choice(['Maple leaf rag', 'Rhapsody in blue', 'Waltz']),
+        'subtitle': rng.choice(['for piano', 'fox trot', None]),
+        'uniform_title': rng.choice(['Rhapsody', None]),
+        'names': names,
+        'publication': rng.random() < 0.8,
+        'publisher': rng.choice(['QRS', 'Ampico', None]),
+        'dates': rng.sample(['1920', '1921', '[ca. 1925]'], rng.randint(0, 3)),
+        'extent': rng.choice(['1 roll', None]),
+        'notes': [rng.choice([None, 'performers', 'statement of responsibility'])
+                  for _ in range(rng.randint(0, 4))],
+        'druid': rng.choice(['bb123cd4567', None]),
+        'druid_as_type': rng.random() < 0.5,
+        'record_identifier': rng.choice([' a9876543 ', None]),
+    }
+
+
+def element(parent, tag, text=None, **attributes):
+    child = ElementTree.SubElement(parent, '{%s}%s' % (NS, tag), **attributes)
+    child.text = text
+    return child
+
+
+def to_element(record, parent=None):
+    mods = ElementTree.Element('{%s}mods' % NS) if parent is None else element(parent, 'mods')
+    title_info = element(mods, 'titleInfo')
+    element(title_info, 'title', record['title'])
+    if record['subtitle']:
+        element(title_info, 'subTitle', record['subtitle'])
+    if record['uniform_title']:
+        element(element(mods, 'titleInfo', type='uniform'), 'title', record['uniform_title'])
+    for name in record['names']:
+        name_element = element(mods, 'name', **({'usage': 'primary'} if name['primary'] else {}))
+        element(name_element, 'namePart', '%s, %s' % (name['surname'], name['forename']))
+        if name['role']:
+            element(element(name_element, 'role'), 'roleTerm', name['role'], type='text')
+    origin = element(mods, 'originInfo', **({'eventType': 'publication'} if record['publication'] else {}))
+    if record['publisher']:
+        element(origin, 'publisher', record['publisher'])
+    for date in record['dates']:
+        element(origin, 'dateIssued', date)
+    if record['extent']:
+        element(element(mods, 'physicalDescription'), 'extent', record['extent'])
+    for index, note_type in enumerate(record['notes']):
+        element(mods, 'note', 'note %d' % index, **({'type': note_type} if note_type else {}))
+    if record['druid']:
+        if record['druid_as_type']:
+            element(mods, 'identifier', record['druid'], type='druid')
+        else:
+            element(mods, 'identifier', 'druid:' + record['druid'], type='local')
+    if record['record_identifier']:
+        element(element(mods, 'recordInfo'), 'recordIdentifier', record['record_identifier'], source='SIRSI')
+    return mods
+
+
+def first_with_role(record, role):
+    for name in record['names']:
+        if (name['role'] or '').lower() == role:
+            return '%s %s' % (name['forename'], name['surname'])
+    return ''
+
+
+def expected_row(record, identifier):
+    primary = [name for name in record['names'] if name['primary']]
+    performers = ['note %d' % index for index, note_type in enumerate(record['notes']) if note_type == 'performers']
+    return {
+        'title': ' '.join(filter(None, [record['title'], record['subtitle']])),
+        'uniform_title': record['uniform_title'] or '',
+        'subtitle': record['subtitle'] or '',
+        'composer': '%s %s' % (primary[0]['forename'], primary[0]['surname']) if primary else '',
+        'arranger': first_with_role(record, 'arranger'),
+        'instrumentalist': first_with_role(record, 'instrumentalist'),
+        'performer': performers[-1] if performers else '',
+        'publisher': (record['publisher'] or '') if record['publication'] else '',
+        'extent': record['extent'] or '',
+        'date_issued': ', '.join(record['dates']),
+        'identifier': identifier,
+    }
+
+
+def record_identifier(record):
+    # records in a collection have no druid_ file name of their own
+    return record['druid'] or (record['record_identifier'] or '').strip()
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('indent', [False, True])
+def test_collection_rows(backend, seed, indent):
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(200)]
+    collection = ElementTree.Element('{%s}modsCollection' % NS)
+    for record in records:
+        to_element(record, collection)
+    if indent:
+        # whitespace between elements mustn't leak into any column
+        ElementTree.indent(collection)
+    file = NamedBuffer(ElementTree.tostring(collection), 'mods-collection.xml')
+
+    rows = [as_dict(row) for row in MODSParser(xml_backend=backend).parse_rows(file)]
+
+    assert rows == [expected_row(record, record_identifier(record)) for record in records]
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_single_record_is_identified_by_file_name(backend):
+    record = random_record(random.Random(7))
+    file = NamedBuffer(ElementTree.tostring(to_element(record)), 'druid_zz999yy8888.xml')
+
+    parser = MODSParser(xml_backend=backend)
+
+    assert as_dict(parser.parse_xml(file)) == expected_row(record, 'zz999yy8888')
+    file.seek(0)
+    assert [as_dict(row) for row in parser.parse_rows(file)] == [expected_row(record, 'zz999yy8888')]
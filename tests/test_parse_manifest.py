@@ -0,0 +1,87 @@
+"""
+Parsing the same files twice with a ParseManifest: the second run must skip
+every file whose rows are settled, finding aids included, and write the same
+rows as the first. Only finding aids whose SearchWorks lookup failed are
+parsed again. Needs spaCy and the model; lookups go to the local stand-in in
+benchmarks.searchworks_stub.
+"""
+
+import socket
+
+import pytest
+
+pytest.importorskip('spacy')
+pytest.importorskip('requests')
+
+from benchmarks.corpus import CorpusConfig, generate
+from benchmarks.run import load, rewound
+from benchmarks.searchworks_stub import StubSearchWorks
+from LookupCache import LookupCache
+from ParseManifest import ParseManifest
+from Parser import Parser
+from SearchWorksClient import SearchWorksClient
+
+EAD_FILES = 6
+
+
+def unused_url():
+    # nothing listens here once the socket is closed
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    config = CorpusConfig(ead=EAD_FILES, mods=6, marc=6, seed=31)
+    return load(generate(str(tmp_path_factory.mktemp('corpus')), config))
+
+
+@pytest.fixture(scope='module')
+def parser():
+    return Parser(show_progress=False, lookup_cache_path=None)
+
+
+def parse(parser, files, manifest_path):
+    manifest = ParseManifest(manifest_path)
+    try:
+        res = parser.parse_files(rewound(files), manifest=manifest)
+    finally:
+        manifest.close()
+    return [(label, dict(columns)) for label, columns in res], manifest
+
+
+def parse_twice(parser, files, tmp_path, searchworks):
+    parser.finding_aid_parser.searchworks = searchworks
+    first, _ = parse(parser, files, str(tmp_path / 'manifest.sqlite'))
+    second, manifest = parse(parser, files, str(tmp_path / 'manifest.sqlite'))
+    assert second == first
+    return first, manifest
+
+
+def urls(res):
+    return dict(res)['Finding aids']['url']
+
+
+def test_offline_finding_aids_are_skipped(parser, files, tmp_path):
+    res, manifest = parse_twice(parser, files, tmp_path, SearchWorksClient(offline=True))
+    assert urls(res) == [''] * EAD_FILES
+    assert (manifest.hits, manifest.misses) == (len(files), 0)
+
+
+def test_finding_aids_without_a_match_are_skipped(parser, files, tmp_path):
+    cache = LookupCache(path=str(tmp_path / 'searchworks.sqlite'))
+    with StubSearchWorks(miss_rate=0.5) as stub:
+        res, manifest = parse_twice(parser, files, tmp_path, SearchWorksClient(base_url=stub.url, cache=cache))
+    cache.close()
+    assert '' in urls(res) and any(urls(res))
+    assert (manifest.hits, manifest.misses) == (len(files), 0)
+
+
+def test_finding_aids_whose_lookup_failed_are_parsed_again(parser, files, tmp_path):
+    cache = LookupCache(path=str(tmp_path / 'searchworks.sqlite'))
+    client = SearchWorksClient(base_url=unused_url(), retries=0, cache=cache)
+    res, manifest = parse_twice(parser, files, tmp_path, client)
+    cache.close()
+    assert urls(res) == [''] * EAD_FILES
+    assert (manifest.hits, manifest.misses) == (len(files) - EAD_FILES, EAD_FILES)
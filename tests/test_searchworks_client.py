@@ -0,0 +1,89 @@
+"""
+SearchWorksClient against the local stand-in in benchmarks.searchworks_stub:
+answers and misses, order and de-duplication in lookup_many, caching of real
+answers only, offline mode, and rebuilding the session after pickling.
+"""
+
+import pickle
+import socket
+
+import pytest
+
+pytest.importorskip('requests')
+
+from benchmarks.searchworks_stub import StubSearchWorks
+from LookupCache import LookupCache
+from SearchWorksClient import SearchWorksClient
+
+LABELS = ['Piano rolls', 'Ampico recordings', 'Welte-Mignon', 'Piano rolls', 'QRS rolls']
+
+
+def expected_url(stub, label):
+    docs = stub.answer(label)['response']['docs']
+    return docs[0]['url_suppl'][0] if docs else ''
+
+
+def unused_url():
+    # nothing listens here once the socket is closed
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+
+
+@pytest.fixture
+def stub():
+    with StubSearchWorks(miss_rate=0.4) as stub:
+        yield stub
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LookupCache(path=str(tmp_path / 'searchworks.sqlite'))
+    yield cache
+    cache.close()
+
+
+def test_lookup_returns_the_first_url_or_nothing(stub):
+    client = SearchWorksClient(base_url=stub.url)
+    urls = [client.lookup(label) for label in LABELS]
+    assert urls == [expected_url(stub, label) for label in LABELS]
+    assert any(urls) and not all(urls)
+
+
+def test_lookup_many_keeps_order_and_fetches_each_label_once(stub):
+    client = SearchWorksClient(base_url=stub.url, max_workers=3)
+    done = []
+    urls = client.lookup_many(LABELS, on_done=lambda: done.append(1))
+    assert urls == [expected_url(stub, label) for label in LABELS]
+    assert stub.requests == len(set(LABELS))
+    assert len(done) == len(LABELS)
+
+
+def test_answers_are_cached(stub, cache):
+    client = SearchWorksClient(base_url=stub.url, cache=cache)
+    first = client.lookup_many(LABELS)
+    requests = stub.requests
+    assert client.lookup_many(LABELS) == first
+    assert [client.lookup(label) for label in LABELS] == first
+    assert stub.requests == requests
+
+
+def test_failures_are_not_cached(cache):
+    client = SearchWorksClient(base_url=unused_url(), retries=0, cache=cache)
+    assert client.lookup('Piano rolls') == ''
+    assert client.lookup_many(['Piano rolls', 'QRS rolls']) == ['', '']
+    assert cache.get('Piano rolls') is None
+
+
+def test_offline_never_touches_the_network(stub, cache):
+    cache.put('Piano rolls', 'https://example.org/cached')
+    client = SearchWorksClient(base_url=stub.url, cache=cache, offline=True)
+    assert client.lookup_many(['Piano rolls', 'QRS rolls']) == ['https://example.org/cached', '']
+    assert stub.requests == 0
+
+
+def test_pickled_client_gets_a_new_session(stub):
+    client = SearchWorksClient(base_url=stub.url)
+    copy = pickle.loads(pickle.dumps(client))
+    assert copy.session is not client.session
+    assert copy.lookup('Piano rolls') == expected_url(stub, 'Piano rolls')
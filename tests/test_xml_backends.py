@@ -0,0 +1,66 @@
+"""
+Every XML backend must give the parsers the same rows as ElementTree. The
+MODS, MARC and finding aid parsers are run over one small synthetic corpus
+under each backend, reading both in-memory uploads and memory-mapped local
+files. Skipped when lxml isn't installed, since there is nothing to compare.
+"""
+
+import os
+
+import pytest
+
+from benchmarks.corpus import CorpusConfig, generate
+from benchmarks.run import load
+from benchmarks.xml_backends import REFERENCE, finding_aid_rows, first_difference, streaming_rows
+from InputFiles import open_local
+from MARCParser import MARCParser
+from MODSParser import MODSParser
+from XMLBackend import available_backends
+
+pytestmark = pytest.mark.skipif(
+    len(available_backends()) < 2,
+    reason="lxml is not installed (pip install -r requirements-extras.txt), so there is nothing to compare")
+
+OTHER_BACKENDS = [name for name in available_backends() if name != REFERENCE]
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    config = CorpusConfig(ead=4, mods=60, marc=60, mods_per_file=6, marc_per_file=6, seed=23)
+    return generate(str(tmp_path_factory.mktemp('corpus')), config)
+
+
+def open_files(paths, kind):
+    if kind == 'buffer':
+        return load(paths)
+    return [open_local(path, mmap_threshold=0) for path in paths]
+
+
+def of_kind(paths, prefixes):
+    return [path for path in paths if os.path.basename(path).startswith(prefixes)]
+
+
+@pytest.mark.parametrize('backend', OTHER_BACKENDS)
+@pytest.mark.parametrize('kind', ['buffer', 'mapped'])
+@pytest.mark.parametrize('parser_class, prefixes', [
+    (MODSParser, ('druid_', 'mods-')),
+    (MARCParser, ('a', 'marc-')),
+])
+def test_parse_rows_match(corpus, backend, kind, parser_class, prefixes):
+    paths = of_kind(corpus, prefixes)
+    assert paths
+    expected = streaming_rows(parser_class(xml_backend=REFERENCE), open_files(paths, kind))
+    actual = streaming_rows(parser_class(xml_backend=backend), open_files(paths, kind))
+    assert expected
+    assert first_difference(expected, actual) is None
+
+
+@pytest.mark.parametrize('backend', OTHER_BACKENDS)
+def test_extract_fields_match(corpus, backend):
+    pytest.importorskip('spacy')
+    from FindingAidParser import FindingAidParser
+    paths = of_kind(corpus, ('ARS-',))
+    expected = finding_aid_rows(FindingAidParser(xml_backend=REFERENCE), load(paths))
+    actual = finding_aid_rows(FindingAidParser(xml_backend=backend), load(paths))
+    assert len(expected) == len(paths)
+    assert first_difference(expected, actual) is None